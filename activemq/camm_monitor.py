@@ -10,6 +10,7 @@ import sys
 from sns_utilities.amq_connector.amq_consumer import Client, Listener
 from sns_utilities.daemon import Daemon
 from configuration import Configuration
+from connection_pool import get_pool
 
 import logging
 
@@ -50,18 +51,15 @@ def send_status_info(instance_number, status, code=0):
         
     # Create a configuration object
     conf = Configuration()
-    # Setup the AMQ client
-    c = Client(conf.brokers, conf.amq_user, conf.amq_pwd)
-
-    # Send a simple message to the return queue
+    # Send a simple message to the return queue, on a pooled connection
     message = {'instance_number': instance_number,
                'user': str(getpass.getuser()),
                'timestamp': time.time(),
                'status': status,
                'code': code}
     
-    c.send(destination='/topic/SNS.CAMM.STATUS.JOBS', message=json.dumps(message))
-    c._disconnect()       
+    get_pool().send(conf.brokers, conf.amq_user, conf.amq_pwd,
+                    '/topic/SNS.CAMM.STATUS.JOBS', json.dumps(message))
         
     
 class CammListener(Listener):
@@ -19,6 +19,7 @@ class Configuration(configuration.Configuration):
     kepler_run_options = {}
     kepler_work_dir_flag = '-LocalWorkingDirectory'
     kepler_output_file_flag = '-OutputFile'
+    kepler_correlation_id_flag = '-CorrelationId'
     kepler_workflow = ''
     
     def __init__(self, config_file=DEFAULT_CONFIG):
@@ -58,5 +59,8 @@ class Configuration(configuration.Configuration):
 
                     if config.has_key('kepler_output_file_flag'):
                         self.kepler_output_file_flag = config['kepler_output_file_flag']
+
+                    if config.has_key('kepler_correlation_id_flag'):
+                        self.kepler_correlation_id_flag = config['kepler_correlation_id_flag']
             except:
                 logging.error("Could not read configuration file:\n  %s" % str(sys.exc_value))
@@ -0,0 +1,204 @@
+"""
+    Process-wide pool of ActiveMQ connections
+
+    Connections are keyed by broker list and user, opened once and reused
+    across sends and subscriptions. Subscriptions are recorded so that they
+    are restored when a lost connection is re-established. Connecting waits
+    for the broker's CONNECTED frame instead of sleeping, and failed
+    attempts are retried with exponential backoff. Connecting happens outside
+    the pool lock, so that senders on other connections, e.g. listeners on
+    the stomp receiver thread, are not blocked while a broker is down.
+"""
+import atexit
+import logging
+import threading
+import time
+
+import stomp
+
+def backoff(attempt, initial=0.1, maximum=30.0):
+    """
+        Waiting time before a retry
+        @param attempt: number of failed attempts so far, starting at zero
+        @param initial: waiting time after the first failure, in seconds
+        @param maximum: upper limit of the waiting time, in seconds
+    """
+    return min(maximum, initial * 2 ** attempt)
+
+class ConnectionPool(object):
+    """
+        Reusable, authenticated connections to the ActiveMQ brokers
+    """
+
+    def __init__(self, max_attempts=8):
+        """
+            @param max_attempts: number of connection attempts before giving up
+        """
+        self.max_attempts = max_attempts
+        self._lock = threading.RLock()
+        ## stomp.Connection objects, indexed by (brokers, user)
+        self._connections = {}
+        ## subscriptions to restore on reconnection, indexed by (brokers, user)
+        ## then by subscription ID
+        self._subscriptions = {}
+
+    def _key(self, brokers, user):
+        return (tuple([tuple(broker) for broker in brokers]), user)
+
+    def subscription_id(self, destination, name):
+        """
+            ID of the subscription of listener name to destination. Listeners
+            can subscribe to the same destination on a shared connection.
+        """
+        return "%s:%s" % (name, destination)
+
+    def _connect(self, brokers, user, passcode):
+        """
+            Open a connection, retrying with exponential backoff
+        """
+        attempt = 0
+        while True:
+            try:
+                logging.info("Connecting to ActiveMQ broker %s" % str(brokers))
+                conn = stomp.Connection(host_and_ports=brokers,
+                                        user=user,
+                                        passcode=passcode,
+                                        wait_on_receipt=True)
+                conn.start()
+                conn.connect(wait=True)
+                return conn
+            except Exception:
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise
+                logging.error("Could not connect to %s, attempt %d" % (str(brokers), attempt))
+                time.sleep(backoff(attempt - 1))
+
+    def get_connection(self, brokers, user, passcode):
+        """
+            Return a connected stomp.Connection, reusing an open one if possible
+            @param brokers: list of (host, port) pairs
+            @param user: ActiveMQ user name
+            @param passcode: ActiveMQ password
+        """
+        key = self._key(brokers, user)
+        self._lock.acquire()
+        try:
+            conn = self._connections.get(key)
+            if conn is not None and conn.is_connected():
+                return conn
+        finally:
+            self._lock.release()
+        new_conn = self._connect(brokers, user, passcode)
+        self._lock.acquire()
+        try:
+            conn = self._connections.get(key)
+            if conn is not None and conn.is_connected():
+                stale = new_conn # another thread connected meanwhile
+            else:
+                stale = conn
+                conn = self._connections[key] = new_conn
+                # Restore subscriptions lost with the previous connection
+                for sid, (destination, name, listener, ack, headers) in self._subscriptions.get(key, {}).items():
+                    conn.set_listener(name, listener)
+                    conn.subscribe(destination=destination, ack=ack, id=sid, headers=headers)
+        finally:
+            self._lock.release()
+        if stale is not None:
+            self._close(stale)
+        return conn
+
+    def send(self, brokers, user, passcode, destination, message, persistent='true', headers=None):
+        """
+            Send a message on a pooled connection
+            @param destination: name of the queue or topic
+            @param message: message content
+            @param headers: optional dictionary of additional message headers
+        """
+        conn = self.get_connection(brokers, user, passcode)
+        conn.send(destination=destination, message=message, persistent=persistent, headers=headers or {})
+
+    def subscribe(self, brokers, user, passcode, destination, name, listener, ack='auto', headers=None):
+        """
+            Subscribe a listener to a destination on a pooled connection
+            @param destination: name of the queue or topic
+            @param name: name of the listener on the connection
+            @param listener: stomp.ConnectionListener receiving the messages
+            @param ack: acknowledgement mode, 'auto' or 'client'
+            @param headers: optional dictionary of subscription headers, e.g. a selector
+        """
+        key = self._key(brokers, user)
+        self.get_connection(brokers, user, passcode) # connect outside the lock
+        self._lock.acquire()
+        try:
+            conn = self._connections[key]
+            sid = self.subscription_id(destination, name)
+            if sid in self._subscriptions.get(key, {}):
+                if conn.get_listener(name) is None:
+                    conn.set_listener(name, listener)
+                return conn
+            self._subscriptions.setdefault(key, {})[sid] = (destination, name, listener, ack, headers or {})
+            conn.set_listener(name, listener)
+            conn.subscribe(destination=destination, ack=ack, id=sid, headers=headers or {})
+            return conn
+        finally:
+            self._lock.release()
+
+    def unsubscribe(self, brokers, user, destination, name):
+        """
+            Remove a subscription. The connection stays open for reuse.
+            @param destination: name of the queue or topic
+            @param name: name of the listener on the connection
+        """
+        key = self._key(brokers, user)
+        self._lock.acquire()
+        try:
+            sid = self.subscription_id(destination, name)
+            subscription = self._subscriptions.get(key, {}).pop(sid, None)
+            conn = self._connections.get(key)
+            if subscription is None or conn is None or not conn.is_connected():
+                return
+            conn.unsubscribe(id=sid)
+            remaining = [x[1] for x in self._subscriptions[key].values()]
+            if name not in remaining and conn.get_listener(name) is not None:
+                conn.remove_listener(name)
+        finally:
+            self._lock.release()
+
+    def _close(self, conn):
+        try:
+            if conn.is_connected():
+                conn.disconnect()
+            conn.stop()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """
+            Disconnect all pooled connections
+        """
+        self._lock.acquire()
+        try:
+            for conn in self._connections.values():
+                self._close(conn)
+            self._connections = {}
+            self._subscriptions = {}
+        finally:
+            self._lock.release()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+        Return the process-wide connection pool
+    """
+    global _pool
+    _pool_lock.acquire()
+    try:
+        if _pool is None:
+            _pool = ConnectionPool()
+            atexit.register(_pool.close_all)
+        return _pool
+    finally:
+        _pool_lock.release()
@@ -9,9 +9,49 @@ import logging
 import argparse
 import threading
 import time
+import uuid
 
 from sns_utilities.amq_connector.amq_consumer import Client, Listener
 from configuration import Configuration
+from connection_pool import get_pool, backoff
+
+class EvaluationFuture(object):
+    """
+        Pending result of an evaluation submitted with DakotaClient.submit
+    """
+    
+    def __init__(self, correlation_id, output_file):
+        self.correlation_id = correlation_id
+        self.output_file = output_file
+        self.message = None
+        self._done = threading.Event()
+        
+    def set_result(self, message):
+        """
+            Resolve the evaluation
+            @param message: decoded results-ready message
+        """
+        self.message = message
+        self._done.set()
+        
+    def done(self):
+        """
+            True if the results-ready message was received
+        """
+        return self._done.is_set()
+        
+    def result(self, timeout=None):
+        """
+            Wait for the results-ready message and return the path of the results file
+            @param timeout: maximum waiting time, in seconds. Default is to wait forever
+        """
+        self._done.wait(timeout)
+        if not self._done.is_set():
+            raise RuntimeError("No results for %s after %s seconds" % (self.output_file, str(timeout)))
+        if 'error' in self.message:
+            raise RuntimeError("Evaluation of %s failed: %s" % (self.output_file, self.message['error']))
+        return self.output_file
+        
 
 class DakotaListener(Listener):
     """
@@ -25,9 +65,11 @@ class DakotaListener(Listener):
         super(DakotaListener, self).__init__(configuration)
         
         self._conf = configuration
-        self._connection = None
         self._complete = False
         self._transaction_complete = threading.Condition()
+        ## Evaluations in flight, indexed by correlation ID and by output file
+        self._pending = {}
+        self._pending_files = {}
         if results_ready_queue is not None:
             self.results_ready_queue = results_ready_queue
         else:
@@ -48,10 +90,21 @@ class DakotaListener(Listener):
                 
                 logging.info("Rcv: %s | Output file: %s" % (self.results_ready_queue, output_file))
                 
+                # Correlate by ID if the workflow echoed it, otherwise by output file
+                correlation_id = headers.get('correlation-id', data_dict.get('correlation_id'))
+                
                 self._transaction_complete.acquire()
+                future = self._pending.pop(correlation_id, None)
+                if future is None:
+                    future = self._pending_files.get(output_file)
+                if future is not None:
+                    self._pending.pop(future.correlation_id, None)
+                    self._pending_files.pop(future.output_file, None)
                 self._complete = True
-                self._transaction_complete.notify()
+                self._transaction_complete.notifyAll()
                 self._transaction_complete.release()
+                if future is not None:
+                    future.set_result(data_dict)
             except:
                 logging.error("Could not process JSON message")
                 logging.error(str(sys.exc_value))
@@ -60,48 +113,56 @@ class DakotaListener(Listener):
             if self.catalog_results_ready_queue is not None:
                 self.send(self.catalog_results_ready_queue, message)
 
-    def wait_on_transaction_complete(self):
+    def wait_on_transaction_complete(self, timeout=None):
         """
             Wait for the results ready message
+            @param timeout: maximum waiting time, in seconds. Default is to wait forever
+            @return: True if the message was received, False if timeout expired
         """
+        deadline = None if timeout is None else time.time() + timeout
         self._transaction_complete.acquire()
-        while not self._complete == True:
-            self._transaction_complete.wait()
+        try:
+            while not self._complete == True:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._transaction_complete.wait(remaining)
+            # Ready for the next results message
+            self._complete = False
+            return True
+        finally:
+            self._transaction_complete.release()
+        
+    def register(self, future):
+        """
+            Track an evaluation in flight, before its parameters are sent
+            @param future: EvaluationFuture object
+        """
+        self._transaction_complete.acquire()
+        self._pending[future.correlation_id] = future
+        self._pending_files[future.output_file] = future
         self._transaction_complete.release()
         
-    def _disconnect(self):
+    def unregister(self, future):
         """
-            Clean disconnect
+            Stop tracking an evaluation, e.g. failed to send or timed out
+            @param future: EvaluationFuture object
         """
-        if self._connection is not None and self._connection.is_connected():
-            self._connection.disconnect()
-        self._connection = None
-
-    def get_connection(self):
-        """
-            Establish and return a connection to ActiveMQ
-        """
-        logging.info("[Dakota Listener] Attempting to connect to ActiveMQ broker")
-        conn = stomp.Connection(host_and_ports=self._conf.brokers, 
-                                user=self._conf.amq_user,
-                                passcode=self._conf.amq_pwd, 
-                                wait_on_receipt=True)
-        conn.start()
-        conn.connect()
-        # Give the connection threads a little breather
-        time.sleep(0.5)
-        return conn
+        self._transaction_complete.acquire()
+        if self._pending.get(future.correlation_id) is future:
+            del self._pending[future.correlation_id]
+        if self._pending_files.get(future.output_file) is future:
+            del self._pending_files[future.output_file]
+        self._transaction_complete.release()
         
     def send(self, destination, message, persistent='true'):
         """
-            Send a message to a queue
+            Send a message to a queue, on a pooled connection
             @param destination: name of the queue
             @param message: message content
         """
-        if self._connection is None or not self._connection.is_connected():
-            self._disconnect()
-            self._connection = self.get_connection()
-        self._connection.send(destination=destination, message=message, persistent=persistent)
+        get_pool().send(self._conf.brokers, self._conf.amq_user, self._conf.amq_pwd,
+                        destination, message, persistent=persistent)
         
         
 class DakotaClient(Client):
@@ -119,6 +180,51 @@ class DakotaClient(Client):
     ## Output queue to announce results
     catalog_results_ready_queue = "CATALOG_RESULTS.READY"
     
+    def __init__(self, brokers, user, passcode, queues=None, consumer_name="dakota_consumer"):
+        super(DakotaClient, self).__init__(brokers, user, passcode, queues, consumer_name)
+        ## Connections are taken from the process-wide pool
+        self._credentials = (brokers, user, passcode)
+        self._subscribed_queues = queues or []
+        
+    def connect(self):
+        """
+            Subscribe the listener to the queues, on a pooled connection
+        """
+        pool = get_pool()
+        for queue in self._subscribed_queues:
+            pool.subscribe(*(self._credentials + (queue, self._consumer_name, self._listener)),
+                           headers=self.subscription_headers())
+        self._connection = pool.get_connection(*self._credentials)
+        
+    def subscription_headers(self):
+        """
+            Headers of the subscriptions to the results queues
+        """
+        return None
+        
+    def new_correlation_id(self):
+        """
+            Return a unique identifier for a new evaluation
+        """
+        return uuid.uuid4().hex
+        
+    def stop_listening(self):
+        """
+            Unsubscribe from the results queue. The pooled connection stays open.
+        """
+        logging.info("Unsubscribing to %s" % self.results_ready_queue)
+        get_pool().unsubscribe(self._credentials[0], self._credentials[1],
+                               self.results_ready_queue, self._consumer_name)
+        
+    def send(self, destination, message, persistent='true', headers=None):
+        """
+            Send a message to a queue, on a pooled connection
+            @param destination: name of the queue
+            @param message: message content
+            @param headers: optional dictionary of additional message headers
+        """
+        get_pool().send(*(self._credentials + (destination, message, persistent, headers)))
+        
     def set_results_ready_queue(self, queue):
         """ 
             Set the name of the queue to be used to 
@@ -146,29 +252,28 @@ class DakotaClient(Client):
         """
         self.working_directory = working_directory
         
-    def listen_and_wait(self, waiting_period=1.0):
+    def listen_and_wait(self, waiting_period=1.0, heartbeat=30.0):
         """
             Listen for the next message from the brokers.
-            @param waiting_period: sleep time between connection to a broker
+            Returns as soon as the results message is received.
+            @param waiting_period: unused, kept for backward compatibility
+            @param heartbeat: time between connection checks while waiting, in
+                              seconds. A lost connection is re-established with
+                              its subscriptions.
         """       
         listening = True
+        attempt = 0
         while(listening):
             try:
-                if self._connection is None or self._connection.is_connected() is False:
-                    self.connect()                
-                time.sleep(waiting_period)
+                self.connect()
                 
                 # Wait for the listening thread to receive the results message
-                self._listener.wait_on_transaction_complete()
+                while not self._listener.wait_on_transaction_complete(heartbeat):
+                    get_pool().get_connection(*self._credentials)
                 
                 # Once the results message has been received and dealt with,
                 # we can simply stop listening
-                logging.info("Unsubscribing to %s" % self.results_ready_queue)
-                self._connection.unsubscribe(destination=self.results_ready_queue)
-                if self._connection.get_listener(self._consumer_name) is not None:
-                    logging.info("Removing listener %s" % self._consumer_name)
-                    self._connection.remove_listener(self._consumer_name)
-                self._connection.stop()
+                self.stop_listening()
                 listening = False
             
             # Catch Ctrl-C for interactive running
@@ -177,32 +282,98 @@ class DakotaClient(Client):
             except:
                 logging.error("Problem connecting to AMQ broker")
                 logging.error("%s: %s" % (sys.exc_type,sys.exc_value))
-                time.sleep(5.0)
+                time.sleep(backoff(attempt))
+                attempt += 1
 
-    def params_ready(self, input_file, output_file):
+    def params_ready(self, input_file, output_file, correlation_id=None):
         """
             Send an ActiveMQ message announcing new
             parameters.
             @param input_file: parameters input file path
             @param output_file: results file to be created
+            @param correlation_id: identifier of the evaluation, sent as the
+                                   correlation-id header and in the message
         """
         if os.path.exists(input_file):
             try:
                 fd = open(input_file, 'r')
                 params = fd.read()
-                message = {'params': params,
-                           'output_file': output_file,
-                           'amq_results_queue': self.results_ready_queue,
-                           'working_directory': self.working_directory
-                           }
-                json_message = json.dumps(message)
-                self.send(self.params_ready_queue, json_message)
-                self.send(self.catalog_params_ready_queue, json_message)
+                fd.close()
             except:
                 logging.error("Could not read %s file: %s" % (input_file, sys.exc_value))
+                return
+            try:
+                self.send_params(params, output_file, correlation_id)
+            except:
+                logging.error("Could not send parameters of %s: %s" % (input_file, sys.exc_value))
         else:
             logging.error("Parameter file %s does not exist" % input_file)
 
+    def send_params(self, params, output_file, correlation_id=None):
+        """
+            Send the parameters message. Errors sending the message are raised.
+            @param params: contents of the parameters input file
+            @param output_file: results file to be created
+            @param correlation_id: identifier of the evaluation
+        """
+        message = {'params': params,
+                   'output_file': output_file,
+                   'amq_results_queue': self.results_ready_queue,
+                   'working_directory': self.working_directory
+                   }
+        headers = None
+        if correlation_id is not None:
+            message['correlation_id'] = correlation_id
+            headers = {'correlation-id': correlation_id}
+        json_message = json.dumps(message)
+        self.send(self.params_ready_queue, json_message, headers=headers)
+        self.send(self.catalog_params_ready_queue, json_message, headers=headers)
+
+    def submit(self, input_file, output_file):
+        """
+            Announce new parameters without waiting for the results.
+            Several evaluations can be in flight at once.
+            @param input_file: parameters input file path
+            @param output_file: results file to be created
+            @return: EvaluationFuture resolved when the results-ready message arrives
+            Errors reading the parameters file or sending the message are raised.
+        """
+        fd = open(input_file, 'r')
+        params = fd.read()
+        fd.close()
+        self.connect()
+        future = EvaluationFuture(self.new_correlation_id(), os.path.abspath(output_file))
+        self._listener.register(future)
+        try:
+            self.send_params(params, future.output_file, correlation_id=future.correlation_id)
+        except:
+            self._listener.unregister(future)
+            raise
+        return future
+
+    def evaluate_batch(self, evaluations, timeout=None):
+        """
+            Submit a batch of evaluations at once and wait for all of them
+            @param evaluations: list of (input_file, output_file) pairs
+            @param timeout: maximum waiting time for the whole batch, in seconds
+            @return: list of results files, in the order of evaluations
+        """
+        futures = []
+        try:
+            for input_file, output_file in evaluations:
+                futures.append(self.submit(input_file, output_file))
+            deadline = None if timeout is None else time.time() + timeout
+            results = []
+            for future in futures:
+                remaining = None if deadline is None else max(0.0, deadline - time.time())
+                results.append(future.result(remaining))
+            return results
+        finally:
+            # Forget the evaluations left in flight by an error or a timeout
+            for future in futures:
+                self._listener.unregister(future)
+            self.stop_listening()
+
 
 def setup_client(instance_number=None, 
                  working_directory=None, 
@@ -265,11 +436,27 @@ def run():
                         action='store_true',
                         help='test execution',
                         dest='is_test')
+    parser.add_argument('-n', metavar='evaluations',
+                        type=int, default=1,
+                        help='number of concurrent test evaluations',
+                        dest='evaluations')
     namespace = parser.parse_args()
 
     c = setup_client(working_directory=namespace.work_directory,
                      config_file=namespace.config_file)
     
+    if namespace.is_test is True and namespace.evaluations > 1:
+        evaluations = []
+        for i in range(namespace.evaluations):
+            input_file = namespace.work_directory+'/test_params.in.%d' % (i+1)
+            fd = open(input_file, 'w')
+            fd.write("123.456")
+            fd.close()
+            evaluations.append((input_file, namespace.work_directory+'/test_results.out.%d' % (i+1)))
+        for output_file in c.evaluate_batch(evaluations):
+            logging.info("Results ready: %s" % output_file)
+        return
+    
     if namespace.is_test is True:
         fd = open(namespace.work_directory+'/test_params.in', 'w')
         fd.write("123.456")
@@ -13,6 +13,7 @@ import time
 from sns_utilities.amq_connector.amq_consumer import Client, Listener
 from configuration import Configuration
 from camm_monitor import send_status_info
+from connection_pool import get_pool
 
 class KeplerJobListener(Listener):
     """
@@ -162,15 +163,21 @@ def send_amq_results_ready():
                         default='results.out',
                         help='Kepler output file',
                         dest='output_file')
+    parser.add_argument(conf.kepler_correlation_id_flag, metavar='correlation_id',
+                        default=None,
+                        help='correlation ID of the evaluation, echoed to Dakota',
+                        dest='correlation_id')
     namespace = parser.parse_args()
 
-    # Setup the AMQ client
-    c = Client(conf.brokers, conf.amq_user, conf.amq_pwd)
-
-    # Send a simple message to the return queue
+    # Send a simple message to the return queue. The status message below
+    # reuses the same pooled connection.
     message = {'output_file': namespace.output_file}
-    c.send(destination='/queue/'+namespace.return_queue, message=json.dumps(message))
-    c._disconnect()
+    headers = None
+    if namespace.correlation_id is not None:
+        message['correlation_id'] = namespace.correlation_id
+        headers = {'correlation-id': namespace.correlation_id}
+    get_pool().send(conf.brokers, conf.amq_user, conf.amq_pwd,
+                    '/queue/'+namespace.return_queue, json.dumps(message), headers=headers)
 
     send_status_info(str(os.getpid()), 'stop_iteration')
 
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+    Long-running Kepler worker
+
+    run_kepler_client waits for exactly one parameters message, then exits,
+    so every iteration starts a new Python process and a new broker
+    connection. The worker stays connected for the whole optimization. It
+    consumes parameters messages continuously and runs the Kepler workflow
+    for each of them in a pool of local executors. A message is acknowledged
+    only once its workflow has completed, so the messages of a worker that
+    dies are redelivered by the broker. If the workflow cannot be run or
+    fails, a failure results message echoing the correlation ID is sent to
+    the results queue, so that Dakota does not wait forever.
+"""
+import os
+import sys
+import json
+import signal
+import logging
+import argparse
+import threading
+import subprocess
+from multiprocessing.pool import ThreadPool
+
+from sns_utilities.amq_connector.amq_consumer import Listener
+from configuration import Configuration
+from connection_pool import get_pool
+from camm_monitor import send_status_info
+
+class KeplerWorker(Listener):
+    """
+        ActiveMQ Listener dispatching parameters messages to Kepler executors
+    """
+
+    def __init__(self, configuration, params_queue=None, executors=1):
+        """
+            @param configuration: Configuration object
+            @param params_queue: queue to consume parameters from. Default is the shared params_ready_queue
+            @param executors: number of workflows run concurrently
+        """
+        super(KeplerWorker, self).__init__(configuration)
+        self._conf = configuration
+        self.params_queue = params_queue or configuration.params_ready_queue
+        self.executors = executors
+        self.consumer_name = "kepler_worker.%d" % os.getpid()
+        self._subscription_id = get_pool().subscription_id(self.params_queue, self.consumer_name)
+        self._pool = ThreadPool(executors)
+        self._stopped = threading.Event()
+
+    def kepler_command(self, data_dict):
+        """
+            Command line running the Kepler workflow for a parameters message
+            @param data_dict: decoded parameters message
+        """
+        conf = self._conf
+        command = [conf.kepler_executable]
+        if conf.kepler_workflow:
+            command += ['-runwf', conf.kepler_workflow]
+        for option, value in conf.kepler_run_options.items():
+            command.append(option)
+            if value not in (None, ''):
+                command.append(str(value))
+        command += [conf.kepler_result_queue_flag, data_dict['amq_results_queue'],
+                    conf.kepler_work_dir_flag, data_dict['working_directory'],
+                    conf.kepler_output_file_flag, data_dict['output_file']]
+        if 'correlation_id' in data_dict:
+            command += [conf.kepler_correlation_id_flag, data_dict['correlation_id']]
+        return command
+
+    def on_message(self, headers, message):
+        """
+            Hand a parameters message to an executor.
+            @param headers: message headers
+            @param message: JSON-encoded message content
+        """
+        if headers.get('subscription', self._subscription_id) != self._subscription_id:
+            return
+        if self._stopped.is_set():
+            # Not acknowledged, the broker redelivers it once unsubscribed
+            return
+        self._pool.apply_async(self.execute, (headers, message))
+
+    def execute(self, headers, message):
+        """
+            Run the Kepler workflow for a parameters message, then acknowledge it.
+            Messages not started before stop are left unacknowledged for redelivery.
+            @param headers: message headers
+            @param message: JSON-encoded message content
+        """
+        if self._stopped.is_set():
+            return
+        try:
+            data_dict = json.loads(message)
+        except:
+            # Cannot be answered, nor processed by another worker
+            logging.error("Could not decode parameters message %s" % headers.get('message-id'))
+            self.ack(headers)
+            return
+        error = None
+        try:
+            command = self.kepler_command(data_dict)
+            logging.info("Running %s" % ' '.join(command))
+            send_status_info(str(os.getpid()), 'start_iteration')
+            code = subprocess.call(command, cwd=data_dict['working_directory'])
+            send_status_info(str(os.getpid()), 'stop_iteration', code)
+            if code != 0:
+                error = "Kepler workflow exited with code %d" % code
+        except:
+            error = "Could not run Kepler workflow: %s: %s" % (sys.exc_info()[0], sys.exc_info()[1])
+        if error is not None:
+            logging.error("%s | Output file: %s" % (error, data_dict.get('output_file')))
+            self.send_failure(data_dict, error)
+        self.ack(headers)
+
+    def send_failure(self, data_dict, error):
+        """
+            Send a failure results message, echoing the correlation ID
+            @param data_dict: decoded parameters message
+            @param error: description of the failure
+        """
+        if 'amq_results_queue' not in data_dict:
+            return
+        reply = {'output_file': data_dict.get('output_file'), 'error': error}
+        headers = {}
+        if 'correlation_id' in data_dict:
+            reply['correlation_id'] = data_dict['correlation_id']
+            headers['correlation-id'] = data_dict['correlation_id']
+        try:
+            get_pool().send(self._conf.brokers, self._conf.amq_user, self._conf.amq_pwd,
+                            '/queue/'+data_dict['amq_results_queue'], json.dumps(reply), headers=headers)
+        except:
+            logging.error("Could not send failure message for %s" % data_dict.get('output_file'))
+
+    def ack(self, headers):
+        """
+            Acknowledge a message
+            @param headers: headers of the message
+        """
+        ack_headers = {'message-id': headers['message-id']}
+        if 'subscription' in headers:
+            ack_headers['subscription'] = headers['subscription']
+        try:
+            conn = get_pool().get_connection(self._conf.brokers, self._conf.amq_user, self._conf.amq_pwd)
+            conn.ack(headers=ack_headers)
+        except:
+            # The broker redelivers unacknowledged messages of a lost connection
+            logging.error("Could not acknowledge message %s" % headers['message-id'])
+
+    def start(self):
+        """
+            Subscribe to the parameters queue. Individual client acknowledgement,
+            as workflows complete out of order, and no more messages in flight
+            than executors.
+        """
+        get_pool().subscribe(self._conf.brokers, self._conf.amq_user, self._conf.amq_pwd,
+                             self.params_queue, self.consumer_name, self, ack='client-individual',
+                             headers={'activemq.prefetchSize': str(self.executors)})
+
+    def serve(self, heartbeat=30.0):
+        """
+            Consume messages until stop is called. The connection is checked at
+            every heartbeat, and re-established with its subscription if lost.
+            @param heartbeat: time between connection checks, in seconds
+        """
+        self.start()
+        while not self._stopped.is_set():
+            self._stopped.wait(heartbeat)
+            if not self._stopped.is_set():
+                get_pool().get_connection(self._conf.brokers, self._conf.amq_user, self._conf.amq_pwd)
+        # Let running workflows complete and acknowledge their messages before
+        # removing the consumer, which returns unacknowledged messages to the queue
+        self._pool.close()
+        self._pool.join()
+        get_pool().unsubscribe(self._conf.brokers, self._conf.amq_user, self.params_queue, self.consumer_name)
+
+    def stop(self, *args):
+        """
+            Stop consuming messages. Also a signal handler.
+        """
+        self._stopped.set()
+
+
+def run():
+    """
+        Entry point for the kepler_worker console script
+    """
+    logging.getLogger().setLevel(logging.INFO)
+    ft = logging.Formatter('%(asctime)-15s %(message)s')
+    fh = logging.FileHandler('kepler_worker.log')
+    fh.setLevel(logging.INFO)
+    fh.setFormatter(ft)
+    logging.getLogger().addHandler(fh)
+
+    parser = argparse.ArgumentParser(description='Long-running Kepler worker')
+    parser.add_argument('-c', metavar='configuration',
+                        default='/etc/kepler_consumer.conf',
+                        help='location of the configuration file',
+                        dest='config_file')
+    parser.add_argument('-q', metavar='params_queue',
+                        default=None,
+                        help='AMQ queue to receive new parameters from. Default is params_ready_queue of the configuration',
+                        dest='params_queue')
+    parser.add_argument('-n', metavar='executors',
+                        type=int, default=1,
+                        help='number of Kepler workflows run concurrently',
+                        dest='executors')
+    namespace = parser.parse_args()
+
+    conf = Configuration(namespace.config_file)
+    worker = KeplerWorker(conf, params_queue=namespace.params_queue, executors=namespace.executors)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.serve()
+
+if __name__ == "__main__":
+    run()
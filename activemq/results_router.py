@@ -0,0 +1,101 @@
+"""
+    Results router for Dakota: one shared results queue for all Dakota processes
+
+    setup_client creates RESULTS.READY.<pid> and PARAMS.READY.<pid> queues for
+    every Dakota process, subscribing and unsubscribing at each evaluation.
+    The router instead sends all parameters to the shared PARAMS.READY queue
+    and keeps a single subscription to the shared RESULTS.READY queue for the
+    lifetime of the process. Correlation IDs are prefixed with the instance
+    number, and the subscription carries a selector on JMSCorrelationID, so
+    the broker delivers each process only the results of its own evaluations.
+    Results are dispatched to the EvaluationFuture objects in flight.
+
+    The workflow must echo the correlation-id header of the parameters
+    message in its results message (see kepler_results_ready -CorrelationId).
+"""
+import os
+import uuid
+
+from configuration import Configuration
+from connection_pool import get_pool
+from dakota_client import DakotaClient, DakotaListener
+
+class RouterListener(DakotaListener):
+    """
+        Listener of the shared results queue, for one Dakota process
+    """
+
+    def __init__(self, configuration=None, subscription_id=None, **kwargs):
+        super(RouterListener, self).__init__(configuration, **kwargs)
+        self.subscription_id = subscription_id
+
+    def on_message(self, headers, message):
+        """
+            Process a message, ignoring those delivered to other
+            subscriptions of the same connection
+            @param headers: message headers
+            @param message: JSON-encoded message content
+        """
+        if self.subscription_id is not None and headers.get('subscription', self.subscription_id) != self.subscription_id:
+            return
+        super(RouterListener, self).on_message(headers, message)
+
+
+class ResultsRouter(DakotaClient):
+    """
+        Dakota client on the shared parameters and results queues
+    """
+
+    def set_instance_number(self, instance_number):
+        """
+            Set the instance number, prefix of the correlation IDs of this process
+            @param instance_number: instance number of the Dakota process
+        """
+        self.instance_number = str(instance_number)
+
+    def subscription_headers(self):
+        """
+            Select the results of the evaluations of this process only
+        """
+        return {'selector': "JMSCorrelationID LIKE '%s.%%'" % self.instance_number}
+
+    def new_correlation_id(self):
+        """
+            Return a unique identifier for a new evaluation, prefixed with the instance number
+        """
+        return "%s.%s" % (self.instance_number, uuid.uuid4().hex)
+
+    def stop_listening(self):
+        """
+            Keep the subscription to the shared results queue for the next evaluations
+        """
+        pass
+
+
+def setup_router(instance_number=None,
+                 working_directory=None,
+                 config_file='/etc/kepler_consumer.conf'):
+    """
+        Create a Dakota client routing results from the shared queues
+        @param instance_number: instance number of the Dakota process
+        @param working_directory: directory for dakota to write parameter files
+        @param config_file: configuration file to use to setup the client
+    """
+    if instance_number is None:
+        instance_number = os.getppid()
+    if working_directory is None:
+        working_directory = os.path.expanduser('~')
+    conf = Configuration(config_file)
+
+    consumer_name = "dakota_router.%s" % str(instance_number)
+    c = ResultsRouter(conf.brokers, conf.amq_user, conf.amq_pwd,
+                      [conf.results_ready_queue], consumer_name)
+    c.set_instance_number(instance_number)
+    c.set_params_ready_queue(conf.params_ready_queue)
+    c.set_results_ready_queue(conf.results_ready_queue)
+    c.set_working_directory(working_directory)
+    sid = get_pool().subscription_id(conf.results_ready_queue, consumer_name)
+    c.set_listener(RouterListener(conf, subscription_id=sid,
+                                  results_ready_queue=conf.results_ready_queue,
+                                  catalog_results_ready_queue=c.catalog_results_ready_queue))
+    return c
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+    Message throughput of the results router against the per-PID queues
+
+    A responder stands for the Kepler workflow: it answers each parameters
+    message with a results message echoing the correlation-id header.
+    Each design runs a number of simulated Dakota processes concurrently,
+    each evaluating several batches of parameter sets:
+      per-pid: setup_client for every batch, with RESULTS.READY.<pid> and
+               PARAMS.READY.<pid> queues subscribed and unsubscribed each time
+      router:  setup_router once per process, shared queues and selectors
+
+    Requires a running ActiveMQ broker, configured in /etc/kepler_consumer.conf
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import threading
+import Queue
+
+from sns_utilities.amq_connector.amq_consumer import Listener
+from camm_amq.configuration import Configuration
+from camm_amq.connection_pool import get_pool
+from camm_amq.dakota_client import setup_client
+from camm_amq.results_router import setup_router
+
+class Responder(Listener):
+    """
+        Answer parameters messages with results messages, from a separate thread
+    """
+    def __init__(self, conf):
+        super(Responder, self).__init__(conf)
+        self._conf = conf
+        self._messages = Queue.Queue()
+        thread = threading.Thread(target=self._respond)
+        thread.daemon = True
+        thread.start()
+
+    def on_message(self, headers, message):
+        if headers['destination'].startswith('/queue/'+self._conf.params_ready_queue):
+            self._messages.put((headers, message))
+
+    def _respond(self):
+        while True:
+            headers, message = self._messages.get()
+            data_dict = json.loads(message)
+            reply = {'output_file': data_dict['output_file']}
+            reply_headers = {}
+            if 'correlation_id' in data_dict:
+                reply['correlation_id'] = data_dict['correlation_id']
+                reply_headers['correlation-id'] = data_dict['correlation_id']
+            get_pool().send(self._conf.brokers, self._conf.amq_user, self._conf.amq_pwd,
+                            '/queue/'+data_dict['amq_results_queue'], json.dumps(reply), headers=reply_headers)
+
+def run_process(design, instance, batches, batch_size, work_dir, conf, responder, config_file):
+    """
+        One simulated Dakota process
+    """
+    input_file = os.path.join(work_dir, 'params.in.%d' % instance)
+    fd = open(input_file, 'w')
+    fd.write("123.456")
+    fd.close()
+    evaluations = [(input_file, os.path.join(work_dir, 'results.out.%d.%d' % (instance, i))) for i in range(batch_size)]
+    if design == 'router':
+        c = setup_router(instance, work_dir, config_file)
+    for batch in range(batches):
+        if design == 'per-pid':
+            c = setup_client(instance, work_dir, config_file)
+            get_pool().subscribe(conf.brokers, conf.amq_user, conf.amq_pwd,
+                                 c.params_ready_queue, 'responder', responder)
+        c.evaluate_batch(evaluations)
+        if design == 'per-pid':
+            get_pool().unsubscribe(conf.brokers, conf.amq_user, c.params_ready_queue, 'responder')
+
+def benchmark(design, processes, batches, batch_size, config_file):
+    """
+        Run the simulated Dakota processes concurrently
+        @return: number of evaluations per second
+    """
+    conf = Configuration(config_file)
+    responder = Responder(conf)
+    if design == 'router':
+        get_pool().subscribe(conf.brokers, conf.amq_user, conf.amq_pwd,
+                             conf.params_ready_queue, 'responder', responder)
+    work_dir = tempfile.mkdtemp()
+    threads = [threading.Thread(target=run_process,
+                                args=(design, 100000+i, batches, batch_size, work_dir, conf, responder, config_file))
+               for i in range(processes)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    if design == 'router':
+        get_pool().unsubscribe(conf.brokers, conf.amq_user, conf.params_ready_queue, 'responder')
+    return processes * batches * batch_size / elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark of the results router against per-PID queues')
+    parser.add_argument('-c', metavar='configuration', default='/etc/kepler_consumer.conf',
+                        help='location of the configuration file', dest='config_file')
+    parser.add_argument('-p', type=int, default=8, help='number of simulated Dakota processes', dest='processes')
+    parser.add_argument('-b', type=int, default=20, help='number of batches per process', dest='batches')
+    parser.add_argument('-n', type=int, default=4, help='number of evaluations per batch', dest='batch_size')
+    namespace = parser.parse_args()
+    for design in ('per-pid', 'router'):
+        rate = benchmark(design, namespace.processes, namespace.batches, namespace.batch_size, namespace.config_file)
+        print("%-8s %10.1f evaluations/s" % (design, rate))
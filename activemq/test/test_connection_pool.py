@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+    Bookkeeping of the connection pool, on stub connections
+
+    No broker is needed: the stomp module is replaced by a stub recording
+    the subscriptions and listeners of each connection.
+"""
+import os
+import sys
+import time
+import types
+import threading
+import unittest
+
+try:
+    import stomp
+except ImportError:
+    sys.modules['stomp'] = types.ModuleType('stomp')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import connection_pool
+
+class StubConnection(object):
+    """
+        stomp.Connection recording calls instead of talking to a broker
+    """
+    ## number of failures before a connection succeeds, and delay of each attempt
+    failures = 0
+    delay = 0.0
+    created = []
+
+    def __init__(self, host_and_ports=None, user=None, passcode=None, wait_on_receipt=False):
+        self.brokers = host_and_ports
+        self.connected = False
+        self.listeners = {}
+        self.subscriptions = {}
+        self.sent = []
+        StubConnection.created.append(self)
+
+    def start(self):
+        pass
+
+    def connect(self, wait=False):
+        time.sleep(StubConnection.delay)
+        if StubConnection.failures > 0:
+            StubConnection.failures -= 1
+            raise RuntimeError("connection refused")
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    def disconnect(self):
+        self.connected = False
+
+    def stop(self):
+        pass
+
+    def set_listener(self, name, listener):
+        self.listeners[name] = listener
+
+    def get_listener(self, name):
+        return self.listeners.get(name)
+
+    def remove_listener(self, name):
+        del self.listeners[name]
+
+    def subscribe(self, destination=None, ack='auto', id=None, headers=None):
+        assert id not in self.subscriptions, "subscribed twice to %s" % id
+        self.subscriptions[id] = (destination, ack, headers)
+
+    def unsubscribe(self, id=None):
+        del self.subscriptions[id]
+
+    def send(self, destination=None, message=None, persistent='true', headers=None):
+        self.sent.append((destination, message, headers))
+
+BROKERS = [('localhost', 61613)]
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self._stomp = connection_pool.stomp
+        stub = types.ModuleType('stomp')
+        stub.Connection = StubConnection
+        connection_pool.stomp = stub
+        StubConnection.failures = 0
+        StubConnection.delay = 0.0
+        StubConnection.created = []
+        self.pool = connection_pool.ConnectionPool(max_attempts=3)
+
+    def tearDown(self):
+        connection_pool.stomp = self._stomp
+
+    def test_reuse(self):
+        """
+            Sends and subscriptions share one connection per broker list and user
+        """
+        self.pool.send(BROKERS, 'user', 'pwd', '/queue/A', 'message')
+        conn = self.pool.subscribe(BROKERS, 'user', 'pwd', '/queue/B', 'listener', object())
+        self.assertEqual(len(StubConnection.created), 1)
+        self.assertEqual(conn.sent, [('/queue/A', 'message', {})])
+        self.pool.get_connection(BROKERS, 'other', 'pwd')
+        self.assertEqual(len(StubConnection.created), 2)
+
+    def test_subscribe_unsubscribe(self):
+        """
+            Subscriptions are made once, and a listener is removed with its last subscription
+        """
+        listener = object()
+        conn = self.pool.subscribe(BROKERS, 'user', 'pwd', '/queue/A', 'listener', listener,
+                                   ack='client-individual', headers={'selector': "JMSCorrelationID LIKE '1.%'"})
+        self.pool.subscribe(BROKERS, 'user', 'pwd', '/queue/A', 'listener', listener)
+        self.pool.subscribe(BROKERS, 'user', 'pwd', '/queue/B', 'listener', listener)
+        self.pool.subscribe(BROKERS, 'user', 'pwd', '/queue/A', 'other', object())
+        sid = self.pool.subscription_id('/queue/A', 'listener')
+        self.assertEqual(conn.subscriptions[sid], ('/queue/A', 'client-individual', {'selector': "JMSCorrelationID LIKE '1.%'"}))
+        self.assertEqual(len(conn.subscriptions), 3)
+        self.pool.unsubscribe(BROKERS, 'user', '/queue/A', 'listener')
+        self.assertTrue(sid not in conn.subscriptions)
+        self.assertTrue(conn.get_listener('listener') is listener) # still subscribed to /queue/B
+        self.pool.unsubscribe(BROKERS, 'user', '/queue/B', 'listener')
+        self.assertTrue(conn.get_listener('listener') is None)
+        self.assertTrue(conn.get_listener('other') is not None)
+        self.pool.unsubscribe(BROKERS, 'user', '/queue/B', 'listener') # no longer subscribed, nothing to do
+        self.assertEqual(list(conn.subscriptions.keys()), [self.pool.subscription_id('/queue/A', 'other')])
+
+    def test_restore(self):
+        """
+            Subscriptions are restored on the new connection when the previous one is lost
+        """
+        listener = object()
+        old = self.pool.subscribe(BROKERS, 'user', 'pwd', '/queue/A', 'listener', listener, headers={'activemq.prefetchSize': '1'})
+        self.pool.subscribe(BROKERS, 'user', 'pwd', '/queue/B', 'other', object())
+        self.pool.unsubscribe(BROKERS, 'user', '/queue/B', 'other')
+        old.connected = False
+        new = self.pool.get_connection(BROKERS, 'user', 'pwd')
+        self.assertTrue(new is not old)
+        self.assertEqual(new.subscriptions, {self.pool.subscription_id('/queue/A', 'listener'): ('/queue/A', 'auto', {'activemq.prefetchSize': '1'})})
+        self.assertTrue(new.get_listener('listener') is listener)
+        self.assertTrue(self.pool.get_connection(BROKERS, 'user', 'pwd') is new)
+
+    def test_retry(self):
+        """
+            Failed attempts are retried, up to max_attempts
+        """
+        StubConnection.failures = 2
+        self.assertTrue(self.pool.get_connection(BROKERS, 'user', 'pwd').is_connected())
+        StubConnection.failures = 3
+        self.assertRaises(RuntimeError, self.pool.get_connection, BROKERS, 'other', 'pwd')
+
+    def test_connect_outside_lock(self):
+        """
+            A slow connection does not block sends on other connections, and
+            threads connecting concurrently end up sharing one connection
+        """
+        self.pool.get_connection(BROKERS, 'user', 'pwd')
+        StubConnection.delay = 0.5
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.pool.get_connection(BROKERS, 'other', 'pwd')))
+                   for i in range(2)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        start = time.time()
+        self.pool.send(BROKERS, 'user', 'pwd', '/queue/A', 'message')
+        self.assertTrue(time.time() - start < 0.2)
+        for thread in threads:
+            thread.join()
+        self.assertTrue(results[0] is results[1])
+        self.assertTrue(results[0].is_connected())
+        self.assertEqual(len([conn for conn in StubConnection.created if conn.is_connected()]), 2)
+
+if __name__ == "__main__":
+    unittest.main()
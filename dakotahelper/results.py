@@ -0,0 +1,78 @@
+'''
+Created on Oct 18, 2026
+
+  Writer for the Dakota results file. For a least-squares problem, the results file
+  contains one line per residual followed by the gradient of each residual with
+  respect to the derivative variables, one bracketed row per residual:
+
+    -1.234e-01 least_sq_term_1
+    ...
+    [ 1.0000000000e+00 -2.0000000000e-03 ]
+    ...
+
+  The whole file is formatted with a single string formatting operation and
+  written with a single call. The file is published atomically, see writeResults.
+'''
+
+def formatResiduals(residuals, label='least_sq_term_%d'):
+  """ Format the residuals, one per line
+
+  Arguments:
+    residuals: sequence of residual values
+    [label]: descriptor written after each value. If it contains '%d', it is
+             substituted with the index of the residual, starting at one.
+
+  Returns:
+    string with one line per residual. Each element is formatted with str() as
+    it is, without conversion to float, so that numpy scalars keep their own
+    str() output and precision, as Dakota was always fed.
+  """
+  values=list(residuals)
+  n=len(values)
+  if '%d' not in label:
+    return ('%s '+label.replace('%','%%')+'\n')*n % tuple(values)
+  items=[None]*(2*n) # interleave values and indexes
+  items[0::2]=values
+  items[1::2]=range(1,n+1)
+  return ('%s '+label+'\n')*n % tuple(items)
+
+def formatGradients(gradients, fmt='%.10e'):
+  """ Format the gradients, one bracketed row per residual
+
+  Arguments:
+    gradients: 2D numpy array of shape (number of residuals, number of derivative variables)
+    [fmt]: C-style format for each element
+
+  Returns:
+    string with one line per residual
+  """
+  import numpy
+  gradients=numpy.atleast_2d(numpy.asarray(gradients,dtype=float))
+  nrsl,npar=gradients.shape
+  if not npar: return ''
+  return ('['+(' '+fmt)*npar+' ]\n')*nrsl % tuple(gradients.ravel().tolist())
+
+def writeResults(filename, residuals, gradients=None, label='least_sq_term_%d', fmt='%.10e'):
+  """ Write the Dakota results file in one call. The contents are written to a
+  temporary file in the same directory, then renamed onto filename, so that
+  readers never see a partially written file (see waitresults.waitResults)
+
+  Arguments:
+    filename: path to the results file
+    residuals: sequence of residual values
+    [gradients]: optional 2D numpy array of shape (number of residuals, number of derivative variables)
+    [label]: descriptor of the residuals, see formatResiduals
+    [fmt]: C-style format for the gradient elements
+
+  Returns:
+    the contents written to filename
+  """
+  buf=formatResiduals(residuals, label=label)
+  if gradients is not None: buf+=formatGradients(gradients, fmt=fmt)
+  import os
+  tmpfile='%s.%d.tmp'%(filename,os.getpid())
+  f=open(tmpfile,'w')
+  f.write(buf)
+  f.close()
+  os.rename(tmpfile,filename)
+  return buf
@@ -0,0 +1,93 @@
+'''
+Checks that waitResults ends only once the results file is in place
+
+Created on Oct 18, 2026
+'''
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dakotahelper import waitresults
+from dakotahelper.results import writeResults
+
+class WaitResultsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.workdir=tempfile.mkdtemp()
+    self.results=os.path.join(self.workdir,'results.out.1')
+
+  def tearDown(self):
+    shutil.rmtree(self.workdir)
+
+  def later(self,delay,function,*args):
+    """ call function in a separate thread after delay seconds """
+    def run():
+      time.sleep(delay)
+      function(*args)
+    thread=threading.Thread(target=run)
+    thread.start()
+    self.addCleanup(thread.join)
+
+  def writeOther(self):
+    """ write and close an unrelated file in the same directory """
+    f=open(os.path.join(self.workdir,'results.out.2'),'w')
+    f.write('1.0 least_sq_term_1\n')
+    f.close()
+
+  def test_rename(self):
+    """ an unrelated file closed first does not end the wait, the rename of the results file does """
+    self.later(0.1,self.writeOther)
+    self.later(0.4,writeResults,self.results,[1.0,2.0])
+    start=time.time()
+    self.assertTrue(waitresults.waitResults(self.results,timeout=10))
+    self.assertTrue(time.time()-start>=0.35)
+    self.assertEqual(open(self.results).read().split(),['1.0','least_sq_term_1','2.0','least_sq_term_2'])
+
+  def test_close_write(self):
+    """ writers that do not rename end the wait when they close the results file,
+    not when an unrelated file is closed while the results file is partially written """
+    f=open(self.results,'w')
+    def partial():
+      f.write('1.0 least_sq_term_1\n')
+      f.flush()
+    def complete():
+      f.write('2.0 least_sq_term_2\n')
+      f.close()
+    self.later(0.1,partial)
+    self.later(0.2,self.writeOther)
+    self.later(0.4,complete)
+    start=time.time()
+    self.assertTrue(waitresults.waitResults(self.results,timeout=10))
+    self.assertTrue(time.time()-start>=0.35)
+    self.assertEqual(len(open(self.results).readlines()),2)
+
+  def test_timeout(self):
+    """ only unrelated events before the timeout """
+    self.later(0.1,self.writeOther)
+    start=time.time()
+    self.assertFalse(waitresults.waitResults(self.results,timeout=0.5))
+    self.assertTrue(time.time()-start>=0.45)
+
+  def test_ready(self):
+    """ a results file already in place does not wait """
+    writeResults(self.results,[1.0])
+    self.assertTrue(waitresults.waitResults(self.results,timeout=0))
+
+  def test_polling(self):
+    """ without inotify, the results file is polled """
+    inotify=waitresults._inotify
+    waitresults._inotify=lambda directory: None
+    try:
+      self.later(0.2,writeResults,self.results,[1.0])
+      self.assertTrue(waitresults.waitResults(self.results,timeout=10))
+      self.assertFalse(waitresults.waitResults(self.results+'.missing',timeout=0.1))
+    finally:
+      waitresults._inotify=inotify
+
+if __name__ == "__main__":
+  unittest.main()
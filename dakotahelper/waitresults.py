@@ -0,0 +1,103 @@
+'''
+Created on Oct 18, 2026
+
+  Block until Dakota's results file is in place, without polling.
+
+  Writers publish the results file atomically: the contents are written to a
+  temporary file in the same directory, which is then renamed onto the results
+  file (see results.writeResults). The rename is a single inotify event
+  (IN_MOVED_TO) on the directory, and the file is complete when it appears.
+  Writers that do not rename are caught when they close the results file
+  (IN_CLOSE_WRITE). Only events on the results file itself end the wait.
+  A results file already in place when the wait starts is taken as complete.
+
+  inotify is accessed through ctypes. Where it is not available, the results
+  file is polled at short intervals, and a non-empty file is taken as complete,
+  which is reliable only for writers that rename.
+'''
+import os
+import sys
+import time
+import struct
+import select
+
+IN_CLOSE_WRITE=0x00000008
+IN_MOVED_TO=0x00000080
+_event=struct.Struct('iIII') # wd, mask, cookie, len, followed by len bytes of name
+
+def isReady(filename):
+  """ True if filename exists and is not empty """
+  try:
+    return os.path.getsize(filename)>0
+  except OSError:
+    return False
+
+def _inotify(directory, mask=IN_CLOSE_WRITE|IN_MOVED_TO):
+  """ inotify file descriptor watching directory, or None if inotify is not available """
+  try:
+    import ctypes
+    libc=ctypes.CDLL(None, use_errno=True) # symbols of the running process, libc included
+    inotify_init, inotify_add_watch = libc.inotify_init, libc.inotify_add_watch
+  except (ImportError, OSError, AttributeError):
+    return None
+  fd=inotify_init()
+  if fd<0: return None
+  if not isinstance(directory, bytes): directory=directory.encode(sys.getfilesystemencoding())
+  if inotify_add_watch(fd, directory, mask)<0:
+    os.close(fd)
+    return None
+  return fd
+
+def _events(buf):
+  """ (mask, name) of each event in a buffer of inotify events """
+  events=[]
+  offset=0
+  while offset+_event.size<=len(buf):
+    mask,length=_event.unpack_from(buf, offset)[1::2]
+    offset+=_event.size
+    events.append((mask, buf[offset:offset+length].rstrip(b'\0')))
+    offset+=length
+  return events
+
+def waitResults(filename, timeout=None, poll=0.01):
+  """ Wait until the results file is in place
+
+  Arguments:
+    filename: path to the results file
+    [timeout]: maximum waiting time, in seconds. Default is to wait forever
+    [poll]: time between checks when inotify is not available, in seconds
+
+  Returns:
+    True if the results file is in place, False if timeout expired
+  """
+  filename=os.path.abspath(filename)
+  if isReady(filename): return True
+  directory, name = os.path.split(filename)
+  if not isinstance(name, bytes): name=name.encode(sys.getfilesystemencoding())
+  deadline=None if timeout is None else time.time()+timeout
+  fd=_inotify(directory)
+  try:
+    if fd is not None and isReady(filename): return True # renamed in place before the watch started
+    while True:
+      remaining=None if deadline is None else max(0.0, deadline-time.time())
+      if remaining==0.0: return False
+      if fd is None:
+        time.sleep(poll if remaining is None else min(poll, remaining))
+        if isReady(filename): return True
+        continue
+      if not select.select([fd], [], [], remaining)[0]: return False
+      for mask,event_name in _events(os.read(fd, 65536)):
+        if event_name==name and mask&(IN_MOVED_TO|IN_CLOSE_WRITE) and isReady(filename):
+          return True
+  finally:
+    if fd is not None: os.close(fd)
+
+if __name__ == "__main__":
+  import argparse
+  p=argparse.ArgumentParser(description='Block until the Dakota results file is in place')
+  p.add_argument('results', help='path to the results file')
+  p.add_argument('--timeout', type=float, help='maximum waiting time, in seconds. Default is to wait forever')
+  args=p.parse_args()
+  if not waitResults(args.results, timeout=args.timeout):
+    sys.stderr.write('timeout waiting for %s\n'%args.results)
+    sys.exit(1)
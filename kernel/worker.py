@@ -0,0 +1,228 @@
+'''
+Persistent worker running the services of the CAMM scripts
+
+Services are invoked by the workflow as separate processes, e.g.
+  python convolve.py convolution --simulated=... --resolution=...
+and each process pays the start-up of Python and Mantid. The worker is a
+long-lived process listening on a Unix socket. It keeps Mantid imported and
+the modules of the scripts loaded, including their in-memory caches (e.g.
+beamline/rescache.py and mantidhelper/workspace.py).
+
+Each script calls forward(__file__) when run as __main__. If a worker is
+listening, the command line is sent to it and the script exits with the
+output and exit status of the service run in the worker. Otherwise the
+script continues as usual, thus the command line interface is unchanged.
+
+Start the worker with:
+  python kernel/worker.py start [--socket=path] [--preload=mantid.simpleapi]
+Set environment variable CAMM_WORKER=0 to run the scripts locally even if a
+worker is listening.
+
+The environment of the script (e.g. CAMM_CACHE_DIR, SASSENA_DB_DIR, PATH) is
+sent along the command line and applied for the duration of the service.
+
+Requests are run one at a time: the services share Mantid's framework and
+the process-wide state patched by runScript (sys.argv, working directory,
+environment). Concurrent requests, e.g. from several Kepler jobs, wait for
+their turn. To run services concurrently, start one worker per job with a
+distinct socket (CAMM_WORKER_SOCKET).
+
+Created on Oct 18, 2026
+'''
+#from pdb import set_trace as trace # uncomment only for debugging purposes
+import os
+import sys
+import json
+import socket
+import struct
+
+inWorker=False # True within the worker, so that scripts run there are not forwarded again
+
+def socketPath():
+  """Path to the Unix socket, given by environment variable CAMM_WORKER_SOCKET or a per-user file in the temporary directory"""
+  from tempfile import gettempdir
+  return os.environ.get('CAMM_WORKER_SOCKET', os.path.join(gettempdir(),'camm_worker_%d.sock'%os.getuid()))
+
+def _send(conn,message):
+  """send a dictionary, as length-prefixed JSON"""
+  data=json.dumps(message).encode('utf-8')
+  conn.sendall(struct.pack('>I',len(data))+data)
+
+def _receive(conn):
+  """receive a dictionary sent with _send, or None if the connection is closed"""
+  def receiveBytes(n):
+    chunks=[]
+    while n>0:
+      chunk=conn.recv(min(n,1048576))
+      if not chunk: return None
+      chunks.append(chunk)
+      n-=len(chunk)
+    return b''.join(chunks)
+  header=receiveBytes(4)
+  if header is None: return None
+  data=receiveBytes(struct.unpack('>I',header)[0])
+  if data is None: return None
+  return json.loads(data.decode('utf-8'))
+
+def request(message,path=None):
+  """Send a request to the worker and wait for the reply
+
+  Returns:
+    reply dictionary, or None if no worker is listening
+  """
+  conn=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+  try:
+    conn.connect(path or socketPath())
+  except socket.error:
+    conn.close()
+    return None
+  try:
+    _send(conn,message)
+    return _receive(conn)
+  finally:
+    conn.close()
+
+def forward(script,argv=None):
+  """Run the script in the worker, if one is listening, then exit with its status.
+  Returns without doing anything if there is no worker, or if already in the worker.
+
+  Arguments:
+    script: path to the script, usually __file__ of the caller
+    [argv]: command line arguments, default is sys.argv[1:]
+  """
+  if inWorker or os.environ.get('CAMM_WORKER')=='0': return
+  path=socketPath()
+  if not os.path.exists(path): return
+  if argv is None: argv=sys.argv[1:]
+  reply=request({'script':os.path.abspath(script), 'argv':list(argv), 'cwd':os.getcwd(), 'env':dict(os.environ)},path=path)
+  if reply is None: return # stale socket file, run locally
+  sys.stdout.write(reply['stdout'])
+  sys.stderr.write(reply['stderr'])
+  sys.stdout.flush()
+  sys.stderr.flush()
+  sys.exit(reply['status'])
+
+def runScript(script,argv,cwd,env=None):
+  """Run a script as __main__ in this process, as if invoked from the command line
+
+  Arguments:
+    script: path to the script
+    argv: command line arguments
+    cwd: working directory
+    [env]: environment variables, replacing those of the worker during the run
+
+  Returns:
+    dictionary with the captured stdout and stderr, and the exit status
+  """
+  import runpy
+  import traceback
+  try:
+    from StringIO import StringIO
+  except ImportError:
+    from io import StringIO
+  saved=(sys.argv,sys.stdout,sys.stderr,os.getcwd(),list(sys.path),dict(os.environ))
+  out,err=StringIO(),StringIO()
+  status=0
+  try:
+    sys.path.insert(0,os.path.dirname(script)) # sibling imports, as when running the script
+    sys.argv=[script]+argv
+    sys.stdout,sys.stderr=out,err
+    if env is not None:
+      os.environ.clear()
+      os.environ.update(env)
+    os.chdir(cwd)
+    runpy.run_path(script,run_name='__main__')
+  except SystemExit:
+    code=sys.exc_info()[1].code
+    if code is None:
+      status=0
+    elif isinstance(code,int):
+      status=code
+    else:
+      err.write('%s\n'%code)
+      status=1
+  except Exception:
+    traceback.print_exc(file=err)
+    status=1
+  finally:
+    sys.argv,sys.stdout,sys.stderr=saved[:3]
+    os.chdir(saved[3])
+    sys.path[:]=saved[4]
+    os.environ.clear()
+    os.environ.update(saved[5])
+  return {'stdout':out.getvalue(), 'stderr':err.getvalue(), 'status':status}
+
+def serve(path=None,preload=('mantid.simpleapi',)):
+  """Listen for requests until a stop request is received. Requests are
+  served one at a time, see the module documentation
+
+  Arguments:
+    [path]: path to the Unix socket, default is socketPath()
+    [preload]: modules to import before listening, paying their start-up once
+  """
+  global inWorker
+  inWorker=True
+  for name in preload:
+    try:
+      __import__(name)
+    except ImportError:
+      sys.stderr.write('worker could not preload %s\n'%name)
+  path=path or socketPath()
+  if os.path.exists(path):
+    if request({'command':'status'},path=path) is not None:
+      raise RuntimeError('a worker is already listening on %s'%path)
+    os.remove(path) # stale socket file
+  server=socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+  umask=os.umask(0o177) # socket created with mode 0600, only the owner can run services
+  try:
+    server.bind(path)
+  finally:
+    os.umask(umask)
+  server.listen(16)
+  try:
+    while True:
+      conn=server.accept()[0]
+      try:
+        message=_receive(conn)
+        if message is None: continue
+        command=message.get('command','run')
+        if command=='run':
+          _send(conn,runScript(message['script'],message['argv'],message['cwd'],env=message.get('env')))
+        elif command=='status':
+          _send(conn,{'status':0, 'pid':os.getpid(), 'modules':len(sys.modules)})
+        elif command=='stop':
+          _send(conn,{'status':0})
+          break
+        else:
+          _send(conn,{'status':1, 'stdout':'', 'stderr':'unknown command %s\n'%command})
+      except socket.error:
+        pass # client went away, serve the next one
+      except Exception:
+        import traceback
+        try:
+          _send(conn,{'status':1, 'stdout':'', 'stderr':'worker could not serve the request\n'+traceback.format_exc()})
+        except socket.error:
+          pass
+      finally:
+        conn.close()
+  finally:
+    server.close()
+    if os.path.exists(path): os.remove(path)
+
+if __name__ == "__main__":
+  import argparse
+  p=argparse.ArgumentParser(description='Persistent worker running the services of the CAMM scripts. Available services are: start, stop, status')
+  p.add_argument('service', help='"start" listens for requests, "stop" stops a listening worker, "status" reports if a worker is listening')
+  p.add_argument('--socket', help='path to the Unix socket. Default is $CAMM_WORKER_SOCKET or camm_worker_UID.sock in the temporary directory')
+  p.add_argument('--preload', help='comma-separated list of modules to import at start. Default is mantid.simpleapi', default='mantid.simpleapi')
+  args=p.parse_args()
+  sys.path[0]=os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # kernel, mantidhelper,... importable
+  from kernel import worker # same module the scripts import, so they see inWorker set
+  if args.service=='start':
+    worker.serve(path=args.socket,preload=[x.strip() for x in args.preload.split(',') if x.strip()])
+  elif args.service in ('stop','status'):
+    reply=worker.request({'command':args.service},path=args.socket)
+    if reply is None:
+      print('no worker listening')
+      sys.exit(1)
+    print(json.dumps(reply))
@@ -0,0 +1,64 @@
+'''
+Checks of chisqResiduals against the arithmetic of Mantid's DakotaChiSquared
+
+Created on Oct 18, 2026
+'''
+import os
+import sys
+import math
+import unittest
+import numpy
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # package mantidhelper
+from mantidhelper.workspace import chisqResiduals
+
+def dakotaChiSquared(Yexp,Eexp,Ycalc,Ecalc):
+  """ reference, one bin at a time as DakotaChiSquared does: Minus, divide by the error, ReplaceSpecialValues """
+  residuals=[]
+  for yd,ed,yc,ec in zip(Yexp.ravel(),Eexp.ravel(),Ycalc.ravel(),Ecalc.ravel()):
+    y=yd-yc
+    e=math.sqrt(ed*ed+ec*ec) # error propagation of Minus
+    if e==0 or math.isnan(y): r=0.0
+    else: r=y/e
+    if math.isnan(r) or math.isinf(r): r=0.0
+    residuals.append(r)
+  residuals=numpy.array(residuals)
+  return residuals, numpy.dot(residuals,residuals)
+
+class ChisqResidualsTest(unittest.TestCase):
+
+  def setUp(self):
+    rng=numpy.random.RandomState(11)
+    shape=(4,50)
+    self.Yexp=rng.rand(*shape)
+    self.Eexp=0.1*rng.rand(*shape)
+    self.Ycalc=rng.rand(*shape)
+    self.Ecalc=0.05*rng.rand(*shape)
+    # special values: zero errors, a bin with only calculated error, missing data
+    self.Eexp[0,:5]=0.0
+    self.Ecalc[0,:3]=0.0
+    self.Eexp[1,7]=0.0
+    self.Yexp[2,9]=numpy.nan
+    self.Yexp[3,11]=numpy.inf
+
+  def test_against_dakotachisquared(self):
+    """ residuals and chi squared as computed by DakotaChiSquared """
+    residuals,weights=chisqResiduals(self.Yexp,self.Eexp,self.Ycalc,self.Ecalc)
+    expected,chisq=dakotaChiSquared(self.Yexp,self.Eexp,self.Ycalc,self.Ecalc)
+    numpy.testing.assert_allclose(residuals.ravel(),expected,rtol=1e-12,atol=0)
+    self.assertAlmostEqual(numpy.dot(residuals.ravel(),residuals.ravel())/chisq,1.0,places=12)
+    self.assertTrue(numpy.all(residuals[0,:3]==0)) # both errors zero
+    self.assertNotEqual(residuals[1,7],0.0) # divided by the calculated error only
+    self.assertEqual((residuals[2,9],residuals[3,11]),(0.0,0.0))
+
+  def test_weights(self):
+    """ weights scale the partial derivatives of the residuals, zero where residuals are replaced """
+    residuals,weights=chisqResiduals(self.Yexp,self.Eexp,self.Ycalc,self.Ecalc)
+    special=numpy.zeros(residuals.shape,dtype=bool)
+    special[0,:3]=special[2,9]=special[3,11]=True
+    numpy.testing.assert_allclose(weights[~special],1/numpy.hypot(self.Eexp,self.Ecalc)[~special],rtol=1e-12)
+    self.assertTrue(numpy.all(weights[special]==0))
+    numpy.testing.assert_allclose(residuals[~special],((self.Yexp-self.Ycalc)*weights)[~special],rtol=1e-12)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -20,4 +20,63 @@ def prunespectra(InputWorkspace=None,indexes=[]):
       ExtractSingleSpectrum(InputWorkspace=InputWorkspace, OutputWorkspace=wst2, WorkspaceIndex=index)
       AppendSpectra(InputWorkspace1=wst, InputWorkspace2=wst2, OutputWorkspace=wst)
   RenameWorkspace(InputWorkspace=wst, OutputWorkspace=InputWorkspace) # overwrite
-  return len(indexes)
\ No newline at end of file
+  return len(indexes)
+
+loaded={} # arrays of Nexus files loaded with loadArrays, indexed by (path, modification time, size)
+
+def loadArrays(filename,logs=(),keepRun=False):
+  """Load a Nexus file onto contiguous numpy arrays
+
+  Files are loaded only once per process. Subsequent calls return the stored arrays
+  unless the file has been modified in the meantime.
+
+  Arguments:
+    filename: Nexus file containing a Workspace2D
+    [logs]: names of sample logs to be retrieved
+    [keepRun]: keep all sample logs of the file in a single-spectrum workspace, so
+               that they can be copied onto other workspaces with CopyLogs
+
+  Returns:
+    dictionary with keys 'X', 'Y', 'E' (2D numpy arrays, one row per spectrum),
+    'logs' (dictionary of sample log values) and, if keepRun, 'run' (name of the
+    workspace holding the sample logs)
+  """
+  import os
+  st=os.stat(filename)
+  stamp=(os.path.abspath(filename),st.st_mtime,st.st_size)
+  if stamp not in loaded or not set(logs).issubset(loaded[stamp]['logs'].keys()) or (keepRun and 'run' not in loaded[stamp]):
+    from mantid.simpleapi import (LoadNexus, DeleteWorkspace, ExtractSingleSpectrum)
+    keepRun=keepRun or 'run' in loaded.get(stamp,{})
+    ws=LoadNexus(Filename=filename,OutputWorkspace='loadArrays_temp')
+    run=ws.getRun()
+    loaded[stamp]={'X':ws.extractX(), 'Y':ws.extractY(), 'E':ws.extractE(),
+                   'logs':dict([(log,run.getLogData(log).value if run.hasProperty(log) else None) for log in logs])
+                   }
+    if keepRun:
+      loaded[stamp]['run']='loadArrays_run_%d'%abs(hash(stamp))
+      ExtractSingleSpectrum(InputWorkspace=ws, OutputWorkspace=loaded[stamp]['run'], WorkspaceIndex=0)
+    DeleteWorkspace(ws)
+  return loaded[stamp]
+
+def chisqResiduals(Yexp,Eexp,Ycalc,Ecalc):
+  """Residuals of calculated spectra against experimental spectra, as computed by DakotaChiSquared
+  The difference Yexp-Ycalc is divided by its error, the experimental and calculated errors
+  added in quadrature (as done by Mantid's Minus). Residuals that are not finite, for instance
+  where both errors are zero, are replaced by zero (as done by Mantid's ReplaceSpecialValues).
+
+  Arguments:
+    Yexp, Eexp: experimental spectra and their errors, numpy arrays of shape (nhist,nE)
+    Ycalc, Ecalc: calculated spectra and their errors, same shape
+
+  Returns:
+    residuals: numpy array of shape (nhist,nE)
+    weights: inverse of the error of each residual, zero where the residual is replaced by zero
+  """
+  import numpy
+  with numpy.errstate(divide='ignore',invalid='ignore'):
+    weights=1/numpy.sqrt(numpy.square(Eexp)+numpy.square(Ecalc))
+    residuals=(numpy.asarray(Yexp)-Ycalc)*weights
+  special=~numpy.isfinite(residuals)
+  residuals[special]=0.0
+  weights[special]=0.0
+  return residuals,weights
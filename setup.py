@@ -18,6 +18,7 @@ setup(
     packages     = ['camm_amq'],
     entry_points = {'console_scripts':["kepler_client = camm_amq.kepler_utilities:run_kepler_client",
                                        "kepler_results_ready = camm_amq.kepler_utilities:send_amq_results_ready",
+                                       "kepler_worker = camm_amq.kepler_worker:run",
                                        "dakota_client = camm_amq.dakota_client:run",
                                        "camm_status = camm_amq.camm_monitor:send_status_info_command",
                                        "camm_monitor = camm_amq.camm_monitor:run",]},
@@ -13,7 +13,7 @@ def writeworkspace_singlecolumn(workspace):
     buf += '\n'.join([str(x) for x in workspace.readY(i)]) + '\n'
   return buf
 
-def modelB_freeE_C(model, resolution, convolved, assembled, expdata=None, costfile=None, derivdata=None, derivexclude=[], doshift=None):
+def modelB_freeE_C(model, resolution, convolved, assembled, expdata=None, costfile=None, derivdata=None, derivexclude=[], doshift=None, fastpath=False):
   """Assemble the Background, Elastic line and Convolution of the resolution with the simulated S(Q,E)
   This is a hard-coded model consisting of a linear background, and elastic line, and a convolution:
     b0+b1*E  +  +e0(Q)*Elastic(E)  +  c0*Resolution(E)xSimulated(Q,E)
@@ -31,25 +31,32 @@ def modelB_freeE_C(model, resolution, convolved, assembled, expdata=None, costfi
     derivdata: Optional, perform analytic derivatives (store in costfile if provided)
     derivexclude: list of fitting parameters for which partial derivatives will not be computed
     doshift: Optional, perform the shift of the model function
+    fastpath: Optional, evaluate the model with numpy arrays, see modelB_freeE_C_numpy
 
   Returns:
     wsm: workspace containing the assembled S(Q,E)
-    gradients: dictionary of partial derivatives with respect to model parameters
+    gradients: partial derivatives with respect to model parameters, a jacobian.BlockJacobian object
   """
+  if fastpath:
+    return modelB_freeE_C_numpy(model, resolution, convolved, assembled, expdata=expdata, costfile=costfile, derivdata=derivdata, derivexclude=derivexclude, doshift=doshift)
   import numpy
   from copy import copy,deepcopy
   from mantid.simpleapi import (LoadNexus, ScaleX, ConvertToPointData, SaveNexus, DakotaChiSquared, AddSampleLog)
   from math import sqrt
+  from jacobian import BlockJacobian
+  from dakotahelper.results import writeResults
 
-  def shiftalongX(*kargs,**kwargs):
+  def shiftalongX(workspace,*kargs,**kwargs):
     """ Function to do the shift along the E-axis. By default, does nothing """
-    pass
+    return workspace
   import interpX
+  shiftmethod='linear' # see interpX.shiftarrays
   if doshift: # replace the dummy function with the real thing
     if doshift in dir(interpX):
       shiftalongX=getattr(__import__('interpX'), doshift)
     else:
       shiftalongX = getattr(__import__('interpX'), 'itp_simple')
+    shiftmethod=interpX.arraymethods.get(shiftalongX.__name__,'linear') # itp_simple interpolates linearly
 
   def computemodel(p,wse,wsc):
     """Assemble the model
@@ -83,18 +90,18 @@ def modelB_freeE_C(model, resolution, convolved, assembled, expdata=None, costfi
   wse=ScaleX(InputWorkspace=wsr, OutputWorkspace='elastic',factor=-1) # elastic line
   wsc=LoadNexus(Filename=convolved,OutputWorkspace='convolved')
   E=wsr.readX(0) # energy values, bins boundary values
-  de=E[1]-E[0]   # assume all bins have same bin width
   Eshifted=(E[1:]+E[:-1])/2 # energy values, center bin values
   nhist=wsc.getNumberHistograms()
   nrsl=len(Eshifted)*nhist # number of residuals
 
-  # calculate partial numerical derivative with respect to eshift 
-  gradients={}
+  # calculate partial analytic derivative with respect to eshift, in the same pass as the shift of the model
+  gradients=BlockJacobian(nhist,len(Eshifted))
   if 'eshift' in derivparnames: 
-    wsm=computemodel(p,wse,wsc)
-    eshiftderiv=(shiftalongX(wsm,p['eshift']+0.5*de,newWorkspace='wsplus') - shiftalongX(wsm,p['eshift']-0.5*de,newWorkspace='wsminus')) / de # forward-backward difference with a 0.5*de step
-    gradients['eshift']=numpy.zeros(0)
-    for i in range(eshiftderiv.getNumberHistograms()): gradients['eshift'] = numpy.concatenate([gradients['eshift'], eshiftderiv.readY(i)])
+    eshiftderiv=0.0 # the model is not shifted
+    if doshift:
+      wsm=computemodel(p,wse,wsc)
+      eshiftderiv=interpX.shiftarrays(E,wsm.extractY(),p['eshift'],method=shiftmethod)[1]
+    gradients.setShared('eshift',eshiftderiv)
 
   # do eshift of component workspaces
   if doshift: Eshifted-=p['eshift']
@@ -113,26 +120,15 @@ def modelB_freeE_C(model, resolution, convolved, assembled, expdata=None, costfi
  
   # calculate analytic partial derivatives with respect to the fit parameters
   if derivparnames:
-    gradients['b0']=numpy.ones(nrsl)
-    gradients['b1']=numpy.zeros(0)
-    gradients['c0']=numpy.zeros(0)
-    gradients['FF1']=numpy.zeros(0)
-    for i in range(nhist):
-      gradients['b1'] = numpy.concatenate([gradients['b1'], Eshifted])
-      gradients['c0'] = numpy.concatenate([gradients['c0'], wsc.readY(i)])
-      if 'FF1' not in derivexclude:
-        gradients['FF1'] = numpy.concatenate([gradients['FF1'], wksp_diff.readY(i)])
-      gradients['e0.'+str(i)]=numpy.zeros(0)
-      for j in range(nhist):
-        if i==j: 
-          gradients['e0.'+str(i)] = numpy.concatenate([gradients['e0.'+str(i)], wse.readY(i)])
-        else:
-          gradients['e0.'+str(i)] = numpy.concatenate([gradients['e0.'+str(i)], numpy.zeros(len(Eshifted))])
+    gradients.setShared('b0',1.0)
+    gradients.setShared('b1',Eshifted)
+    gradients.setShared('c0',wsc.extractY())
+    gradients.setBlockDiagonal(['e0.'+str(i) for i in range(nhist)], wse.extractY()[:nhist]) # e0.i affects only spectrum i
 
   if 'FF1' not in derivexclude:
     FF1_f=wscf.getRun().getLogData('FF1').value
     FF1_b=wscb.getRun().getLogData('FF1').value
-    gradients['FF1'] *= p['c0']/(FF1_f-FF1_b)
+    gradients.setShared('FF1',wksp_diff.extractY() * p['c0']/(FF1_f-FF1_b))
 
   # save model to file
   wsm=computemodel(p,wse,wsc)
@@ -146,26 +142,17 @@ def modelB_freeE_C(model, resolution, convolved, assembled, expdata=None, costfi
   SaveNexus(InputWorkspace=wsm, Filename=assembled)
 
   # save residuals and partial derivatives
-  buf=''
   if expdata and costfile:
     wex=LoadNexus(Filename=expdata,OutputWorkspace='experiment')
     chisq,wR=DakotaChiSquared(DataFile=expdata,CalculatedFile=assembled,OutputFile=costfile,ResidualsWorkspace='wR')
-    Xe=numpy.zeros(0) # list of errors for each residual
-    for i in range(nhist):
-      Xe = numpy.concatenate([Xe, wex.readE(i)])
-      Ry=wR.readY(i)
-      for j in range(len(Ry)):
-        buf+=str(Ry[j])+" least_sq_term_"+str(i*len(Ry)+j+1)+"\n"
-    for parname in derivparnames: gradients[parname]/=numpy.where(Xe>0,Xe,1) # divide by experimental error (with non-positive elements replaced by one)
-    if derivparnames:
-      for i in range(nrsl):
-        buf+="["
-        for parname in derivparnames: buf+=" %.10e"%(-gradients[parname][i])
-        buf+=" ]\n"
-    open(costfile,'w').write(buf)
+    Xe=wex.extractE()[:nhist] # errors for each residual
+    gradients.scaleRows(1/numpy.where(Xe>0,Xe,1)) # divide by experimental error (with non-positive elements replaced by one)
+    jacobian=None
+    if derivparnames: jacobian=-gradients.toarray(derivparnames) # dense only for serialization
+    writeResults(costfile, wR.extractY().ravel(), gradients=jacobian)
 
   AddSampleLog(Workspace=wsm,LogName="chisq",LogText=str(chisq),LogType='Number')
-  norm_chisq=chisq/(len(Ry)-len(derivparnames))
+  norm_chisq=chisq/(wR.blocksize()-len(derivparnames))
   print costfile, " R = ", sqrt(norm_chisq)
   AddSampleLog(Workspace=wsm,LogName="norm_chisq",LogText=str(norm_chisq),LogType='Number')
   AddSampleLog(Workspace=wsm,LogName="norm_chi",LogText=str(sqrt(norm_chisq)),LogType='Number')
@@ -173,6 +160,108 @@ def modelB_freeE_C(model, resolution, convolved, assembled, expdata=None, costfi
 
   return {'model':wsm, 'gradients':gradients}
 
+def modelB_freeE_C_numpy(model, resolution, convolved, assembled, expdata=None, costfile=None, derivdata=None, derivexclude=[], doshift=None):
+  """Same model as modelB_freeE_C, evaluated on numpy arrays
+  Elastic, convolved and experimental spectra are loaded once per process onto (nQ, nE) arrays
+  (see mantidhelper.workspace.loadArrays), and the model is evaluated as a single vectorized
+  expression. Mantid is used only to load the input files and to save the assembled S(Q,E).
+  As with modelB_freeE_C, the assembled S(Q,E) carries the sample logs of the convolved file.
+  The shift along the E-axis and its derivative are computed with interpX.shiftarrays,
+  with linear interpolation unless doshift is 'itp_fourier'.
+  Residuals are those of DakotaChiSquared, see chisqResiduals. The errors of the assembled
+  S(Q,E) are those of the convolved file, as in modelB_freeE_C.
+
+  Arguments: see modelB_freeE_C
+
+  Returns:
+    wsm: workspace containing the assembled S(Q,E)
+    gradients: partial derivatives with respect to model parameters, a jacobian.BlockJacobian object
+  """
+  import numpy
+  from math import sqrt
+  from mantid.simpleapi import (CreateWorkspace, AddSampleLog, CopyLogs, SaveNexus)
+  from mantidhelper.workspace import (loadArrays, chisqResiduals)
+  from jacobian import BlockJacobian
+  from dakotahelper.results import writeResults
+
+  # init list of parameters names for which analytical derivative exists, same order as in the input model file
+  derivparnames=[] # filled only if derivdata different than None
+  p={}
+  pnames=[] # parameter names, same order as in the input model file
+  for pair in open(model,'r').readline().split(';'):
+    key,val=[x.strip() for x in pair.split('=')]
+    if derivdata and key not in derivexclude: derivparnames.append(key)
+    p[key]=float(val)
+    pnames.append(key)
+
+  # read various inputs
+  wsr=loadArrays(resolution)
+  wsc=loadArrays(convolved,logs=('FF1',),keepRun=True)
+  convolvedY=wsc['Y']
+  nhist,nE=convolvedY.shape
+  elastic=wsr['Y'][:nhist,::-1] # elastic line, the resolution with E --> -E
+  E=wsr['X'][0] # energy values, bins boundary values
+  Eshifted=(E[1:]+E[:-1])/2 # energy values, center bin values
+  e0=numpy.array([p['e0.'+str(i)] for i in range(nhist)])
+  background=p['b0'] + p['b1']*Eshifted
+
+  # calculate analytic partial derivative with respect to eshift, and do eshift of component arrays
+  gradients=BlockJacobian(nhist,nE)
+  if 'eshift' in derivparnames: gradients.setShared('eshift',0.0) # overwritten below if the model is shifted
+  if doshift:
+    import interpX
+    shiftmethod=interpX.arraymethods.get(doshift,'linear') # itp_simple interpolates linearly
+    if 'eshift' in derivparnames:
+      wsm=background + e0[:,numpy.newaxis]*elastic + p['c0']*convolvedY
+      gradients.setShared('eshift',interpX.shiftarrays(E,wsm,p['eshift'],method=shiftmethod)[1])
+    elastic=interpX.shiftarrays(E,elastic,p['eshift'],method=shiftmethod)[0]
+    convolvedY=interpX.shiftarrays(E,convolvedY,p['eshift'],method=shiftmethod)[0]
+    Eshifted=Eshifted-p['eshift']
+  wsm=background + e0[:,numpy.newaxis]*elastic + p['c0']*convolvedY
+
+  # calculate analytic partial derivatives with respect to the fit parameters
+  if 'FF1' not in derivexclude: derivparnames.append('FF1')
+  if derivparnames:
+    gradients.setShared('b0',1.0)
+    gradients.setShared('b1',Eshifted)
+    gradients.setShared('c0',convolvedY)
+    gradients.setBlockDiagonal(['e0.'+str(i) for i in range(nhist)], elastic) # e0.i affects only spectrum i
+  if 'FF1' not in derivexclude: # difference in convolutions with FF1 changed
+    wscf=loadArrays(convolved.replace('.nxs','_1.nxs'),logs=('FF1',))
+    wscb=loadArrays(convolved.replace('.nxs','_0.nxs'),logs=('FF1',))
+    gradients.setShared('FF1',(wscf['Y']-wscb['Y']) * p['c0']/(wscf['logs']['FF1']-wscb['logs']['FF1']))
+
+  # residuals and partial derivatives, divided by the error of the residual as in DakotaChiSquared
+  chisq=None
+  if expdata:
+    wex=loadArrays(expdata)
+    residuals,weights=chisqResiduals(wex['Y'],wex['E'],wsm,wsc['E'])
+    residuals=residuals.ravel()
+    chisq=numpy.dot(residuals,residuals)
+    if costfile:
+      gradients.scaleRows(weights) # the calculated errors do not depend on the parameters
+      jacobian=None
+      if derivparnames: jacobian=-gradients.toarray(derivparnames) # dense only for serialization
+      writeResults(costfile, residuals, gradients=jacobian)
+
+  # save model to file, only Mantid call in addition to loading the input files
+  ws=CreateWorkspace(DataX=wsc['X'].ravel(), DataY=wsm.ravel(), DataE=wsc['E'].ravel(), NSpec=nhist, UnitX='DeltaE', OutputWorkspace='assembled')
+  CopyLogs(InputWorkspace=wsc['run'], OutputWorkspace=ws) # sample logs of the convolved file, FF1 included
+  for key in pnames:
+    AddSampleLog(Workspace=ws,LogName=key,LogText=str(p[key]),LogType='Number')
+    print key, "=",  p[key]
+  if wsc['logs']['FF1'] is not None:
+    print "FF1 =", wsc['logs']['FF1']
+  if chisq is not None:
+    AddSampleLog(Workspace=ws,LogName="chisq",LogText=str(chisq),LogType='Number')
+    norm_chisq=chisq/(nE-len(derivparnames))
+    print costfile, " R = ", sqrt(norm_chisq)
+    AddSampleLog(Workspace=ws,LogName="norm_chisq",LogText=str(norm_chisq),LogType='Number')
+    AddSampleLog(Workspace=ws,LogName="norm_chi",LogText=str(sqrt(norm_chisq)),LogType='Number')
+  SaveNexus(InputWorkspace=ws, Filename=assembled)
+
+  return {'model':ws, 'gradients':gradients}
+
 def modelBEC_EC(model, resolution, convolved, qvalues, assembled, expdata=None, costfile=None):
   """Assemble the Background, Elastic line and Convolution of the resolution with the simulated S(Q,E)
   This is a hard-coded model consisting of a linear background, and elastic line, and a convolution:
@@ -398,6 +487,8 @@ def lowTResolution(model, simulated, resolution, convolved, expdata=None,
 
 
 if __name__ == "__main__":
+  from kernel.worker import forward
+  forward(__file__) # run the service in the persistent worker, if one is listening
   import argparse
   import sys
   if sys.version_info < (2,6): from sets import Set as set
@@ -487,12 +578,13 @@ if __name__ == "__main__":
     p.add_argument('--derivdata',    help='optional, set to 1 if to perform analytic derivatives (store in costfile if provided)')
     p.add_argument('--derivexclude', help='optional, string containing space-separated parameters for which partial derivatives will not be computed')
     p.add_argument('--doshift',      help='optional, perform the shift of the model function')
+    p.add_argument('--fastpath',     help='optional, set to 1 to evaluate the model with numpy arrays instead of Mantid workspaces')
     if '-explain' in sys.argv:
       p.parse_args(args=('-h',))
     else:
       args=p.parse_args()
       derivexclude=[]
       if args.derivexclude: derivexclude=args.derivexclude.split()
-      modelB_freeE_C(args.model, args.resolution, args.convolved, args.assembled, expdata=args.expdata, costfile=args.costfile, derivdata=bool(args.derivdata), derivexclude=derivexclude, doshift=args.doshift)
+      modelB_freeE_C(args.model, args.resolution, args.convolved, args.assembled, expdata=args.expdata, costfile=args.costfile, derivdata=bool(args.derivdata), derivexclude=derivexclude, doshift=args.doshift, fastpath=bool(args.fastpath))
   else:
     print 'service not found'
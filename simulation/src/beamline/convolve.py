@@ -44,7 +44,131 @@ def camm_convolve(signal,response,mode='same'):
   g=response[::-1] # numpy convolve uses the definition of convolution of math textbooks, which does E --> -E
   return convolve(signal,g,mode=mode)
 
-def convolution(simulated, resolution, expdata, convolved, dak=None, norm2one=False):
+def fftlength(n):
+  """Smallest integer >= n whose only prime factors are 2, 3 and 5. FFTs of these lengths are fast"""
+  best=1
+  while best<n: best*=2 # power of two is always a valid candidate
+  p5=1
+  while p5<best:
+    p35=p5
+    while p35<best:
+      m=p35
+      while m<n: m*=2
+      if m<best: best=m
+      p35*=3
+    p5*=5
+  return best
+
+def convolve_method(nsignal,nresponse):
+  """Choose between 'direct' and 'fft' convolution by comparing estimated operation counts
+
+  Direct convolution costs nsignal*nresponse multiply-adds. FFT convolution costs three
+  transforms of the padded length, each about L*log2(L) operations.
+  """
+  from math import log
+  L=fftlength(nsignal+nresponse-1)
+  if nsignal*nresponse < 3*L*log(L,2):
+    return 'direct'
+  return 'fft'
+
+def _cropconvolved(full,nsignal,nresponse,mode):
+  """Extract from the full convolution the section corresponding to numpy.convolve modes"""
+  if mode=='full':
+    return full
+  if mode=='same':
+    start=(min(nsignal,nresponse)-1)//2
+    return full[:,start:start+max(nsignal,nresponse)]
+  if mode=='valid':
+    start=min(nsignal,nresponse)-1
+    return full[:,start:start+max(nsignal,nresponse)-min(nsignal,nresponse)+1]
+  raise ValueError('mode must be one of "full", "same", or "valid". Found: %s'%mode)
+
+def transform_responses(responses,nsignal,method='auto'):
+  """Prepare the response functions for camm_convolve2d
+
+  Reverses the responses and, if FFT convolution is the method of choice, stores
+  their Fourier transforms. The returned kernel can be reused to convolve any
+  number of signals of length nsignal, and it can be cached (see rescache module).
+
+  Arguments:
+    responses: 1D or 2D numpy array with the response function(s)
+    nsignal: length of the signals to be convolved
+    [method]: 'direct', 'fft', or 'auto'. If 'auto', the fastest method is guessed
+              from the lengths of signal and response.
+
+  Returns:
+    kernel: dictionary with keys 'method', 'nsignal', 'responses', 'L' (padded
+            length of the FFT) and 'transform' (Fourier transform of the reversed
+            responses, only for method 'fft')
+  """
+  import numpy
+  responses=numpy.asarray(responses,dtype=float)
+  if responses.ndim==1: responses=responses[numpy.newaxis,:] # same response for all signals
+  nresponse=responses.shape[1]
+  if method=='auto': method=convolve_method(nsignal,nresponse)
+  if method not in ('direct','fft'):
+    raise ValueError('method must be one of "auto", "direct", or "fft". Found: %s'%method)
+  kernel={'method':method, 'nsignal':nsignal, 'responses':responses, 'L':0}
+  if method=='fft':
+    kernel['L']=fftlength(nsignal+nresponse-1)
+    kernel['transform']=numpy.fft.rfft(responses[:,::-1],kernel['L'],axis=1) # reverse response, see camm_convolve
+  return kernel
+
+def camm_convolve2d(signals,responses=None,mode='same',method='auto',kernel=None):
+  """In-house convolution of a batch of spectra
+
+  Same definition of convolution as camm_convolve, but all spectra are convolved at once.
+  Each row of signals is convolved with the corresponding row of responses, or with
+  the same response if responses is one-dimensional.
+
+  Arguments:
+    signals: 2D numpy array, one spectrum per row (one row per Q-value)
+    responses: 1D or 2D numpy array with the response function(s). Not needed if kernel is passed.
+    [mode]: 'full', 'same' or 'valid', same meaning as in numpy.convolve
+    [method]: 'direct', 'fft', or 'auto'. If 'auto', the fastest method is guessed
+              from the lengths of signal and response.
+    [kernel]: responses already prepared with transform_responses
+
+  Returns:
+    2D numpy array, the in-house convolution of each row of signals
+  """
+  import numpy
+  signals=numpy.atleast_2d(numpy.asarray(signals,dtype=float))
+  nsignal=signals.shape[1]
+  if kernel is None or kernel['nsignal']!=nsignal:
+    if responses is None: responses=kernel['responses']
+    kernel=transform_responses(responses,nsignal,method=method)
+  nresponse=kernel['responses'].shape[1]
+  nfull=nsignal+nresponse-1
+  if kernel['method']=='fft':
+    L=kernel['L']
+    full=numpy.fft.irfft(numpy.fft.rfft(signals,L,axis=1)*kernel['transform'],L,axis=1)[:,:nfull]
+  else:
+    g=kernel['responses'][:,::-1] # reverse response, see camm_convolve
+    full=numpy.zeros((max(signals.shape[0],g.shape[0]),nfull))
+    for k in range(nresponse): # one vectorized multiply-add per element of the response
+      full[:,k:k+nsignal]+=signals*g[:,k:k+1]
+  return _cropconvolved(full,nsignal,nresponse,mode)
+
+def convolvedKey(dak, resolution, expdata, norm2one=False, ffnames=None):
+  """Key of the convolved file in the store of convolved files (see convstore)
+
+  Arguments:
+    dak: dakota params file, containing the force field parameters
+    resolution: Nexus file containing the resolution
+    expdata: experimental nexus file, the convolved is binned as expdata
+    [norm2one]: whether Mantid::NormaliseToUnity is applied
+    [ffnames]: list of force field parameter names. If None, parameters starting with 'FF'
+
+  Returns:
+    key for convstore.ConvolvedStore
+  """
+  from rescache import fileHash
+  from convstore import ffParams, storeKey
+  context=(fileHash(resolution), fileHash(expdata), 'norm2one=%s'%bool(norm2one))
+  return storeKey(ffParams(getParams(dak),ffnames), context=context)
+
+def convolution(simulated, resolution, expdata, convolved, dak=None, norm2one=False, cachedir=None, storedir=None, ffnames=None):
   """Convolve a simulated S(Q,E) with a resolution file
 
   Arguments:
@@ -52,32 +176,51 @@ def convolution(simulated, resolution, expdata, convolved, dak=None, norm2one=Fa
     resolution: Nexus file containing the resolution. This will be used to produce a elastic line.
     convolved: Output Nexus file containing the convolution of the simulated S(Q,E) with the model beamline.
     expdata: Optional, experimental nexus file. Convolved will be binned as expdata. 
+    cachedir: Optional, directory to cache the symmetrized and transformed resolution across
+              Dakota iterations. Default is given by rescache.defaultCacheDir()
+    storedir: Optional, directory of the store of convolved files (see convstore). If passed
+              together with dak, a convolved file previously computed for the same force field
+              parameters is copied onto convolved, and new convolutions are added to the store.
+    ffnames: Optional, list of force field parameter names in dak. Default are names starting with 'FF'
   Returns:
     workspace for the convolution
   """
   from mantid.simpleapi import (LoadNexus, Rebin, ConvertToHistogram, NormaliseToUnity, SaveNexus, SaveAscii, AddSampleLog)
+  from rescache import ResolutionCache
+  from convstore import ConvolvedStore
+  key=None
+  if storedir and dak:
+    key=convolvedKey(dak, resolution, expdata, norm2one=norm2one, ffnames=ffnames)
+    if ConvolvedStore(storedir).fetch(key,convolved): return # served from the store
   wss=LoadNexus(Filename=simulated,OutputWorkspace='simulated')
   width=wss.readX(0)[1]-wss.readX(0)[0] # rebin resolution as simulated
-  wsr=LoadNexus(Filename=resolution,OutputWorkspace='resolution')
-
-  #symmetrize the domain of the resolution function. Otherwise the
-  #convolution results in a function with its peak shifted from the origin
-  min=wsr.readX(0)[0]
-  max=wsr.readX(0)[-1]
-  delta=min+max
-  if delta<0:
-    wsr=Rebin(wsr, Params=(-max,width,max))
-  elif delta>0:
-    wsr=Rebin(wsr, Params=(min,width,-min))
-  else:
-    wsr=Rebin(wsr, Params=(min,width,max))
-
-  # convolve now, overwriting simulateds
-  for i in range(wss.getNumberHistograms()):
-    v=wsr.readY(i)
-    w=wss.readY(i)
-    x=camm_convolve(w,v,mode='same')
-    wss.setY(i,x)
+  nsignal=wss.blocksize()
+  cache=ResolutionCache(cachedir)
+  kernel=cache.get(resolution,width,nsignal) # the resolution does not change during a fit
+  if kernel is None:
+    wsr=LoadNexus(Filename=resolution,OutputWorkspace='resolution')
+
+    #symmetrize the domain of the resolution function. Otherwise the
+    #convolution results in a function with its peak shifted from the origin
+    min=wsr.readX(0)[0]
+    max=wsr.readX(0)[-1]
+    delta=min+max
+    if delta<0:
+      wsr=Rebin(wsr, Params=(-max,width,max))
+    elif delta>0:
+      wsr=Rebin(wsr, Params=(min,width,-min))
+    else:
+      wsr=Rebin(wsr, Params=(min,width,max))
+    kernel=cache.put(resolution,width,nsignal,transform_responses(wsr.extractY(),nsignal))
+
+  # convolve all spectra at once, overwriting simulateds
+  nhist=wss.getNumberHistograms()
+  if kernel['responses'].shape[0]>nhist: # resolution may have more spectra than simulated
+    kernel=dict(kernel, responses=kernel['responses'][:nhist])
+    if 'transform' in kernel: kernel['transform']=kernel['transform'][:nhist]
+  x=camm_convolve2d(wss.extractY(),kernel=kernel,mode='same')
+  for i in range(nhist):
+    wss.setY(i,x[i])
     
   wse=LoadNexus(Filename=expdata,OutputWorkspace='expdata')
   width=wse.readX(0)[1]-wse.readX(0)[0] # rebin simulated as expdata
@@ -91,13 +234,16 @@ def convolution(simulated, resolution, expdata, convolved, dak=None, norm2one=Fa
     AddSampleLog(Workspace='convolved',LogName='FF1',LogText=str(dakota_vals["FF1"]),LogType='Number')
   from mantid.simpleapi import mtd
   SaveNexus(InputWorkspace='convolved', Filename=convolved)
+  if key: ConvolvedStore(storedir).put(key,convolved)
   return
 
 if __name__ == "__main__":
+  from kernel.worker import forward
+  forward(__file__) # run the service in the persistent worker, if one is listening
   import argparse
   import sys
   if sys.version_info < (2,6): from sets import Set as set
-  p=argparse.ArgumentParser(description='Provider for services involving convolution of simulated S(Q,E) with a model beamline. Available services are: lowTresolution.')
+  p=argparse.ArgumentParser(description='Provider for services involving convolution of simulated S(Q,E) with a model beamline. Available services are: convolution, lookup.')
   p.add_argument('service', help='name of the service to invoke')
   p.add_argument('-explain', action='store_true', help='print message explaining the arguments to pass for the particular service')
   if set(['-h', '-help', '--help']).intersection(set(sys.argv)): args=p.parse_args() # check if help message is requested
@@ -111,10 +257,41 @@ if __name__ == "__main__":
     p.add_argument('--expdata',   help='name of the experimental nexus file. Convolved will be binned as expdata.')
     p.add_argument('--dak',       help='name of the dakota params file')
     p.add_argument('--norm2one',  help='apply Mantid::NormaliseToUnity. Default is false')
+    p.add_argument('--cachedir',  help='directory to cache the transformed resolution across iterations. Pass an empty string to disable the disk cache. Default is $CAMM_CACHE_DIR or ~/.camm/cache')
+    p.add_argument('--storedir',  help='optional, directory of the store of convolved files, reused for previously computed force field parameters. Not used if not passed')
+    p.add_argument('--ffnames',   help='optional, comma-separated list of force field parameter names in the dakota params file. Default are names starting with "FF"')
+    if '-explain' in sys.argv:
+      p.parse_args(args=('-h',))
+    else:
+      args=p.parse_args()
+      norm2one=False
+      if args.norm2one in ('True','true','1'): norm2one=True
+      ffnames=None
+      if args.ffnames: ffnames=[x.strip() for x in args.ffnames.split(',')]
+      convolution(args.simulated, args.resolution, args.expdata, args.convolved, dak=args.dak, norm2one=norm2one, cachedir=args.cachedir, storedir=args.storedir, ffnames=ffnames)
+  elif 'lookup' in sys.argv:
+    p.description='Look up the store of convolved files for the force field parameters in the dakota params file. If found, copy onto the output Nexus file and exit with status 0, otherwise exit with status 1.' # update help message
+    for action in p._actions:
+      if action.dest=='service': action.help='substitue "service" with "lookup"' # update help message
+    p.add_argument('--dak',       help='name of the dakota params file')
+    p.add_argument('--resolution',help='name of the nexus file containing the resolution function')
+    p.add_argument('--expdata',   help='name of the experimental nexus file')
+    p.add_argument('--convolved', help='name of the output nexus file')
+    p.add_argument('--norm2one',  help='whether Mantid::NormaliseToUnity is applied. Default is false')
+    p.add_argument('--storedir',  help='directory of the store of convolved files. Default is $CAMM_CACHE_DIR/convolved or ~/.camm/cache/convolved')
+    p.add_argument('--ffnames',   help='comma-separated list of force field parameter names. Default are names starting with "FF"')
     if '-explain' in sys.argv:
       p.parse_args(args=('-h',))
     else:
       args=p.parse_args()
+      from convstore import ConvolvedStore
       norm2one=False
       if args.norm2one in ('True','true','1'): norm2one=True
-      convolution(args.simulated, args.resolution, args.expdata, args.convolved, dak=args.dak, norm2one=norm2one)
+      ffnames=None
+      if args.ffnames: ffnames=[x.strip() for x in args.ffnames.split(',')]
+      key=convolvedKey(args.dak, args.resolution, args.expdata, norm2one=norm2one, ffnames=ffnames)
+      if ConvolvedStore(args.storedir).fetch(key,args.convolved):
+        sys.stdout.write('hit\n')
+        sys.exit(0)
+      sys.stdout.write('miss\n')
+      sys.exit(1)
@@ -0,0 +1,126 @@
+'''
+Content-addressed store of convolved S(Q,E) files
+
+Each convolved Nexus file is the end product of a force field, a molecular dynamics
+simulation, a Sassena calculation and the convolution with the resolution. Dakota
+revisits parameter points often, and the FF1 derivative requires convolutions at
+forward and backward values of the force field parameters. The store allows to
+serve previously computed points instead of convolving them again.
+The workflow passes no store to convolve.py yet, and it does not call the lookup
+service of convolve.py: the force field, the simulation and the Sassena stages
+are run for every point, and only the convolution can be served from the store.
+
+Layout of the store directory:
+  objects/<sha1>.nxs: convolved files, named after the SHA1 hash of their contents.
+                      Identical files are stored only once.
+  keys/<key>: text file containing the SHA1 hash of the object for this key. The
+              key is derived from the force field parameter vector and the files
+              that determine the convolution (resolution, experimental binning).
+
+Created on Oct 18, 2026
+'''
+#from pdb import set_trace as trace # uncomment only for debugging purposes
+import os
+
+def defaultStoreDir():
+  """Directory for the store, subdirectory 'convolved' of rescache.defaultCacheDir()"""
+  from rescache import defaultCacheDir
+  return os.path.join(defaultCacheDir(),'convolved')
+
+def ffParams(params,ffnames=None):
+  """Select the force field parameters
+
+  Arguments:
+    params: dictionary of parameter values, e.g. loaded from the Dakota params file
+    [ffnames]: list of force field parameter names. If None, names starting with 'FF'
+
+  Returns:
+    dictionary with the force field parameters only
+  """
+  if ffnames is None: ffnames=[name for name in params.keys() if name.startswith('FF')]
+  return dict([(name,params[name]) for name in ffnames])
+
+def storeKey(ffparams,context=(),digits=10):
+  """Key for a force field parameter vector
+
+  Arguments:
+    ffparams: dictionary of force field parameter values
+    [context]: sequence of strings identifying everything else the convolved file
+               depends on, e.g. hashes of the resolution and experimental files
+    [digits]: number of significant digits of the parameter values entering the key
+
+  Returns:
+    SHA1 hex digest
+  """
+  import hashlib
+  fmt='%s=%.'+str(digits-1)+'e\n'
+  buf=''.join([fmt%(name,ffparams[name]) for name in sorted(ffparams.keys())])
+  buf+=''.join(['%s\n'%item for item in context])
+  return hashlib.sha1(buf.encode('utf-8')).hexdigest()
+
+class ConvolvedStore(object):
+  """ Store and retrieve convolved files, keyed by force field parameter vector """
+
+  def __init__(self,storedir=None):
+    """
+    Arguments:
+      [storedir]: directory of the store. If None, defaultStoreDir() is used
+    """
+    if storedir is None: storedir=defaultStoreDir()
+    self._storedir=storedir
+
+  def _keypath(self,key):
+    return os.path.join(self._storedir,'keys',key)
+
+  def _objectpath(self,digest):
+    return os.path.join(self._storedir,'objects','%s.nxs'%digest)
+
+  def _atomicwrite(self,filename,contents=None,source=None):
+    """Write contents, or copy file source, onto filename through a temporary file and a rename"""
+    import shutil
+    dirname=os.path.dirname(filename)
+    if not os.path.isdir(dirname): os.makedirs(dirname)
+    tmpfile=filename+'.%d.tmp'%os.getpid()
+    if source:
+      shutil.copyfile(source,tmpfile)
+    else:
+      open(tmpfile,'w').write(contents)
+    os.rename(tmpfile,filename)
+
+  def get(self,key):
+    """Path to the stored convolved file for key, or None if not in the store"""
+    try:
+      digest=open(self._keypath(key)).read().strip()
+    except IOError:
+      return None
+    filename=self._objectpath(digest)
+    if not os.path.exists(filename): return None
+    return filename
+
+  def fetch(self,key,destination):
+    """Copy the stored convolved file for key onto destination
+
+    Returns:
+      True if found in the store, False otherwise
+    """
+    import shutil
+    filename=self.get(key)
+    if not filename: return False
+    shutil.copyfile(filename,destination)
+    return True
+
+  def put(self,key,filename):
+    """Add a convolved file to the store. Writes are atomic, so concurrent jobs can share the store
+
+    Returns:
+      SHA1 hash of the contents of filename, or None if the store could not be written
+    """
+    from rescache import fileHash
+    try:
+      digest=fileHash(filename)
+      if not os.path.exists(self._objectpath(digest)): # same contents are stored only once
+        self._atomicwrite(self._objectpath(digest),source=filename)
+      self._atomicwrite(self._keypath(key),contents=digest+'\n')
+    except (IOError,OSError):
+      return None # the store is an optimization only
+    return digest
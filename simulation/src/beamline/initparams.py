@@ -76,6 +76,8 @@ def modelB_freeE_C(modeltpl, elastic, convolved, expdata, initparfile=None):
 
 
 if __name__ == "__main__":
+  from kernel.worker import forward
+  forward(__file__) # run the service in the persistent worker, if one is listening
 
   import argparse
   import sys
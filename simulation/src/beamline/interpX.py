@@ -30,12 +30,104 @@ def itp_simple(workspace,shift,newWorkspace=None):
   ScaleX(InputWorkspace=wname,OutputWorkspace=newWorkspace,factor=shift,Operation='Add')
   return Rebin(InputWorkspace=newWorkspace,OutputWorkspace=newWorkspace,Params=[start,width,end])
 
+arraymethods={'itp_linear':'linear', 'itp_fourier':'fourier'} # shift functions working on numpy arrays
+
+def shiftarrays(X,Y,shift,method='linear'):
+  '''Shift spectra along the X-axis and compute the derivative with respect to the shift
+
+  Works directly on numpy arrays, one spectrum per row. Shifted spectra are evaluated
+  on the original X-axis, Yshifted(x)=Y(x-shift). It is assumed a constant bin size.
+    method='linear': linear interpolation between neighbor bins. For histograms, this is
+                     what Mantid::Rebin does after Mantid::ScaleX (see itp_simple). Values
+                     shifted from outside the X-axis range are zero.
+    method='fourier': phase shift of the Fourier transform of each spectrum. Spectra are
+                      assumed periodic along the X-axis.
+
+  Arguments:
+    X: X-axis values (bin boundaries or points), only the bin width is used
+    Y: 1D or 2D numpy array, spectra to be shifted
+    shift: real quantity to shift along the X-axis
+    [method]: 'linear' or 'fourier'
+
+  Returns:
+    Yshifted: shifted spectra, same shape as Y
+    derivative: derivative of Yshifted with respect to shift
+  '''
+  import numpy
+  Y=numpy.asarray(Y,dtype=float)
+  width=X[1]-X[0] # assume constant bin size
+  n=Y.shape[-1]
+  if method=='linear':
+    u=shift/width
+    k=int(numpy.floor(u))
+    f=u-k
+    def take(offset):
+      """spectra displaced by offset bins, padded with zeros"""
+      out=numpy.zeros(Y.shape)
+      if abs(offset)<n:
+        if offset>=0: out[...,offset:]=Y[...,:n-offset]
+        else: out[...,:n+offset]=Y[...,-offset:]
+      return out
+    Y0=take(k)   # Y[j-k]
+    Y1=take(k+1) # Y[j-k-1]
+    return (1-f)*Y0+f*Y1, (Y1-Y0)/width
+  elif method=='fourier':
+    w=2*numpy.pi*numpy.fft.rfftfreq(n,width) # angular frequencies
+    transform=numpy.fft.rfft(Y,axis=-1)*numpy.exp(-1j*w*shift)
+    dtransform=-1j*w*transform
+    if n%2==0: dtransform[...,-1]=0 # derivative of the Nyquist component is not defined
+    return numpy.fft.irfft(transform,n,axis=-1), numpy.fft.irfft(dtransform,n,axis=-1)
+  raise ValueError('method must be one of "linear" or "fourier". Found: %s'%method)
+
+def itp_linear(workspace,shift,newWorkspace=None):
+  '''For all spectra of a mantid workspace, shift a small amount by linear interpolation.
+
+  Same result as itp_simple, but computed with numpy (see shiftarrays) instead of running
+  Mantid algorithms. If newWorkspace is not passed, the input workspace is overwritten.
+
+  Arguments:
+    workspace: Mantid workspace
+    shift: real quantity to shift along the X-axis
+    [newWorkspace]: string, if not passed, overwrite input workspace
+
+  Returns:
+    workspace object shifted and interpolated
+  '''
+  return _itp_arrays(workspace,shift,newWorkspace,'linear')
+
+def itp_fourier(workspace,shift,newWorkspace=None):
+  '''For all spectra of a mantid workspace, shift by a phase shift of their Fourier transforms
+
+  See shiftarrays for details. If newWorkspace is not passed, the input workspace is overwritten.
+
+  Arguments:
+    workspace: Mantid workspace
+    shift: real quantity to shift along the X-axis
+    [newWorkspace]: string, if not passed, overwrite input workspace
+
+  Returns:
+    workspace object shifted
+  '''
+  return _itp_arrays(workspace,shift,newWorkspace,'fourier')
+
+def _itp_arrays(workspace,shift,newWorkspace,method):
+  """Shift the spectra of a workspace with shiftarrays, overwriting the spectra in place"""
+  if newWorkspace:
+    from mantid.simpleapi import CloneWorkspace
+    workspace=CloneWorkspace(InputWorkspace=workspace,OutputWorkspace=newWorkspace)
+  Y=shiftarrays(workspace.readX(0),workspace.extractY(),shift,method=method)[0]
+  for i in range(workspace.getNumberHistograms()):
+    workspace.setY(i,Y[i])
+  return workspace
+
 if __name__ == "__main__":
+  from kernel.worker import forward
+  forward(__file__) # run the service in the persistent worker, if one is listening
   import argparse
   import sys
   import re
   if sys.version_info < (2,6): from sets import Set as set
-  p=argparse.ArgumentParser(description='Provider for services involving shift of calculated S(Q,E) model Available services are: itp_simple')
+  p=argparse.ArgumentParser(description='Provider for services involving shift of calculated S(Q,E) model Available services are: itp_simple, itp_linear, itp_fourier')
   p.add_argument('service', help='name of the service to invoke')
   p.add_argument('-explain', action='store_true', help='print message explaining the arguments to pass for the particular service')
   if set(['-h', '-help', '--help']).intersection(set(sys.argv)): args=p.parse_args() # check if help message is requested
@@ -60,10 +152,7 @@ if __name__ == "__main__":
       ws=itp_simple(ws, eshift)
       SaveNexus(InputWorkspace=ws.getName(),Filename=args.interpolated)
       if args.expdata and args.costfile:
+        from dakotahelper.results import writeResults
         chisq,wR=DakotaChiSquared(DataFile=args.expdata,CalculatedFile=args.interpolated,OutputFile=args.costfile,ResidualsWorkspace='wR')
-        f=open(args.costfile,'w')
-        for i in range(wR.getNumberHistograms()):
-            Ry=wR.readY(i)
-            for j in range(len(Ry)):
-                f.write(str(Ry[j])+" least_squares_term\n")
+        writeResults(args.costfile, wR.extractY().ravel(), label='least_squares_term')
 
@@ -0,0 +1,126 @@
+'''
+Block-structured Jacobian for beamline models fitting one spectrum per Q-value
+
+Residuals are ordered by spectrum, nE residuals per each of the nhist spectra.
+Parameters shared by all spectra (e.g. b0, b1, c0) have a column spanning all
+residuals. Parameters specific to one spectrum (e.g. e0.i) have a column with
+non-zero elements only for the residuals of spectrum i, thus the block of these
+columns is block-diagonal and is stored as a single (nhist, nE) array.
+The dense Jacobian is built only when serialized.
+
+Created on Oct 18, 2026
+'''
+#from pdb import set_trace as trace # uncomment only for debugging purposes
+
+class BlockJacobian(object):
+  """ Jacobian with shared columns and a block-diagonal part """
+
+  def __init__(self,nhist,nE):
+    """
+    Arguments:
+      nhist: number of spectra
+      nE: number of residuals per spectrum
+    """
+    self._nhist=nhist
+    self._nE=nE
+    self._shared={}   # columns of shared parameters, arrays broadcastable to shape (nhist,nE)
+    self._diagonal={} # parameter name --> index of the spectrum it applies to
+    self._blocks=None # (nhist,nE) array, row i holds the non-zero elements of the column for spectrum i
+
+  def shape(self):
+    """number of residuals and number of parameters"""
+    return (self._nhist*self._nE, len(self._shared)+len(self._diagonal))
+
+  def setShared(self,name,column):
+    """Column for a parameter shared by all spectra
+
+    Arguments:
+      name: parameter name
+      column: array broadcastable to shape (nhist,nE), or of length nhist*nE.
+              For instance, a scalar if the derivative is the same for all residuals,
+              or an array of length nE if it is the same for all spectra.
+    """
+    import numpy
+    column=numpy.asarray(column,dtype=float)
+    if column.ndim<2: # stored with two dimensions, broadcastable to (nhist,nE)
+      if column.size==self._nhist*self._nE:
+        column=column.reshape(self._nhist,self._nE)
+      else:
+        column=column.reshape(1,column.size)
+    self._shared[name]=column
+
+  def setBlockDiagonal(self,names,blocks):
+    """Columns for parameters each applying to one spectrum only
+
+    Arguments:
+      names: list of nhist parameter names, names[i] applies to spectrum i
+      blocks: (nhist,nE) array, blocks[i] is the derivative of the residuals of spectrum i
+              with respect to parameter names[i]
+    """
+    import numpy
+    if len(names)!=self._nhist:
+      raise ValueError('expected %d block-diagonal parameters, found %d'%(self._nhist,len(names)))
+    self._blocks=numpy.array(blocks,dtype=float).reshape(self._nhist,self._nE)
+    self._diagonal=dict([(name,i) for i,name in enumerate(names)])
+
+  def keys(self):
+    return list(self._shared.keys())+list(self._diagonal.keys())
+
+  def __contains__(self,name):
+    return name in self._shared or name in self._diagonal
+
+  def scaleRows(self,factors):
+    """Multiply each residual row by a factor
+
+    Arguments:
+      factors: array of shape (nhist,nE) or of length nhist*nE
+    """
+    import numpy
+    factors=numpy.asarray(factors,dtype=float).reshape(self._nhist,self._nE)
+    for name,column in self._shared.items():
+      self._shared[name]=column*factors
+    if self._blocks is not None: self._blocks=self._blocks*factors
+
+  def column(self,name):
+    """dense column for parameter name, as a 1D array of length nhist*nE"""
+    import numpy
+    col=numpy.zeros((self._nhist,self._nE))
+    if name in self._shared:
+      col+=self._shared[name]
+    else:
+      i=self._diagonal[name]
+      col[i]=self._blocks[i]
+    return col.ravel()
+  __getitem__=column # behave as the old dictionary of gradients
+
+  def iterblocks(self,names):
+    """Iterate over the dense rows of the Jacobian, one spectrum at a time
+
+    Arguments:
+      names: list of parameter names, determines the order of the columns
+
+    Returns:
+      generator of (nE, len(names)) arrays, one for each spectrum
+    """
+    import numpy
+    for i in range(self._nhist):
+      block=numpy.zeros((self._nE,len(names)))
+      for j,name in enumerate(names):
+        if name in self._shared:
+          column=self._shared[name]
+          block[:,j]=column[min(i,column.shape[0]-1)] # row i, or the only row if same for all spectra
+        elif self._diagonal[name]==i:
+          block[:,j]=self._blocks[i]
+      yield block
+
+  def toarray(self,names):
+    """dense Jacobian, of shape (nhist*nE, len(names))"""
+    import numpy
+    out=numpy.zeros((self._nhist,self._nE,len(names)))
+    for j,name in enumerate(names):
+      if name in self._shared:
+        out[:,:,j]=self._shared[name]
+      else:
+        i=self._diagonal[name]
+        out[i,:,j]=self._blocks[i]
+    return out.reshape(self._nhist*self._nE,len(names))
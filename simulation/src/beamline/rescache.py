@@ -0,0 +1,90 @@
+'''
+Cache of resolution kernels, the symmetrized and rebinned resolution
+function together with its Fourier transform.
+
+The resolution does not change during a fit, thus the kernel is computed
+on the first Dakota iteration and then reused. Kernels are stored in memory,
+for the lifetime of the process, and on disk, for later processes.
+Entries are keyed on the content hash of the resolution file, the target
+bin width, and the length of the signals to be convolved.
+
+Created on Oct 18, 2026
+'''
+#from pdb import set_trace as trace # uncomment only for debugging purposes
+import os
+
+memory={} # in-memory kernels, indexed by cache key
+hashes={} # content hash of files, indexed by (path, modification time, size)
+
+def defaultCacheDir():
+  """Directory for the on-disk cache, given by environment variable CAMM_CACHE_DIR or ~/.camm/cache"""
+  return os.environ.get('CAMM_CACHE_DIR', os.path.join(os.path.expanduser('~'),'.camm','cache'))
+
+def fileHash(filename):
+  """SHA1 hash of the contents of a file. Files not modified since last call are not read again"""
+  import hashlib
+  st=os.stat(filename)
+  stamp=(os.path.abspath(filename),st.st_mtime,st.st_size)
+  if stamp not in hashes:
+    sha=hashlib.sha1()
+    f=open(filename,'rb')
+    chunk=f.read(1048576)
+    while chunk:
+      sha.update(chunk)
+      chunk=f.read(1048576)
+    f.close()
+    hashes[stamp]=sha.hexdigest()
+  return hashes[stamp]
+
+def cacheKey(resolution,width,nsignal):
+  """Key for the kernel derived from a resolution file"""
+  return '%s_%.10e_%d'%(fileHash(resolution),width,nsignal)
+
+class ResolutionCache(object):
+  """ Store and retrieve resolution kernels, see convolve.transform_responses """
+
+  def __init__(self,cachedir=None):
+    """
+    Arguments:
+      [cachedir]: directory for the on-disk cache. If None, defaultCacheDir() is used.
+                  If empty string, kernels are stored in memory only.
+    """
+    if cachedir is None: cachedir=defaultCacheDir()
+    self._cachedir=cachedir
+
+  def _path(self,key):
+    return os.path.join(self._cachedir,'resolution_%s.npz'%key)
+
+  def get(self,resolution,width,nsignal):
+    """Retrieve a kernel, or None if not found in memory or disk"""
+    import numpy
+    key=cacheKey(resolution,width,nsignal)
+    if key in memory: return memory[key]
+    if not self._cachedir or not os.path.exists(self._path(key)): return None
+    try:
+      stored=numpy.load(self._path(key))
+      kernel={'method':str(stored['method']), 'nsignal':int(stored['nsignal']),
+              'L':int(stored['L']), 'responses':stored['responses']}
+      if kernel['method']=='fft': kernel['transform']=stored['transform']
+      stored.close()
+    except Exception:
+      return None # corrupted or unreadable entry, will be overwritten by put()
+    memory[key]=kernel
+    return kernel
+
+  def put(self,resolution,width,nsignal,kernel):
+    """Store a kernel in memory and disk. Disk writes are atomic, so concurrent jobs can share the cache"""
+    import numpy
+    key=cacheKey(resolution,width,nsignal)
+    memory[key]=kernel
+    if not self._cachedir: return kernel
+    try:
+      if not os.path.isdir(self._cachedir): os.makedirs(self._cachedir)
+      tmpfile=self._path(key)+'.%d.tmp'%os.getpid()
+      f=open(tmpfile,'wb')
+      numpy.savez(f,**kernel)
+      f.close()
+      os.rename(tmpfile,self._path(key))
+    except (IOError,OSError):
+      pass # disk cache is an optimization only
+    return kernel
@@ -31,6 +31,8 @@ def elasticLineLowTemp(insqe, outres=None):
   return wsr
 
 if __name__ == "__main__":
+  from kernel.worker import forward
+  forward(__file__) # run the service in the persistent worker, if one is listening
   import argparse
   import sys
   if sys.version_info < (2,6): from sets import Set as set
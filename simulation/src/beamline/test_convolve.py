@@ -0,0 +1,72 @@
+'''
+Checks of the batched convolution engine against numpy.convolve
+
+Created on Oct 18, 2026
+'''
+import os
+import sys
+import unittest
+import numpy
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from convolve import fftlength, camm_convolve, camm_convolve2d, transform_responses
+
+class FFTLengthTest(unittest.TestCase):
+
+  def test_smallest_5smooth(self):
+    """ fftlength(n) is the smallest integer >= n with prime factors 2, 3 and 5 only """
+    def smooth(m):
+      for p in (2,3,5):
+        while m%p==0: m//=p
+      return m==1
+    for n in range(1,2000):
+      expected=n
+      while not smooth(expected): expected+=1
+      self.assertEqual(fftlength(n),expected)
+
+class Convolve2dTest(unittest.TestCase):
+
+  def setUp(self):
+    rng=numpy.random.RandomState(7)
+    self.signals=rng.rand(5,97)
+    self.responses=rng.rand(5,31)
+
+  def test_against_numpy(self):
+    """ direct and FFT methods agree with camm_convolve, itself numpy.convolve, row by row """
+    for method in ('direct','fft'):
+      for mode in ('full','same','valid'):
+        result=camm_convolve2d(self.signals,self.responses,mode=mode,method=method)
+        for i in range(len(self.signals)):
+          expected=camm_convolve(self.signals[i],self.responses[i],mode=mode)
+          numpy.testing.assert_allclose(result[i],expected,rtol=1e-10,atol=1e-12)
+
+  def test_shared_response(self):
+    """ a one-dimensional response is applied to every signal """
+    response=self.responses[0]
+    for method in ('direct','fft'):
+      result=camm_convolve2d(self.signals,response,method=method)
+      for i in range(len(self.signals)):
+        numpy.testing.assert_allclose(result[i],camm_convolve(self.signals[i],response),rtol=1e-10,atol=1e-12)
+
+  def test_response_longer_than_signal(self):
+    """ mode 'same' follows numpy.convolve when the response is the longer array """
+    signals,responses=self.responses,self.signals
+    for method in ('direct','fft'):
+      result=camm_convolve2d(signals,responses,method=method)
+      for i in range(len(signals)):
+        numpy.testing.assert_allclose(result[i],camm_convolve(signals[i],responses[i]),rtol=1e-10,atol=1e-12)
+
+  def test_kernel_reuse(self):
+    """ a prepared kernel gives the same result, and is rebuilt for signals of another length """
+    kernel=transform_responses(self.responses,self.signals.shape[1],method='fft')
+    numpy.testing.assert_allclose(camm_convolve2d(self.signals,kernel=kernel),
+                                  camm_convolve2d(self.signals,self.responses,method='fft'),rtol=1e-12,atol=1e-12)
+    shorter=self.signals[:,:50]
+    numpy.testing.assert_allclose(camm_convolve2d(shorter,kernel=kernel),
+                                  camm_convolve2d(shorter,self.responses,method='fft'),rtol=1e-12,atol=1e-12)
+
+  def test_bad_mode(self):
+    self.assertRaises(ValueError,camm_convolve2d,self.signals,self.responses,mode='bogus')
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,85 @@
+'''
+Benchmark of the templating of atom lines, insertFFParamsNames of psf.py, against
+the previous scan of all seeds for every atom line
+
+Created on Oct 18, 2026
+'''
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from psf import insertFFParmName, insertFFParamsNames, isSameType
+
+class SyntheticAtom(object):
+  """ Minimal atom with the attributes used for templating, see benchmarkInsertFFParamsNames """
+  __slots__=('number','segid','name','resname')
+  def __init__(self,number,segid,name,resname):
+    self.number=number
+    self.segid=segid
+    self.name=name
+    self.resname=resname
+
+def benchmarkInsertFFParamsNames(natoms=100000,nseeds=20,repeat=1):
+  """ Compare insertFFParamsNames against the scan of all seeds for every atom line,
+  on a synthetic solvated system: a solute making 10% of the atoms, the rest water.
+  Seeds are solute atoms, thus most atom lines match no seed.
+
+  Arguments:
+    [natoms]: number of atoms of the synthetic PSF
+    [nseeds]: number of seeds, half of them extended
+    [repeat]: number of timings, the best one is reported
+
+  Returns:
+    dictionary with timings (in seconds) of the scan and the indexed versions, and the speed-up
+  """
+  import time
+  nsolute=max(natoms//10,nseeds)
+  atom_list=[]
+  atom_lines=[]
+  for i in range(natoms):
+    if i<nsolute:
+      atom=SyntheticAtom(i,'SOLU','R%02d'%(i//10%20),'A%d'%(i%10))
+    else:
+      atom=SyntheticAtom(i,'SOLV',('OH2','H1','H2')[i%3],'TIP3')
+    atom_list.append(atom)
+    atom_lines.append('%8d %-4s %-4d %-4s %-4s %-4s %14.6f %9.4f %11d\n'%(i+1,atom.segid,i//3+1,atom.resname,atom.name,atom.name,0.0,1.0,0))
+  seed_list=[(atom_list[(i*37)%nsolute],'FF%d'%(i+1),i%2) for i in range(nseeds)]
+
+  def scan(atom_lines,atom_list,seed_list,psf_format='STANDARD'):
+    """ previous implementation, every atom line against every seed """
+    buf=''
+    for index in range(len(atom_lines)):
+      atom1=atom_list[index]
+      line=atom_lines[index]
+      inserted=False
+      for (atom2,name,extend) in seed_list:
+        if atom1.number==atom2.number or (extend and isSameType(atom1,atom2)):
+          buf+=insertFFParmName(line,name,psf_format)
+          inserted=True
+          break
+      if not inserted: buf+=line
+    return buf
+
+  timings={}
+  for label,function in (('scan',scan),('indexed',insertFFParamsNames)):
+    best=None
+    for i in range(repeat):
+      start=time.time()
+      out=function(atom_lines,atom_list,seed_list)
+      elapsed=time.time()-start
+      if best is None or elapsed<best: best=elapsed
+    timings[label]=best
+    timings[label+'_output']=out
+  if timings.pop('scan_output')!=timings.pop('indexed_output'):
+    raise AssertionError('indexed and scan templates differ')
+  timings['speedup']=timings['scan']/max(timings['indexed'],1e-9)
+  return timings
+
+if __name__=='__main__':
+  from argparse import ArgumentParser
+  parser = ArgumentParser(description='time the templating of a synthetic PSF')
+  parser.add_argument('--natoms',type=int,default=100000,help='number of atoms of the synthetic PSF. Default is 100000')
+  parser.add_argument('--repeat',type=int,default=1,help='number of timings, the best one is reported. Default is 1')
+  args = parser.parse_args()
+  timings=benchmarkInsertFFParamsNames(natoms=args.natoms,repeat=args.repeat)
+  print('natoms=%d scan=%.3fs indexed=%.3fs speedup=%.1f'%(args.natoms,timings['scan'],timings['indexed'],timings['speedup']))
@@ -0,0 +1,133 @@
+'''
+Compact container for force field templates
+
+Replaces the XML force field template (see psf.generateFFtemplate) with a file
+that can be loaded without parsing the template text:
+
+  line 1: magic string and version, 'CAMMFFTPL 1'
+  line 2: JSON header with the FFParam attributes, the placeholder slots (as
+          indexes to the distinct pairs of parameter name and C-style format),
+          and the byte length of each chunk
+  rest:   blob of the literal chunks of the template, concatenated and UTF-8 encoded
+
+The template is stored pre-split into chunks and slots, as returned by
+ff_update.compileTemplate. Parameters are available after reading the header
+only; the blob is read on first access to the template.
+
+Created on Oct 18, 2026
+'''
+#from pdb import set_trace as trace  # only for interactive debugging purposes
+import json
+
+magic='CAMMFFTPL'
+version=1
+
+def isContainer(filename):
+  """True if filename is a force field template container, False if e.g. XML"""
+  f=open(filename,'rb')
+  head=f.read(len(magic))
+  f.close()
+  return head==magic.encode('ascii')
+
+def paramToDict(param):
+  """attributes of a FFParam object, same selection as FFParam.toElementTreeElement"""
+  attributes={}
+  for attribute,value in vars(param).items():
+    if attribute[0]=='_' and value: attributes[attribute[1:]]=str(value)
+  return attributes
+
+def paramFromDict(attributes):
+  """FFParam object from its attributes. Overloaded FFParam.__setattr__ takes care of types"""
+  from molmec.fftpl.psf import FFParam
+  param=FFParam()
+  valid_keys=vars(param).keys()
+  for key,value in attributes.items():
+    if '_'+key in valid_keys: param.__setattr__('_'+str(key), str(value))
+  return param
+
+def writeContainer(filename,params,compiled):
+  """ Save the force field template
+
+  Arguments:
+    filename: name of the container file
+    params: list of FFParam objects
+    compiled: (chunks, slots) as returned by ff_update.compileTemplate
+  """
+  chunks,slots=compiled
+  encoded=[chunk.encode('utf-8') for chunk in chunks]
+  kinds=sorted(set(slots)) # few distinct (name, format) pairs, slots store an index to them
+  index=dict([(kind,i) for i,kind in enumerate(kinds)])
+  header={'version':version, 'params':[paramToDict(param) for param in params],
+          'kinds':[list(kind) for kind in kinds], 'slots':[index[slot] for slot in slots],
+          'lengths':[len(x) for x in encoded]}
+  f=open(filename,'wb')
+  f.write(('%s %d\n'%(magic,version)).encode('ascii'))
+  f.write((json.dumps(header)+'\n').encode('utf-8'))
+  f.write(b''.join(encoded))
+  f.close()
+
+class FFTemplateContainer(object):
+  """ Lazy reader of a force field template container """
+
+  def __init__(self,filename):
+    self._filename=filename
+    f=open(filename,'rb')
+    line=f.readline().decode('ascii').split()
+    if len(line)!=2 or line[0]!=magic:
+      f.close()
+      raise ValueError('%s is not a force field template container'%filename)
+    if int(line[1])>version:
+      f.close()
+      raise ValueError('%s has container version %s, only up to %d supported'%(filename,line[1],version))
+    self._header=json.loads(f.readline().decode('utf-8'))
+    self._blob_offset=f.tell()
+    f.close()
+    self._compiled=None
+
+  def params(self):
+    """list of FFParam objects"""
+    return [paramFromDict(attributes) for attributes in self._header['params']]
+
+  def compiled(self):
+    """(chunks, slots) of the template, read from disk on first call"""
+    if self._compiled is None:
+      f=open(self._filename,'rb')
+      f.seek(self._blob_offset)
+      blob=f.read()
+      f.close()
+      chunks=[]
+      start=0
+      for length in self._header['lengths']:
+        chunks.append(blob[start:start+length].decode('utf-8'))
+        start+=length
+      kinds=[(str(name),str(cformat)) for name,cformat in self._header['kinds']]
+      slots=[kinds[i] for i in self._header['slots']]
+      self._compiled=(chunks,slots)
+    return self._compiled
+
+  def template(self):
+    """template text, with the placeholders, e.g. _FF1_(%-14.6f)"""
+    chunks,slots=self.compiled()
+    pieces=[None]*(len(chunks)+len(slots))
+    pieces[0::2]=chunks
+    pieces[1::2]=['_%s_(%s)'%slot for slot in slots]
+    return ''.join(pieces)
+
+def convertXML(xmlfile,filename):
+  """ Convert a XML force field template onto a container
+
+  Arguments:
+    xmlfile: XML force field template, see psf.generateFFtemplate
+    filename: name of the output container
+  """
+  from molmec.ffupdate.ff_update import loadFFtpl, compileTemplate
+  params,template=loadFFtpl(xmlfile)
+  writeContainer(filename,params,compileTemplate(template,[param._name for param in params]))
+
+if __name__=='__main__':
+  from argparse import ArgumentParser
+  parser = ArgumentParser(description='convert a XML force field template onto a compact container')
+  parser.add_argument('--xml', help='XML force field template file')
+  parser.add_argument('--fftpl', help='name of the output container file')
+  args = parser.parse_args()
+  convertXML(args.xml,args.fftpl)
@@ -43,12 +43,10 @@ class FFParam(object):
       self.__dict__[key]=val
   
   def resolveTie(self,free_params):
-    """ Assign value based on the tie expression """
+    """ Assign value based on the tie expression, see molmec.fftpl.tie """
     if not self.isFree():
-      tie=self._tie
-      for param in free_params:
-        tie=tie.replace(param._name,str(param._value))
-      self._value=eval(tie)
+      from molmec.fftpl.tie import evaluateTie
+      self._value=evaluateTie(self._tie,dict([(param._name,param._value) for param in free_params]))
     return self._value
 
   def toElementTreeElement(self):
@@ -141,29 +139,78 @@ def resolvePSFformat(psf_file):
     psf_format = "EXTENDED"    # CHARMM
   return psf_format
 
+# fixed columns of the atom lines, (start, end) of atom ID, segid, resid, resname, name, type, charge, mass
+psf_columns={'STANDARD':((0,8),(9,13),(14,18),(19,23),(24,28),(29,33),(34,48),(48,62)),
+             'EXTENDED':((0,10),(11,19),(20,28),(29,37),(38,46),(47,51),(52,66),(66,80))}
+
+def splitAtomLine(line,psf_format):
+  """ atom ID, segid, resid, resname, name, type, charge, mass of one atom line """
+  if psf_format in psf_columns:
+    try:
+      fields=[line[start:end].strip() for start,end in psf_columns[psf_format]]
+      int(fields[0]); float(fields[6]); float(fields[7]) # check the columns are right
+      return fields
+    except ValueError:
+      pass # not aligned to the fixed columns, split by whitespace as in NAMD format
+  return line.split()[0:8]
+
+def readPSF(psf_file):
+  """ Read the topology file in a single streaming pass, without MDAnalysis
+
+  Returns:
+    dictionary with keys
+      'format': 'STANDARD', 'EXTENDED' or 'NAMD', see resolvePSFformat
+      'atoms': numpy record array with fields number (atom ID minus one), segid,
+               resid, resname, name, type, charge, and mass. Records have the
+               attributes used by isSameType and insertFFParamsNames
+      'prelines': lines of the topology file up to and including the !NATOM line
+      'atom_lines': list of the atom lines
+      'suflines': lines of the topology file after the atom lines
+      'sections': dictionary with the byte offset of each section header line,
+                  indexed by section name, e.g. sections['NATOM']
+  """
+  import re
+  import numpy
+  psf_format=resolvePSFformat(psf_file)
+  header_pattern=re.compile(r'^\s*\d+(\s+\d+)*\s+!(\w+)')
+  sections={}
+  prelines=[]
+  atom_lines=[]
+  suflines=[]
+  columns=[[] for i in range(8)]
+  pf=open(psf_file,'rb')
+  offset=0
+  natoms=None
+  for line in pf:
+    start=offset
+    offset+=len(line)
+    if not isinstance(line,str): line=line.decode('latin-1')
+    if natoms is None: # before the atom lines
+      prelines.append(line)
+      match=header_pattern.match(line)
+      if match:
+        sections[match.group(2)]=start
+        if match.group(2)=='NATOM': natoms=int(line.split()[0])
+    elif len(atom_lines)<natoms:
+      atom_lines.append(line)
+      for column,field in zip(columns,splitAtomLine(line,psf_format)): column.append(field)
+    else:
+      suflines.append(line)
+      match=header_pattern.match(line)
+      if match: sections[match.group(2)]=start
+  pf.close()
+  if natoms is None:
+    raise PSFParseError("%s has no !NATOM section" % psf_file)
+  atoms=numpy.rec.fromarrays([numpy.array(columns[0],dtype=int)-1]+[numpy.array(x) for x in columns[1:6]]+
+                             [numpy.array(x,dtype=float) for x in columns[6:8]],
+                             names=('number','segid','resid','resname','name','type','charge','mass'))
+  return {'format':psf_format, 'atoms':atoms, 'prelines':''.join(prelines), 'atom_lines':atom_lines,
+          'suflines':''.join(suflines), 'sections':sections}
+
 def parsePSF(psf_file):
-  """parse the topology file"""
-  from MDAnalysis.topology.PSFParser import parse
-  atom_list=parse(psf_file)['_atoms'] #list of MDAnalysis.core.AtomGroup.Atom objects
-  #store the atom lines
-  prelines='' # lines of the topology file before the atom lines
-  atom_lines=[] # store the atom lines
-  suflines='' # lines of the topology file after the atom lines
-  pf=open(psf_file,'r')
-  line=pf.readline()
-  prelines += line
-  while '!NATOM' not in line: 
-    line=pf.readline()
-    prelines += line
-  nlines=int(line.split()[0])
-  iline=0
-  while iline<nlines: 
-    atom_lines.append(pf.readline())
-    iline +=1
-  while line:
-    suflines+=line
-    line=pf.readline()
-  return [atom_list,prelines,atom_lines,suflines]
+  """parse the topology file, see readPSF"""
+  psf=readPSF(psf_file)
+  return [psf['atoms'],psf['prelines'],psf['atom_lines'],psf['suflines']]
 
 def isSameType(atom1,atom2):
   """compare types between two atoms. In this case we require that
@@ -187,20 +234,28 @@ def insertFFParmName(line,name,psf_format):
   pass
 
 def insertFFParamsNames(atom_lines,atom_list,seed_list,psf_format='STANDARD'):
-  """ Insert force field parameter names where needed """
-  buf=''
+  """ Insert force field parameter names where needed
+
+  Seeds are indexed by atom number and, if extended, by (segid, name, resname),
+  so each atom line is matched with a couple of dictionary lookups. When several
+  seeds match an atom, the first one in seed_list is applied.
+  """
+  byNumber={} # atom number --> index of first seed with that atom
+  byType={}   # (segid, name, resname) --> index of first extended seed of that type
+  for iseed,(atom2,name,extend) in enumerate(seed_list):
+    byNumber.setdefault(atom2.number,iseed)
+    if extend: byType.setdefault((atom2.segid,atom2.name,atom2.resname),iseed)
+  nseeds=len(seed_list)
+  buf=[]
   for index in range(len(atom_lines)):
     atom1=atom_list[index]
     line=atom_lines[index]
-    inserted=False
-    #check atom1 is same type than some atom of seed_list
-    for (atom2,name,extend) in seed_list:
-      if atom1==atom2 or (extend and isSameType(atom1,atom2)):
-        buf+=insertFFParmName(line,name,psf_format)
-        inserted=True
-        break
-    if not inserted: buf+=line
-  return buf
+    iseed=min(byNumber.get(atom1.number,nseeds), byType.get((atom1.segid,atom1.name,atom1.resname),nseeds))
+    if iseed<nseeds:
+      buf.append(insertFFParmName(line,seed_list[iseed][1],psf_format))
+    else:
+      buf.append(line)
+  return ''.join(buf)
 
 def generateFFtemplate(params,buf):
   """ generate force field template XML"""
@@ -234,7 +289,7 @@ if __name__=='__main__':
   parser.add_argument('--fftpl',help='name of the output XML force field template file')
   args = parser.parse_args()
 
-  # atom_list is a list of MDAnalysis.core.AtomGroup.Atom objects
+  # atom_list is a numpy record array of the atom columns, one record per atom (see readPSF)
   [atom_list,buf,atom_lines,suflines]=parsePSF(args.ff)
   seed_list=initSeedAtomList(args.conf,atom_list) #list of atoms serving as seed
   buf+=insertFFParamsNames(atom_lines,atom_list,seed_list,
@@ -0,0 +1,47 @@
+'''
+Checks of the safe evaluator of tie expressions
+
+Created on Oct 18, 2026
+'''
+import os
+import sys
+import unittest
+import numpy
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from tie import TieError, compileTie, evaluateTie, tieVariables
+
+class CompileTieTest(unittest.TestCase):
+
+  def test_unsafe_expressions(self):
+    """ anything but arithmetic on variables, numbers and whitelisted functions is rejected """
+    for expression in ("__import__('os').system('true')",
+                       "FF1.__class__",
+                       "open('/etc/passwd')",
+                       "exp(FF1).real",
+                       "[FF1 for FF1 in (1,2)]",
+                       "lambda: FF1",
+                       "FF1 if FF1 else 0",
+                       "FF1[0]",
+                       "'a'*FF1",
+                       "exp(x=FF1)",
+                       "FF1 < 2",
+                       "FF1; FF2",
+                       "eval('1')",
+                       ):
+      self.assertRaises(TieError,compileTie,expression)
+
+  def test_variables(self):
+    """ variables are whole names, FF1 and FF10 are not confused, functions are not variables """
+    self.assertEqual(tieVariables('-2*FF1+sqrt(FF10)'),set(['FF1','FF10']))
+
+  def test_evaluate(self):
+    self.assertAlmostEqual(evaluateTie('-2*FF1',{'FF1':0.417}),-0.834)
+    self.assertAlmostEqual(evaluateTie('FF1/2',{'FF1':1}),0.5) # true division
+    numpy.testing.assert_allclose(evaluateTie('exp(FF1)-FF2',{'FF1':numpy.zeros(3),'FF2':numpy.arange(3.)}),[1.,0.,-1.])
+
+  def test_missing_value(self):
+    self.assertRaises(TieError,evaluateTie,'FF1+FF2',{'FF1':1.0})
+
+if __name__ == "__main__":
+  unittest.main()
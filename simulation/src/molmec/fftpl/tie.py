@@ -0,0 +1,123 @@
+'''
+Safe evaluation of the tie expressions of force field parameters
+
+A tie expression, e.g. '-2*FF1', is parsed once into a syntax tree, checked
+against a whitelist of arithmetic operations and functions, and compiled.
+Compiled expressions are cached for the lifetime of the process, indexed by
+the expression string. Names are variables of the expression, thus FF1 and
+FF10 are never confused.
+
+Values can be scalars or numpy arrays, so that ties are resolved for a batch
+of parameter vectors with a single evaluation of each expression.
+
+Created on Oct 18, 2026
+'''
+#from pdb import set_trace as trace  # only for interactive debugging purposes
+import ast
+import __future__
+
+compiled={} # compiled expressions and their variables, indexed by expression string
+
+def functions():
+  """functions allowed in tie expressions. numpy versions work on scalars and arrays"""
+  import numpy
+  return {'exp':numpy.exp, 'log':numpy.log, 'sqrt':numpy.sqrt, 'abs':numpy.abs}
+
+allowed_nodes=(ast.Expression, ast.BinOp, ast.UnaryOp, ast.Name, ast.Load, ast.Call,
+               ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+constant_nodes=tuple([getattr(ast,x) for x in ('Num','Constant') if hasattr(ast,x)])
+
+class TieError(ValueError):
+  """Signifies a tie expression that is not valid or cannot be resolved"""
+  pass
+
+def compileTie(expression):
+  """ Parse and compile a tie expression
+
+  Returns:
+    (code, variables): code object, and set of variable names in the expression
+  """
+  if expression in compiled: return compiled[expression]
+  try:
+    tree=ast.parse(expression.strip(),mode='eval')
+  except SyntaxError:
+    raise TieError('invalid tie expression: %s'%expression)
+  allowed_functions=functions()
+  variables=set()
+  for node in ast.walk(tree):
+    if isinstance(node,constant_nodes):
+      if not isinstance(getattr(node,'n',getattr(node,'value',None)),(int,float)):
+        raise TieError('only numeric constants are allowed in tie expression: %s'%expression)
+    elif not isinstance(node,allowed_nodes):
+      raise TieError('%s not allowed in tie expression: %s'%(node.__class__.__name__,expression))
+    elif isinstance(node,ast.Call):
+      if not isinstance(node.func,ast.Name) or node.func.id not in allowed_functions or node.keywords:
+        raise TieError('only functions %s are allowed in tie expression: %s'%(', '.join(sorted(allowed_functions)),expression))
+    elif isinstance(node,ast.Name) and node.id not in allowed_functions:
+      variables.add(node.id)
+  code=compile(tree,'<tie>','eval',__future__.division.compiler_flag) # true division, as for floats
+  compiled[expression]=(code,variables)
+  return compiled[expression]
+
+def tieVariables(expression):
+  """set of variable names in a tie expression"""
+  return compileTie(expression)[1]
+
+def evaluateTie(expression,values):
+  """ Evaluate a tie expression
+
+  Arguments:
+    expression: tie expression, e.g. '-2*FF1'
+    values: dictionary of variable values, scalars or numpy arrays
+
+  Returns:
+    value of the expression, a float if all values are scalars
+  """
+  code,variables=compileTie(expression)
+  missing=variables.difference(values.keys())
+  if missing: raise TieError('no value for %s in tie expression: %s'%(', '.join(sorted(missing)),expression))
+  namespace=functions()
+  namespace['__builtins__']={}
+  result=eval(code,namespace,dict([(name,values[name]) for name in variables]))
+  if getattr(result,'ndim',0)==0: result=float(result)
+  return result
+
+def tieOrder(params):
+  """ Order the tied parameters so that each comes after the tied parameters it depends on
+
+  Arguments:
+    params: list of FFParam objects
+
+  Returns:
+    list of the tied FFParam objects, in order of evaluation
+  """
+  tied=dict([(param._name,param) for param in params if not param.isFree()])
+  order=[]
+  state={} # name --> 1 while visiting its dependencies, 2 when added to order
+  def visit(name,path):
+    if state.get(name)==2: return
+    if state.get(name)==1: raise TieError('circular ties: %s'%' -> '.join(path+[name]))
+    state[name]=1
+    for dependency in sorted(tieVariables(tied[name]._tie)):
+      if dependency in tied: visit(dependency,path+[name])
+    state[name]=2
+    order.append(tied[name])
+  for param in params:
+    if param._name in tied: visit(param._name,[])
+  return order
+
+def resolveTies(params,values):
+  """ Values of the tied parameters, given the values of the free parameters
+
+  Arguments:
+    params: list of FFParam objects
+    values: dictionary of free parameter values, scalars or numpy arrays (one
+            element per parameter vector of a batch)
+
+  Returns:
+    dictionary with the values of all parameters
+  """
+  values=dict(values)
+  for param in tieOrder(params):
+    values[param._name]=evaluateTie(param._tie,values)
+  return values
@@ -0,0 +1,180 @@
+'''
+Cache of Dakota evaluations, stored in an SQLite database
+
+Each evaluation is keyed on the values of all free force field parameters,
+quantized with the tolerance of each parameter. Stored along the key are the
+tag of the evaluation (the extension of the Dakota params file, e.g. '12' for
+params.in.12) and the files generated by the downstream chain: force field
+(PSF), trajectory (DCD), Sassena output (HDF5) and Dakota results file.
+An evaluation is registered when its force field is written, but it is
+complete only when its results file exists. Only complete evaluations are
+hits, allowing to skip the whole molecular dynamics and scattering chain.
+Crashed or still running evaluations are run again.
+
+ff_update --evalcache looks up and registers evaluations. The Dakota driver
+(dakota/opt_driver) completes them once the results file is in place, with
+environment variables CAMM_EVALCACHE and CAMM_FFTPL naming the database and
+the force field template.
+
+Created on Oct 18, 2026
+'''
+#from pdb import set_trace as trace  # only for interactive debugging purposes
+import os
+
+artifacts=('psf','dcd','hdf5','results') # files stored for each evaluation
+
+def evaluationKey(values,tolerances=None,digits=8):
+  """Quantized key for a parameter vector
+
+  Two parameter vectors have the same key if each parameter rounds to the same
+  multiple of its tolerance. Parameters with no tolerance are rounded to a
+  number of significant digits.
+
+  Arguments:
+    values: dictionary of free parameter values
+    [tolerances]: dictionary of parameter tolerances
+    [digits]: significant digits for parameters with no tolerance
+
+  Returns:
+    key string, e.g. 'FF1=1530;FF2=-4.21000000e-01'
+  """
+  if tolerances is None: tolerances={}
+  items=[]
+  fmt='%s=%.'+str(digits-1)+'e'
+  for name in sorted(values.keys()):
+    tolerance=tolerances.get(name)
+    if tolerance:
+      items.append('%s=%d'%(name,int(round(values[name]/tolerance))))
+    else:
+      items.append(fmt%(name,values[name]))
+  return ';'.join(items)
+
+class EvalCache(object):
+  """ Store and look up Dakota evaluations """
+
+  def __init__(self,dbfile,digits=8):
+    """
+    Arguments:
+      dbfile: SQLite database file, created if it does not exist
+      [digits]: significant digits for parameters with no tolerance, see evaluationKey
+    """
+    import sqlite3
+    self._digits=digits
+    self._conn=sqlite3.connect(dbfile,timeout=60) # concurrent Dakota evaluations may share the database
+    self._conn.execute('CREATE TABLE IF NOT EXISTS evaluations (key TEXT PRIMARY KEY, tag TEXT, %s)'%', '.join(['%s TEXT'%x for x in artifacts]))
+    self._conn.commit()
+
+  def key(self,params):
+    """Key for a list of free FFParam objects"""
+    values=dict([(param._name,param._value) for param in params])
+    tolerances=dict([(param._name,param._tolerance) for param in params])
+    return evaluationKey(values,tolerances=tolerances,digits=self._digits)
+
+  def lookup(self,params):
+    """Previous complete evaluation for a list of free FFParam objects
+
+    Returns:
+      dictionary with keys 'tag' and the artifacts, or None if not found or
+      if the results file of the evaluation does not exist
+    """
+    row=self._conn.execute('SELECT tag, %s FROM evaluations WHERE key=?'%', '.join(artifacts),(self.key(params),)).fetchone()
+    if row is None: return None
+    hit=dict(zip(('tag',)+artifacts,row))
+    if not hit['tag'] or not hit['results'] or not os.path.isfile(hit['results']): return None
+    return hit
+
+  def register(self,params,**kwargs):
+    """Insert or update an evaluation, without completing it
+
+    Arguments:
+      params: list of free FFParam objects
+      kwargs: file names for the artifacts (psf, dcd, hdf5). Only the passed ones are updated
+    """
+    if 'results' in kwargs: raise KeyError('results are registered with complete()')
+    self._update(params,**kwargs)
+
+  def complete(self,params,tag,results,**kwargs):
+    """Mark an evaluation as complete, once its results file is written
+
+    Arguments:
+      params: list of free FFParam objects
+      tag: tag of the evaluation
+      results: Dakota results file of the evaluation
+      kwargs: file names for other artifacts (psf, dcd, hdf5)
+    """
+    if not os.path.isfile(results): raise IOError('results file %s does not exist'%results)
+    self._update(params,tag=tag,results=results,**kwargs)
+
+  def _update(self,params,tag=None,**kwargs):
+    """Insert or update the row of an evaluation"""
+    unknown=set(kwargs.keys()).difference(artifacts)
+    if unknown: raise KeyError('unknown artifacts: %s'%', '.join(sorted(unknown)))
+    key=self.key(params)
+    self._conn.execute('INSERT OR IGNORE INTO evaluations (key) VALUES (?)',(key,))
+    columns=dict([(name,os.path.abspath(value)) for name,value in kwargs.items() if value])
+    if tag is not None: columns['tag']=tag
+    if columns:
+      names=sorted(columns.keys())
+      self._conn.execute('UPDATE evaluations SET %s WHERE key=?'%', '.join(['%s=?'%x for x in names]),
+                         tuple([columns[x] for x in names])+(key,))
+    self._conn.commit()
+
+  def close(self):
+    self._conn.close()
+
+def freeParams(fftpl_file,dakota_vals):
+  """Free FFParam objects of the template, with values from the Dakota params file"""
+  from ff_update import loadFFParams
+  params=loadFFParams(fftpl_file) # parameters only, the template is not needed
+  free_params=[param for param in params if param.isFree()]
+  for param in free_params: param._value=dakota_vals[param._name]
+  return free_params
+
+def completeEvaluation(dbfile,fftpl_file,paramsFile,results,tag=None,**kwargs):
+  """Mark the evaluation of a Dakota params file as complete
+
+  Arguments:
+    dbfile: SQLite database file
+    fftpl_file: force field template, with the free parameters and their tolerances
+    paramsFile: Dakota params file of the evaluation
+    results: Dakota results file of the evaluation
+    [tag]: tag of the evaluation. Default is the extension of the params file, e.g. '12' for params.in.12
+    kwargs: file names for other artifacts (psf, dcd, hdf5)
+  """
+  from ff_update import getParams
+  if tag is None: tag=paramsFile.split('in.')[1]
+  cache=EvalCache(dbfile)
+  try:
+    cache.complete(freeParams(fftpl_file,getParams(paramsFile)[0]),tag,results,**kwargs)
+  finally:
+    cache.close()
+
+if __name__ == "__main__":
+  import argparse
+  import sys
+  parser = argparse.ArgumentParser(description='Cache of Dakota evaluations. Available services are: lookup, register, complete')
+  parser.add_argument('service',help='"lookup" prints the tag of a previous complete evaluation and exits with it, or exits with status 0 if not found. "register" stores the files of an evaluation. "complete" marks the evaluation as complete, once its results file exists')
+  parser.add_argument('--db',help='name of the SQLite database file')
+  parser.add_argument('--dak',help='name of the dakota params file')
+  parser.add_argument('--fftpl',help='force field template, used to find the free parameters and their tolerances. Ex: --fftpl=fftpl.xml')
+  parser.add_argument('--tag',help='tag of the evaluation, for the "complete" service. Default is the extension of the dakota params file')
+  for name in artifacts:
+    parser.add_argument('--'+name,help='name of the %s file of the evaluation'%name)
+  args = parser.parse_args()
+
+  from ff_update import getParams
+  if args.service=='complete':
+    completeEvaluation(args.db,args.fftpl,args.dak,args.results,tag=args.tag,
+                       **dict([(name,getattr(args,name)) for name in artifacts if name!='results']))
+    sys.exit(0)
+  cache=EvalCache(args.db)
+  free_params=freeParams(args.fftpl,getParams(args.dak)[0])
+  if args.service=='lookup':
+    hit=cache.lookup(free_params)
+    if hit:
+      sys.stdout.write(hit['tag'])
+      sys.exit(hit['tag'])
+    sys.exit(0)
+  elif args.service=='register':
+    cache.register(free_params,**dict([(name,getattr(args,name)) for name in artifacts if name!='results']))
+  cache.close()
@@ -11,8 +11,13 @@ from molmec.fftpl.psf import FFParam
 
 def loadFFtpl(fftpl_file):
   """From the XML file containing the list of FFParam objects
-  and the force-field template file, load these items
+  and the force-field template file, load these items.
+  Also loads the compact container format, see molmec.fftpl.container
   """
+  from molmec.fftpl.container import isContainer, FFTemplateContainer
+  if isContainer(fftpl_file):
+    container=FFTemplateContainer(fftpl_file)
+    return container.params(),container.template()
   from xml.etree.ElementTree import parse
   root = parse(fftpl_file).getroot()
   params=[]
@@ -22,6 +27,34 @@ def loadFFtpl(fftpl_file):
   template=root.find('FFTemplate').text
   return params,template
 
+def loadFFParams(fftpl_file):
+  """Load only the list of FFParam objects, not the template.
+  Reads the header of the compact container, or the XML file up to the end of FFParams
+  """
+  from molmec.fftpl.container import isContainer, FFTemplateContainer
+  if isContainer(fftpl_file):
+    return FFTemplateContainer(fftpl_file).params()
+  from xml.etree.ElementTree import iterparse
+  params=[]
+  for event,element in iterparse(fftpl_file):
+    if element.tag=='FFParams':
+      for ff_param in element:
+        x=FFParam()
+        params.append(x.fromElementTreeElement(ff_param))
+      break
+  return params
+
+def loadCompiledFFtpl(fftpl_file):
+  """Load the list of FFParam objects and the compiled template (see compileTemplate).
+  The template in the compact container format is already compiled
+  """
+  from molmec.fftpl.container import isContainer, FFTemplateContainer
+  if isContainer(fftpl_file):
+    container=FFTemplateContainer(fftpl_file)
+    return container.params(),container.compiled()
+  params,template=loadFFtpl(fftpl_file)
+  return params,compileTemplate(template,[param._name for param in params])
+
 def getParams(paramsFile):
   """Load the params file from Dakota onto a standard dictionary"""
   from itertools import islice
@@ -38,28 +71,157 @@ def getParams(paramsFile):
   pf.close()
   return parms,parmstr
 
+def compileTemplate(template,names):
+  """ Split the template into literal chunks and placeholder slots.
+  Placeholders have the form _NAME_(%-14.6f), see updateTemplate.
+
+  Arguments:
+    template: force field template string
+    names: list of parameter names
+
+  Returns:
+    (chunks, slots): list of literal strings, and list of (name, C-style format)
+    tuples. There is one more chunk than slots, the template is chunks[0],
+    slots[0], chunks[1], slots[1],..., chunks[-1]
+  """
+  names=sorted(names, key=len, reverse=True) # longest first, in case a name contains another
+  pattern=re.compile('_(%s)_\((\%%\-\w+\.\w+)\)'%'|'.join([re.escape(name) for name in names]))
+  chunks=[]
+  slots=[]
+  start=0
+  for match in pattern.finditer(template):
+    chunks.append(template[start:match.start()])
+    slots.append(match.groups())
+    start=match.end()
+  chunks.append(template[start:])
+  return chunks,slots
+
+def renderTemplate(compiled,values):
+  """ Insert parameter values in a template compiled with compileTemplate, in one pass
+
+  Arguments:
+    compiled: (chunks, slots) as returned by compileTemplate
+    values: dictionary of parameter values, indexed by parameter name
+
+  Returns:
+    force field string
+  """
+  chunks,slots=compiled
+  pieces=[None]*(len(chunks)+len(slots)) # interleave chunks and formatted values
+  pieces[0::2]=chunks
+  pieces[1::2]=[cformat%values[name] for name,cformat in slots]
+  return ''.join(pieces)
+
+def resolveParams(params,values):
+  """ Update free parameters with values, then resolve the ties of the non-free parameters
+
+  Arguments:
+    params: list of FFParam objects
+    values: dictionary of free parameter values, indexed by parameter name
+
+  Returns:
+    dictionary of all parameter values, indexed by parameter name
+  """
+  from molmec.fftpl.tie import resolveTies
+  free_params=[param for param in params if param.isFree()]
+  for param in free_params: param._value=values[param._name] # Update free param values
+  values=resolveTies(params,dict([(param._name,param._value) for param in free_params])) # ties in order of dependency
+  for param in params:
+    if not param.isFree(): param._value=values[param._name] # Update non-free param values
+  return values
+
 def updateTemplate(template,params):
   """ Insert actual values for the parameters in the template.
   The formatting to insert the values is contained in the template.
   Example: _FF1_(%-14.6) indicates substitute parameter FF1 with its
   current value with a C-style format of %-14.6.
   """
-  for param in params:
-    cformats=re.findall("_%s_"%param._name+'\((\%\-\w+\.\w+)\)',template)
-    cformats=list(set(cformats)) # Remove duplicates
-    for cformat in cformats:
-      template=template.replace("_%s_(%s)"%(param._name,cformat), cformat%param._value)
-  return template
+  compiled=compileTemplate(template,[param._name for param in params])
+  return renderTemplate(compiled,dict([(param._name,param._value) for param in params]))
+
+def writeForceField(compiled,values,ffout,patcher=None):
+  """ Write the force field for values, patching a base PSF if patcher is passed (see psfpatch) """
+  if patcher is not None:
+    patcher.write(values,ffout)
+  else:
+    open(ffout,'w').write(renderTemplate(compiled,values))
+
+def writeParamsVariant(paramsFile,outFile,name,value):
+  """ Copy the Dakota params file, changing the value of one parameter only.
+  Only the descriptor line of the parameter is changed, e.g. '  1.53e+00 FF1'
+  """
+  lines=open(paramsFile).readlines()
+  for i,line in enumerate(lines):
+    items=line.split()
+    if len(items)==2 and items[1]==name:
+      lines[i]=line.replace(items[0],'%.15e'%value,1) # same format as Dakota
+      break
+  open(outFile,'w').write(''.join(lines))
+
+def generateVariants(params,compiled,paramsFile,dakota_vals,ffout,step=0.01,patcher=None):
+  """ Generate the base force field and the forward and backward variants for every free parameter
+
+  Forward and backward variants of parameter NAME have value*(1+step) and value*(1-step)
+  (+step and -step if the value is zero), with ties resolved for each variant. For each
+  variant, a Dakota params file and a force field file are written, with suffixes
+  _1 (forward) and _0 (backward) if there is a single free parameter, as expected by the
+  workflow and by assemblemodel, or _NAME_1 and _NAME_0 otherwise.
+
+  Arguments:
+    params: list of FFParam objects
+    compiled: template compiled with compileTemplate
+    paramsFile: Dakota params file
+    dakota_vals: dictionary of parameter values in the Dakota params file
+    ffout: name of the output force field for the base parameter values
+    [step]: relative step of the finite differences
+    [patcher]: psfpatch.PSFPatcher object, to write the force fields as patched copies of a base PSF
+
+  Returns:
+    manifest: dictionary listing all generated files, for the downstream jobs to fan out over
+  """
+  free_names=[param._name for param in params if param.isFree()]
+  base=dict([(name,dakota_vals[name]) for name in free_names])
+  writeForceField(compiled,resolveParams(params,base),ffout,patcher=patcher)
+  manifest={'params':os.path.abspath(paramsFile), 'ff':os.path.abspath(ffout), 'step':step, 'variants':[]}
+  for name in free_names:
+    h=step*abs(base[name]) or step
+    prefix='' if len(free_names)==1 else '_'+name
+    for direction,suffix in ((1,prefix+'_1'),(-1,prefix+'_0')):
+      values=dict(base)
+      values[name]=base[name]+direction*h
+      variantParams=paramsFile+suffix
+      variantFF=ffout.replace('.psf',suffix+'.psf')
+      writeParamsVariant(paramsFile,variantParams,name,values[name])
+      writeForceField(compiled,resolveParams(params,values),variantFF,patcher=patcher)
+      manifest['variants'].append({'parameter':name, 'direction':direction, 'value':values[name],
+                                   'params':os.path.abspath(variantParams), 'ff':os.path.abspath(variantFF)})
+  return manifest
 
 if __name__ == "__main__":
   parser = argparse.ArgumentParser(description='script generating updated force field')
   parser.add_argument('--dak',help='name of the dakota params file')
-  parser.add_argument('--fftpl',help='force field template, Ex: --fftpl=fftpl.xml')
+  parser.add_argument('--fftpl',help='force field template, XML or compact container (see molmec.fftpl.container). Ex: --fftpl=fftpl.xml')
   parser.add_argument('--ffout',help='name of the output force field. Ex: --ffout=ff.psf')
-  parser.add_argument('--pout',help='name of the output parameter file Ex: --pout=output.csv')
+  parser.add_argument('--pout',help='name of the output parameter file Ex: --pout=output.csv. Superseded by --evalcache')
+  parser.add_argument('--evalcache',help='SQLite database of previous evaluations, keyed on all free parameters. Ex: --evalcache=evaluations.db')
+  parser.add_argument('--batch',action='store_true',help='generate forward and backward variants for every free parameter, and a JSON manifest of all generated files')
+  parser.add_argument('--step',type=float,default=0.01,help='relative step of the variants in batch mode. Default is 0.01')
+  parser.add_argument('--manifest',help='name of the JSON manifest in batch mode. Default is the output force field with extension .json')
+  parser.add_argument('--patchbase',help='base PSF file. Force fields are written as copies of the base with the placeholder fields overwritten. The base and its index are created if missing or older than the template. Ex: --patchbase=ff_base.psf')
   args = parser.parse_args()
 
   dakota_vals,dakota_valstr = getParams(args.dak) # read in Dakota params file
+  if args.evalcache is not None:
+    from evalcache import EvalCache, freeParams
+    cache=EvalCache(args.evalcache)
+    free_params=freeParams(args.fftpl,dakota_vals)
+    hit=cache.lookup(free_params)
+    if hit: # previous complete evaluation, skip the downstream chain
+      cache.close()
+      sys.stdout.write(hit['tag'])
+      sys.exit(hit['tag'])
+    cache.register(free_params,psf=args.ffout) # completed by dakota/opt_driver once the results file is in place
+    cache.close()
   if args.pout is not None:
     data = {}
     if os.path.isfile(args.pout):
@@ -79,6 +241,20 @@ if __name__ == "__main__":
       w.writerow([key, val])
     g.close()
 
+  if args.batch:
+    import json
+    params,compiled=loadCompiledFFtpl(args.fftpl) # read in force field template file, scan the template only once
+    patcher=None
+    if args.patchbase:
+      from psfpatch import loadPatcher
+      patcher=loadPatcher(compiled,resolveParams(params,dakota_vals),args.patchbase,fftpl_file=args.fftpl)
+    manifest=generateVariants(params,compiled,args.dak,dakota_vals,args.ffout,step=args.step,patcher=patcher)
+    manifest['tag']=str(args.dak.split('in.')[1])
+    manifestFile=args.manifest or os.path.splitext(args.ffout)[0]+'.json'
+    open(manifestFile,'w').write(json.dumps(manifest,indent=2))
+    sys.stdout.write(manifest['tag'])
+    sys.exit(0)
+
   fwd_file = open(args.dak+'_1','w')
   old_file = open(args.dak)
   for line in old_file:
@@ -91,31 +267,15 @@ if __name__ == "__main__":
       bck_file.write(line.replace(str(dakota_valstr["FF1"]), str(0.99*dakota_vals["FF1"])))
   bck_file.close()
   old_file.close()
-  params,template=loadFFtpl(args.fftpl) # read in force field template file
-  free_params=[param for param in params if param.isFree()]
-  for param in free_params: param._value=1.01*dakota_vals[param._name] # Update free param values
-  for param in params:
-    if not param.isFree(): param.resolveTie(free_params) # Update non-free param values
-  template=updateTemplate(template,params)
-  ffoutf=args.ffout.replace('.psf','_1.psf')
-  open(ffoutf,'w').write(template)
-
-  params,template=loadFFtpl(args.fftpl) # read in force field template file
-  free_params=[param for param in params if param.isFree()]
-  for param in free_params: param._value=0.99*dakota_vals[param._name] # Update free param values
-  for param in params:
-    if not param.isFree(): param.resolveTie(free_params) # Update non-free param values
-  template=updateTemplate(template,params)
-  ffoutb=args.ffout.replace('.psf','_0.psf')
-  open(ffoutb,'w').write(template)
-  
-  params,template=loadFFtpl(args.fftpl) # read in force field template file
-  free_params=[param for param in params if param.isFree()]
-  for param in free_params: param._value=dakota_vals[param._name] # Update free param values
-  for param in params:
-    if not param.isFree(): param.resolveTie(free_params) # Update non-free param values
-  template=updateTemplate(template,params)
-  open(args.ffout,'w').write(template)
+  params,compiled=loadCompiledFFtpl(args.fftpl) # read in force field template file, scan the template only once
+  free_names=[param._name for param in params if param.isFree()]
+  patcher=None
+  if args.patchbase:
+    from psfpatch import loadPatcher
+    patcher=loadPatcher(compiled,resolveParams(params,dakota_vals),args.patchbase,fftpl_file=args.fftpl)
+  for scale,ffout in ((1.01,args.ffout.replace('.psf','_1.psf')), (0.99,args.ffout.replace('.psf','_0.psf')), (1.0,args.ffout)):
+    values=resolveParams(params,dict([(name,scale*dakota_vals[name]) for name in free_names]))
+    writeForceField(compiled,values,ffout,patcher=patcher)
   sys.stdout.write(str(args.dak.split('in.')[1]))
   sys.exit(0)
 
@@ -0,0 +1,126 @@
+'''
+Produce force fields by patching the placeholders of a base PSF file in place
+
+The force field template differs between Dakota iterations only in the values
+inserted in the placeholders, e.g. _FF1_(%-14.6f) in the charge column of a few
+atom lines. The base PSF is rendered once, together with an index holding the
+byte offset, width, format and parameter name of every placeholder. New force
+fields are a copy of the base PSF with the fixed-width fields overwritten.
+
+Formats with no width (e.g. %f in NAMD format) or values not fitting the width
+of the base rendering cannot be patched, and the whole template is rendered.
+
+Created on Oct 18, 2026
+'''
+#from pdb import set_trace as trace  # only for interactive debugging purposes
+import os
+
+def _nbytes(text):
+  """length of text once written to file"""
+  if isinstance(text,bytes): return len(text)
+  return len(text.encode('utf-8'))
+
+def indexFile(basefile):
+  """name of the file storing the index of the placeholders of basefile"""
+  return basefile+'.idx.npz'
+
+def createPatchBase(compiled,values,basefile):
+  """ Render the template onto the base PSF file, and store the index of the placeholders
+
+  Arguments:
+    compiled: template compiled with ff_update.compileTemplate
+    values: dictionary of parameter values for the base rendering
+    basefile: name of the base PSF file
+
+  Returns:
+    PSFPatcher object for basefile
+  """
+  import numpy
+  from ff_update import renderTemplate
+  chunks,slots=compiled
+  offsets=[]
+  widths=[]
+  offset=0
+  for chunk,(name,cformat) in zip(chunks,slots):
+    offset+=_nbytes(chunk)
+    width=_nbytes(cformat%values[name])
+    offsets.append(offset)
+    widths.append(width)
+    offset+=width
+  tmpfile=basefile+'.%d.tmp'%os.getpid()
+  open(tmpfile,'w').write(renderTemplate(compiled,values))
+  if os.path.exists(indexFile(basefile)): os.remove(indexFile(basefile)) # stale once the base is replaced
+  os.rename(tmpfile,basefile) # readers see either the previous or the new base, never a partial one
+  tmpfile=indexFile(basefile)+'.%d.tmp'%os.getpid()
+  f=open(tmpfile,'wb')
+  numpy.savez(f,offset=numpy.array(offsets,dtype=numpy.int64),width=numpy.array(widths,dtype=numpy.int32),
+              name=numpy.array([name for name,cformat in slots]),cformat=numpy.array([cformat for name,cformat in slots]))
+  f.close()
+  os.rename(tmpfile,indexFile(basefile)) # the index is valid only once complete
+  return PSFPatcher(basefile,compiled=compiled)
+
+class PSFPatcher(object):
+  """ Write force fields as patched copies of a base PSF file """
+
+  def __init__(self,basefile,compiled=None):
+    """
+    Arguments:
+      basefile: base PSF file, created with createPatchBase
+      [compiled]: compiled template, used to render the force field when patching is not possible
+    """
+    import numpy
+    self._basefile=basefile
+    self._compiled=compiled
+    index=numpy.load(indexFile(basefile))
+    self._offsets=index['offset'].tolist()
+    self._widths=index['width'].tolist()
+    self._names=[str(x) for x in index['name']]
+    self._cformats=[str(x) for x in index['cformat']]
+    index.close()
+
+  def patch(self,values,outfile):
+    """ Copy the base PSF onto outfile and overwrite the placeholder fields
+
+    Returns:
+      True if patched, False if some value does not fit the width of its field
+    """
+    import shutil
+    fields=[]
+    for offset,width,name,cformat in zip(self._offsets,self._widths,self._names,self._cformats):
+      field=(cformat%values[name]).encode('ascii')
+      if len(field)!=width: return False
+      fields.append((offset,field))
+    shutil.copyfile(self._basefile,outfile)
+    f=open(outfile,'r+b')
+    for offset,field in fields:
+      f.seek(offset)
+      f.write(field)
+    f.close()
+    return True
+
+  def write(self,values,outfile):
+    """ Patch the base PSF onto outfile, or render the whole template if patching is not possible """
+    from ff_update import renderTemplate
+    if not self.patch(values,outfile):
+      if self._compiled is None:
+        raise ValueError('values do not fit the fields of %s, and no template to render'%self._basefile)
+      open(outfile,'w').write(renderTemplate(self._compiled,values))
+
+def loadPatcher(compiled,values,basefile,fftpl_file=None):
+  """ PSFPatcher for basefile, creating the base PSF and its index if they
+  do not exist or are older than the template file
+
+  Arguments:
+    compiled: template compiled with ff_update.compileTemplate
+    values: dictionary of parameter values, used only if the base is created
+    basefile: name of the base PSF file
+    [fftpl_file]: force field template file the base was rendered from
+
+  Returns:
+    PSFPatcher object for basefile
+  """
+  index=indexFile(basefile)
+  if os.path.exists(basefile) and os.path.exists(index):
+    if fftpl_file is None or os.path.getmtime(index)>=os.path.getmtime(fftpl_file):
+      return PSFPatcher(basefile,compiled=compiled)
+  return createPatchBase(compiled,values,basefile)
@@ -0,0 +1,86 @@
+'''
+Checks of the evaluation cache, alone and through ff_update and the Dakota driver
+
+Created on Oct 18, 2026
+'''
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+here=os.path.dirname(os.path.abspath(__file__))
+src=os.path.abspath(os.path.join(here,'..','..'))
+sys.path[:0]=[here,src] # evalcache, and package molmec
+from evalcache import EvalCache, freeParams
+
+root=os.path.abspath(os.path.join(src,'..','..'))
+fftpl_file=os.path.join(root,'simulation','test','ce1.xml')
+driver=os.path.join(root,'dakota','opt_driver')
+
+def writeParams(filename,ff1):
+  """ Dakota params file with free parameter FF1 """
+  open(filename,'w').write('%43d variables\n%46.15e FF1\n%43d functions\n%43d ASV_1:obj_fn\n'%(1,ff1,1,1))
+
+class EvalCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.workdir=tempfile.mkdtemp()
+    self.db=os.path.join(self.workdir,'evaluations.db')
+
+  def tearDown(self):
+    shutil.rmtree(self.workdir)
+
+  def path(self,name):
+    return os.path.join(self.workdir,name)
+
+  def test_complete(self):
+    """ only evaluations completed with an existing results file are hits """
+    cache=EvalCache(self.db)
+    params=freeParams(fftpl_file,{'FF1':0.417})
+    cache.register(params,psf=self.path('ff_1.psf'))
+    self.assertTrue(cache.lookup(params) is None) # still running
+    self.assertRaises(IOError,cache.complete,params,'1',self.path('results.out.1'))
+    open(self.path('results.out.1'),'w').write('1.0 least_sq_term_1\n')
+    cache.complete(params,'1',self.path('results.out.1'))
+    hit=cache.lookup(freeParams(fftpl_file,{'FF1':0.4170001})) # same within the tolerance of FF1
+    self.assertEqual((hit['tag'],hit['psf']),('1',self.path('ff_1.psf')))
+    self.assertTrue(cache.lookup(freeParams(fftpl_file,{'FF1':0.45})) is None)
+    os.remove(self.path('results.out.1'))
+    self.assertTrue(cache.lookup(params) is None) # results file gone
+    self.assertRaises(KeyError,cache.register,params,results=self.path('results.out.1'))
+    cache.close()
+
+  def ffUpdate(self,tag):
+    """ run ff_update with the evaluation cache, return its exit status and standard output """
+    env=dict(os.environ)
+    env['PYTHONPATH']=os.pathsep.join([src]+[x for x in [env.get('PYTHONPATH')] if x])
+    process=subprocess.Popen([sys.executable,os.path.join(here,'ff_update.py'),'--fftpl',fftpl_file,
+                              '--ffout',self.path('ff_%s.psf'%tag),'--dak',self.path('params.in.%s'%tag),
+                              '--evalcache',self.db],
+                             cwd=self.workdir,env=env,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+    out,err=process.communicate()
+    return process.returncode,out.decode()
+
+  def test_second_evaluation_hits(self):
+    """ an evaluation identical to a previous one, completed by the Dakota driver, is a hit """
+    writeParams(self.path('params.in.1'),0.417)
+    self.assertEqual(self.ffUpdate('1'),(0,'1')) # miss, ff_update reports its own tag
+    self.assertTrue(os.path.isfile(self.path('ff_1.psf')))
+    writeParams(self.path('params.in.2'),0.417)
+    self.assertEqual(self.ffUpdate('2'),(0,'2')) # the first evaluation is not complete yet
+    open(self.path('results.out.1'),'w').write('1.0 least_sq_term_1\n')
+    env=dict(os.environ)
+    env.update({'CAMM_EVALCACHE':self.db, 'CAMM_FFTPL':fftpl_file})
+    env.pop('CAMM_DRIVER',None)
+    env['PATH']=os.path.dirname(sys.executable)+os.pathsep+env.get('PATH','') # python run by the driver
+    self.assertEqual(subprocess.call([driver,self.path('params.in.1'),self.path('results.out.1')],cwd=self.workdir,env=env),0)
+    writeParams(self.path('params.in.3'),0.417)
+    self.assertEqual(self.ffUpdate('3'),(1,'1')) # hit, ff_update reports the tag of the previous evaluation
+    self.assertFalse(os.path.exists(self.path('ff_3.psf'))) # downstream chain skipped
+    writeParams(self.path('params.in.4'),0.45)
+    self.assertEqual(self.ffUpdate('4'),(0,'4'))
+
+if __name__ == "__main__":
+  unittest.main()
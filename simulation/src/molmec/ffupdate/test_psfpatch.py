@@ -0,0 +1,67 @@
+'''
+Checks that patched force fields are byte-identical to full renderings of the template
+
+Uses the template of simulation/test/ce1.psf, with FF1 free and FF2 tied to -2*FF1.
+
+Created on Oct 18, 2026
+'''
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+here=os.path.dirname(os.path.abspath(__file__))
+sys.path[:0]=[here,os.path.join(here,'..','..')] # ff_update, and package molmec
+from ff_update import loadCompiledFFtpl, renderTemplate, resolveParams
+from psfpatch import PSFPatcher, createPatchBase, indexFile, loadPatcher
+
+fftpl_file=os.path.join(here,'..','..','..','test','ce1.xml')
+
+class PSFPatchTest(unittest.TestCase):
+
+  def setUp(self):
+    self.workdir=tempfile.mkdtemp()
+    self.params,self.compiled=loadCompiledFFtpl(fftpl_file)
+    self.basefile=os.path.join(self.workdir,'base.psf')
+    self.patcher=createPatchBase(self.compiled,resolveParams(self.params,{'FF1':0.45}),self.basefile)
+
+  def tearDown(self):
+    shutil.rmtree(self.workdir)
+
+  def render(self,ff1):
+    return renderTemplate(self.compiled,resolveParams(self.params,{'FF1':ff1}))
+
+  def test_base(self):
+    """ the base is the full rendering of the base values, published with its index and no temporary files """
+    self.assertEqual(open(self.basefile,'rb').read(),self.render(0.45).encode('ascii'))
+    self.assertEqual(sorted(os.listdir(self.workdir)),sorted([os.path.basename(self.basefile),os.path.basename(indexFile(self.basefile))]))
+
+  def test_patch(self):
+    """ patched copies are byte-identical to full renderings """
+    outfile=os.path.join(self.workdir,'ff.psf')
+    for ff1 in (0.417,0.3,0.599999,0.4170001,-0.45):
+      self.assertTrue(self.patcher.patch(resolveParams(self.params,{'FF1':ff1}),outfile))
+      self.assertEqual(open(outfile,'rb').read(),self.render(ff1).encode('ascii'))
+
+  def test_fallback(self):
+    """ values wider than their field are not patched, and write renders the whole template """
+    outfile=os.path.join(self.workdir,'ff.psf')
+    values=resolveParams(self.params,{'FF1':-1.0e12})
+    self.assertFalse(self.patcher.patch(values,outfile))
+    self.patcher.write(values,outfile)
+    self.assertEqual(open(outfile,'rb').read(),self.render(-1.0e12).encode('ascii'))
+    self.assertRaises(ValueError,PSFPatcher(self.basefile).write,values,outfile) # no template to render
+
+  def test_reload(self):
+    """ an existing base and index are reused, and recreated if older than the template """
+    self.assertEqual(loadPatcher(self.compiled,{},self.basefile)._offsets,self.patcher._offsets)
+    os.utime(indexFile(self.basefile),(0,0))
+    patcher=loadPatcher(self.compiled,resolveParams(self.params,{'FF1':0.417}),self.basefile,fftpl_file=fftpl_file)
+    self.assertEqual(open(self.basefile,'rb').read(),self.render(0.417).encode('ascii'))
+    outfile=os.path.join(self.workdir,'ff.psf')
+    patcher.write(resolveParams(self.params,{'FF1':0.5}),outfile)
+    self.assertEqual(open(outfile,'rb').read(),self.render(0.5).encode('ascii'))
+
+if __name__ == "__main__":
+  unittest.main()
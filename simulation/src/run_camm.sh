@@ -2,6 +2,6 @@ rm params* results* assembly* fit* Q*psf *log dakota.rst nohup.out
 #pkill dakota
 #pkill opt_driver
 #pkill python
-cp $2/../../dakota/opt* .
+ln -sf "$(cd "$2/../../dakota" && pwd)"/opt* . # links, so that opt_driver finds the scripts it runs
 nohup dakota -i $1 -o dakota.log >/dev/null 2>/dev/null </dev/null  &
 echo $!
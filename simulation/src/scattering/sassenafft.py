@@ -0,0 +1,123 @@
+'''
+Native replacement for Mantid algorithms LoadSassena and SassenaFFT
+
+Transforms the intermediate scattering function I(Q,t) stored in a Sassena
+output file onto the dynamic structure factor S(Q,E), for all Q-vectors with
+a single real FFT. Sassena stores I(Q,t) for t>=0 only. As LoadSassena does,
+the signal is extended to negative times with I(Q,-t)=conj(I(Q,t)), so that
+S(Q,E) is real and defined on 2*nt-1 energies symmetric around zero.
+
+Units follow SassenaFFT: time in picoseconds, energy in meV.
+
+Created on Oct 18, 2026
+'''
+#from pdb import set_trace as trace # uncomment only for debugging purposes
+
+ps2meV=4.136 # from frequency in 1/ps to energy in meV, as in Mantid::SassenaFFT
+K2meV=1.0/11.604 # Boltzmann constant, in meV/K
+
+def loadIQt(filename):
+  """ Load the intermediate scattering function from a Sassena output file
+
+  Arguments:
+    filename: Sassena output file, with datasets qvectors and fqt
+
+  Returns:
+    Q: moduli of the Q-vectors, in increasing order
+    fqt: complex array of shape (nQ, nt), rows ordered as Q
+  """
+  from h5py import File
+  import numpy
+  f=File(filename,'r')
+  qvectors=f['qvectors'][...]
+  fqt=f['fqt'][...] # shape==(nQ,nt,2), real and imaginary parts
+  f.close()
+  Q=numpy.sqrt(numpy.square(qvectors).sum(axis=1))
+  rank=numpy.argsort(Q,kind='mergesort')
+  return Q[rank],fqt[rank,:,0]+1j*fqt[rank,:,1]
+
+def rebinQMatrix(Q,qmin,qwidth,qmax):
+  """ Matrix rebinning the spectra onto bins [qmin+i*qwidth, qmin+(i+1)*qwidth)
+
+  Same as Mantid::Rebin of the transposed I(Q,t), which holds counts as point data:
+  the Q-values are converted to bins with boundaries midway between consecutive
+  values (Mantid::ConvertToHistogram), and each spectrum is added to every Q-bin
+  with the fraction of its own bin overlapping the Q-bin. Spectra are summed, not
+  averaged. Spectra with a Q-value repeated have a bin of zero width, and are
+  added whole to the Q-bin holding their Q-value.
+
+  Uses a scipy.sparse matrix if scipy is available, otherwise a dense numpy array.
+
+  Arguments:
+    Q: Q-value of each spectrum
+    qmin, qwidth, qmax: boundaries and width of the Q-bins, as in Mantid::Rebin
+
+  Returns:
+    R: matrix of shape (nbins, nQ), the rebinned spectra are R*spectra
+    centers: Q-value at the center of each bin
+  """
+  import numpy
+  Q=numpy.asarray(Q,dtype=float)
+  boundaries=numpy.arange(qmin,qmax+0.5*qwidth,qwidth)
+  nbins=len(boundaries)-1
+  edges=numpy.concatenate((Q[:1],(Q[1:]+Q[:-1])/2,Q[-1:])) # bins of the spectra
+  if len(Q)>1:
+    edges[0]-=edges[1]-Q[0]
+    edges[-1]+=Q[-1]-edges[-2]
+  width=edges[1:]-edges[:-1]
+  overlap=numpy.minimum(edges[1:],boundaries[1:,numpy.newaxis])-numpy.maximum(edges[:-1],boundaries[:-1,numpy.newaxis])
+  R=numpy.where(width>0,numpy.clip(overlap,0.0,None)/numpy.where(width>0,width,1.0),0.0)
+  ibin=numpy.searchsorted(boundaries,Q,side='right')-1
+  point=numpy.nonzero((width==0)&(ibin>=0)&(ibin<nbins))[0]
+  R[ibin[point],point]=1.0
+  try:
+    from scipy.sparse import csr_matrix
+    R=csr_matrix(R)
+  except ImportError:
+    pass
+  return R,(boundaries[1:]+boundaries[:-1])/2
+
+def sassenaFFT(fqt,timeunit=1.0,onlyReal=False,detailedBalance=False,temp=300.0):
+  """ Fourier transform I(Q,t) onto S(Q,E), all spectra at once
+
+  Arguments:
+    fqt: complex array of shape (nQ, nt), I(Q,t) for t=0, timeunit, 2*timeunit,...
+    [timeunit]: time between consecutive frames, in picoseconds (TimeUnit of LoadSassena)
+    [onlyReal]: transform only the real part of I(Q,t) (FFTonlyRealPart of SassenaFFT)
+    [detailedBalance]: multiply S(Q,E) by exp(E/(2kT)) (DetailedBalance of SassenaFFT, which applies
+                       ExponentialCorrection C0*exp(-C1*E) with C0=1 and C1=-1/(2kT))
+    [temp]: temperature in Kelvin, for the detailed balance (Temp of SassenaFFT)
+
+  Returns:
+    E: energies, in meV, shape (2*nt-1,)
+    sqe: S(Q,E), real array of shape (nQ, 2*nt-1)
+  """
+  import numpy
+  fqt=numpy.atleast_2d(fqt)
+  if onlyReal: fqt=fqt.real
+  n=2*fqt.shape[1]-1 # symmetric in time, I(Q,-t)=conj(I(Q,t))
+  sqe=numpy.fft.fftshift(numpy.fft.hfft(fqt,n,axis=1),axes=1)*(timeunit/ps2meV)
+  E=numpy.fft.fftshift(numpy.fft.fftfreq(n,timeunit))*ps2meV
+  if detailedBalance:
+    sqe*=numpy.exp(E/(2*temp*K2meV))
+  return E,sqe
+
+def genSQE(filename,rebinQ=None,timeunit=1.0,onlyReal=False,detailedBalance=False,temp=300.0):
+  """ S(Q,E) from a Sassena output file, without Mantid
+
+  Arguments:
+    filename: Sassena output file
+    [rebinQ]: (qmin, qwidth, qmax) to rebin in Q before the transform
+    other arguments: see sassenaFFT
+
+  Returns:
+    Q: Q-value of each spectrum
+    E: energies, in meV
+    sqe: S(Q,E), array of shape (nQ, nE)
+  """
+  Q,fqt=loadIQt(filename)
+  if rebinQ:
+    R,Q=rebinQMatrix(Q,*rebinQ)
+    fqt=R.dot(fqt) # transform is linear, rebin first as there are fewer spectra
+  E,sqe=sassenaFFT(fqt,timeunit=timeunit,onlyReal=onlyReal,detailedBalance=detailedBalance,temp=temp)
+  return Q,E,sqe
@@ -6,6 +6,9 @@ Created on Mar 8, 2013
 
 #from pdb import set_trace as trace # uncomment only for debugging purposes
 import os
+if __name__ == '__main__':
+  from kernel.worker import forward
+  forward(__file__) # run the service in the persistent worker, if one is listening, before importing Mantid
 import mantid.simpleapi as mti
 
 sassexec=None
@@ -65,12 +68,7 @@ def setCatDCD(filepath=None):
 
 def hasVersion(filename):
   """Check filename as sassena version"""
-  from h5py import File
-  f = File(filename,'r')
-  value=False
-  if 'sassena_version' in f.attrs.keys(): value=True
-  f.close()
-  return value
+  return inspectSassena(filename)['version'] is not None
 
 def addVersionStamp(filename,stamp):
   """ Insert stamp as version attribute in and HDF5 file. """
@@ -79,6 +77,33 @@ def addVersionStamp(filename,stamp):
   f.attrs['sassena_version']=stamp
   f.close()
 
+def inspectSassena(filename):
+  """ Inspect a Sassena output file, opening it only once
+
+  Arguments:
+    filename: a Sassena output file
+
+  Returns:
+    dictionary with keys
+      'qvectors': array of shape (nvectors,3)
+      'moduli': modulus of each Q-vector
+      'rank': permutation ordering the Q-vectors by increasing modulus, see qmodulusPermutation
+      'ordered': True if Q-vectors are ordered by increasing modulus
+      'datasets': dictionary of (shape, dtype) for each dataset
+      'version': value of the sassena_version attribute, or None
+  """
+  from h5py import File
+  import numpy
+  f=File(filename,'r')
+  info={'datasets':dict([(name,(f[name].shape,f[name].dtype)) for name in f.keys()]),
+        'version':f.attrs.get('sassena_version',None), 'qvectors':f['qvectors'][...]}
+  f.close()
+  moduli2=numpy.square(info['qvectors']).sum(axis=1) # moduli-squared of the Q-vectors
+  info['moduli']=numpy.sqrt(moduli2)
+  info['ordered']=bool(numpy.all(numpy.diff(moduli2)>=0))
+  info['rank']=qmodulusPermutation(info['qvectors'])
+  return info
+
 def isOrderedByQmodulus(filename):
   """ Check list of structure factors is ordered by increasing modulus of momentum transfer
 
@@ -89,45 +114,206 @@ def isOrderedByQmodulus(filename):
    True if qvectors dataset is ordered by increasing modulus of
         momentum transfer. Otherwise returns False
   """
+  return inspectSassena(filename)['ordered']
+
+def qmodulusPermutation(qvectors):
+  """ Permutation ordering Q-vectors by increasing modulus. Stable, ties keep their order
+
+  Arguments:
+    qvectors: array of shape (nvectors,3)
+
+  Returns:
+    rank: integer array, rank[i] is the index of the Q-vector going to position i
+  """
+  import numpy
+  moduli=numpy.square(numpy.asarray(qvectors)).sum(axis=1) # moduli-squared of the Q-vectors
+  return numpy.argsort(moduli,kind='mergesort') # rank from smallest to greatest
+
+def _copyPermuted(source,target,rank,blockbytes):
+  """ Copy dataset source onto new dataset target with rows permuted, target[i]=source[rank[i]].
+  Rows are copied in blocks of about blockbytes bytes, so memory use is bounded """
+  import numpy
+  nrows=source.shape[0]
+  rowbytes=max(1,source.dtype.itemsize*int(numpy.prod(source.shape[1:])))
+  nblock=max(1,blockbytes//rowbytes)
+  for start in range(0,nrows,nblock):
+    rows=rank[start:start+nblock]
+    order=numpy.argsort(rows) # HDF5 selections need increasing indexes
+    data=source[rows[order].tolist()]
+    block=numpy.empty_like(data)
+    block[order]=data
+    target[start:start+len(rows)]=block
+
+def orderByQmodulus(filename,outfile=None,mode='reorder',blockbytes=64*1024*1024,rank=None):
+  """ Sassena does not enforce any ordering of the structure factors.
+  Here we order by increasing value of modulus of Q-vectors.
+
+  Arguments:
+    filename: a Sassena output file
+    [outfile]: output file. If None, filename is overwritten
+    [mode]: 'reorder' physically reorders the rows of datasets qvectors, fqt, fq, fq0 and fq2,
+            streaming blocks of rows. 'permutation' leaves the rows untouched and stores
+            the permutation in dataset 'qpermutation', see readByQmodulus.
+    [blockbytes]: approximate size of the blocks of rows read at once, in 'reorder' mode
+    [rank]: the permutation, if already known from inspectSassena
+
+  Returns:
+    rank: the permutation, rank[i] is the index of the Q-vector going to position i
+  """
   from h5py import File
+  from tempfile import mkstemp
   import numpy
+  import shutil
+  if mode not in ('reorder','permutation'):
+    raise ValueError('mode must be one of "reorder" or "permutation". Found: %s'%mode)
+  if rank is None:
+    f=File(filename,'r')
+    rank=qmodulusPermutation(f['qvectors'][...])
+    f.close()
+  if outfile and os.path.abspath(outfile)!=os.path.abspath(filename):
+    target=outfile
+  else:
+    target=filename
+  if numpy.array_equal(rank,numpy.arange(len(rank))): # already ordered, nothing to do
+    if target!=filename: shutil.copyfile(filename,target)
+    return rank
+  if mode=='permutation':
+    if target!=filename: shutil.copyfile(filename,target)
+    g=File(target,'r+')
+    if 'qpermutation' in g.keys(): del g['qpermutation']
+    g['qpermutation']=rank
+    g.close()
+    return rank
+  # write onto a temporary file in the same directory, then rename onto the target
+  handle,tmpfile=mkstemp(dir=os.path.dirname(os.path.abspath(target)),suffix='.h5')
+  os.close(handle)
   f=File(filename,'r')
-  ds_q = numpy.array(f["qvectors"]) # shape==(nvectors,3)
+  g=File(tmpfile,'w')
+  for dset in f.keys():
+    if dset in ('qvectors', 'fqt', 'fq', 'fq0', 'fq2'):
+      x=f[dset]
+      y=g.create_dataset(dset,shape=x.shape,dtype=x.dtype)
+      _copyPermuted(x,y,rank,blockbytes)
+      for key,val in x.attrs.items(): y.attrs[key]=val
+    elif dset!='qpermutation':
+      f.copy(dset,g) # not indexed by Q-vector
+  for key,val in f.attrs.items(): g.attrs[key]=val
+  g.close()
   f.close()
-  moduli=numpy.square(ds_q).sum(axis=1) # moduli-squared of the Q-vectors
-  return all(x<=y for x, y in zip(moduli, moduli[1:]))
+  shutil.copymode(target if os.path.exists(target) else filename,tmpfile) # mkstemp creates it private
+  os.rename(tmpfile,target)
+  return rank
 
-def orderByQmodulus(filename,outfile=None):
-  """ Sassena does not enforce any ordering of the structure factors.
-  Here we order by increasing value of modulus of Q-vectors. """
+def readByQmodulus(filename,dset):
+  """ Read a dataset with rows ordered by increasing modulus of Q-vectors, reading
+  through dataset 'qpermutation' if orderByQmodulus was invoked with mode='permutation'
+
+  Arguments:
+    filename: a Sassena output file
+    dset: name of the dataset, e.g. 'fq0'
+
+  Returns:
+    numpy array
+  """
+  from h5py import File
+  f=File(filename,'r')
+  x=f[dset][...]
+  if 'qpermutation' in f.keys(): x=x[f['qpermutation'][...]]
+  f.close()
+  return x
+
+def _readPermutedBlock(task):
+  """ Read rows rank[start:stop] of a dataset. Run by the worker processes of sumSassena
+
+  Arguments:
+    task: tuple (filename, dataset name, rank, start, stop)
+
+  Returns:
+    (dataset name, start, array of rows)
+  """
   from h5py import File
   import numpy
+  filename,dset,rank,start,stop=task
+  rows=rank[start:stop]
+  order=numpy.argsort(rows) # HDF5 selections need increasing indexes
   f=File(filename,'r')
-  overwrite=False
-  if not outfile:
-    outfile=tempfile() # temporaty output file
-    overwrite=True
+  data=f[dset][rows[order].tolist()]
+  f.close()
+  block=numpy.empty_like(data)
+  block[order]=data
+  return dset,start,block
+
+def sumSassena(hdfs,outfile,nprocs=None,blockbytes=64*1024*1024,infos=None):
+  """ Sum the structure factors of several Sassena output files onto a single file
+
+  Datasets fq0, fqt, fq and fq2 are read directly with h5py, in blocks of Q-vectors
+  distributed to a pool of processes, and added onto one preallocated accumulator
+  per dataset. Rows are ordered by increasing modulus of the Q-vectors. Files with
+  Q-vectors different than those of the first file are skipped.
+
+  The pool processes are forked from this process, with Mantid already loaded, and
+  use only h5py and numpy. Within the persistent worker (see kernel.worker) the
+  blocks are read in this process instead, so the worker and its socket are not forked.
+
+  Arguments:
+    hdfs: list of Sassena output files
+    outfile: output Sassena file containing the sum
+    [nprocs]: number of worker processes. Default is the number of cores, or one
+              within the persistent worker
+    [blockbytes]: approximate size of the blocks of rows read by each task
+    [infos]: list of outputs of inspectSassena for hdfs, if already available
+
+  Returns:
+    list of the files that were summed
+  """
+  import sys
+  from h5py import File
+  from multiprocessing import Pool, cpu_count
+  import numpy
+  infos=infos or [inspectSassena(hdf) for hdf in hdfs]
+  first=infos[0]
+  qvectors=first['qvectors'][first['rank']] # Q-vectors once sorted
+  summed=[]
+  tasks=[]
+  dsets=[dset for dset in ('fq0','fqt','fq','fq2') if dset in first['datasets']]
+  for hdf,info in zip(hdfs,infos):
+    if not numpy.array_equal(qvectors,info['qvectors'][info['rank']]):
+      print 'Workspaces do not match, skipping %s'%hdf
+      continue
+    summed.append(hdf)
+    for dset in dsets:
+      shape,dtype=info['datasets'][dset]
+      rowbytes=max(1,numpy.dtype(dtype).itemsize*int(numpy.prod(shape[1:])))
+      nblock=max(1,blockbytes//rowbytes)
+      for start in range(0,shape[0],nblock):
+        tasks.append((hdf,dset,info['rank'],start,min(start+nblock,shape[0])))
+  accumulator=dict([(dset,numpy.zeros(*first['datasets'][dset])) for dset in dsets])
+  worker=sys.modules.get('kernel.worker')
+  if worker is not None and worker.inWorker: nprocs=1
+  nprocs=min(nprocs or cpu_count(),len(tasks)) or 1
+  if nprocs>1:
+    pool=Pool(nprocs)
+    try:
+      for dset,start,block in pool.imap_unordered(_readPermutedBlock,tasks):
+        accumulator[dset][start:start+len(block)]+=block
+      pool.close()
+    finally:
+      pool.terminate() # no-op once closed and drained, kills the processes on error
+      pool.join()
+  else:
+    for task in tasks:
+      dset,start,block=_readPermutedBlock(task)
+      accumulator[dset][start:start+len(block)]+=block
+  f=File(hdfs[0],'r')
   g=File(outfile,'w')
-  ds_q = numpy.array(f["qvectors"]) # shape==(nvectors,3)
-  moduli=numpy.square(ds_q).sum(axis=1) # moduli-squared of the Q-vectors
-  rank=numpy.argsort(moduli) # rank from smallest to greatest
-  for dset in ('qvectors', 'fqt', 'fq', 'fq0', 'fq2'):
-    if dset in f.keys(): 
-      x=numpy.array(f[dset])
-      if not outfile:
-        del f[dset]
-        f[dset]=x[rank]
-      else:
-        g[dset]=x[rank]
+  g['qvectors']=qvectors
+  for dset in dsets: g[dset]=accumulator[dset]
   for key,val in f.attrs.items(): g.attrs[key]=val
   g.close()
   f.close()
-  if overwrite:
-    os.system('/bin/mv %s %s'%(outfile,filename))
-  return None
-
+  return summed
 
-def sortQvectors(hdfile, args):
+def sortQvectors(hdfile, args, info=None):
   """Sort rows by Qvector modulus
 
   If python version < 2.7, then use Mantid algorithm
@@ -137,6 +323,7 @@ def sortQvectors(hdfile, args):
   Arguments:
    hdfile (string) HDF5 file
    args  (dictionary) extra arguments for LoadSassena algorithm
+   info  (dictionary) output of inspectSassena(hdfile), if already available
 
   Returns:
    ws (mantid group workspace) Workspace holding the contents of the HDF5 file
@@ -146,7 +333,8 @@ def sortQvectors(hdfile, args):
     ws = mti.LoadSassena( Filename=hdfile, **args )
     mti.SortByQVectors(ws)
   else:
-    if not isOrderedByQmodulus(hdfile): orderByQmodulus(hdfile)
+    info=info or inspectSassena(hdfile)
+    if not info['ordered']: orderByQmodulus(hdfile,rank=info['rank'])
     ws = mti.LoadSassena( Filename=hdfile, **args )
   return ws
 
@@ -313,7 +501,7 @@ def calculateIQ(qlist, pdbfile):
   os.system('/bin/rm -rf '+workdir)
   return mti.mtd['inc'],mti.mtd['coh']
 
-def genSQE(hdfname,nxsname,wsname=None,indexes=[],rebinQ=None,scale=1.0, **kwargs):
+def genSQE(hdfname,nxsname,wsname=None,indexes=[],rebinQ=None,scale=1.0,nprocs=None,nativeFFT=False, **kwargs):
   """ Generate S(Q,E)
 
   Loads Sassena output (HDF5 files) and generates a Nexus file containing
@@ -331,6 +519,9 @@ def genSQE(hdfname,nxsname,wsname=None,indexes=[],rebinQ=None,scale=1.0, **kwarg
     [indexes]:  save only spectra with indexes given by indexes list. If indexes is empty,
                  all spectra are saved.
     [scale]:    multipy the generated S(Q,E) by this scaling factor
+    [nprocs]:   number of processes reading the sassena output files, if more than one. See sumSassena
+    [nativeFFT]: compute S(Q,E) with numpy instead of Mantid algorithms LoadSassena and SassenaFFT.
+                 Options TimeUnit, FFTonlyRealPart, DetailedBalance and Temp are honored. See sassenafft module
     [**kwargs]: extra options for the Mantid algorithms producing S(Q,E). For
                 example:
                 kwargs={'LoadSassena':{'TimeUnit':0.1,},
@@ -346,6 +537,7 @@ def genSQE(hdfname,nxsname,wsname=None,indexes=[],rebinQ=None,scale=1.0, **kwarg
             |_rootname_fqt.Re
             |_rootname_fqt.Im
             |_rootname_sqw
+    If nativeFFT, only the S(Q,E) workspace rootname_sqw
 
   Raises:
     None
@@ -357,25 +549,37 @@ def genSQE(hdfname,nxsname,wsname=None,indexes=[],rebinQ=None,scale=1.0, **kwarg
   algs_opt=locals()['kwargs']
   hdfs=hdfname.split() # list of sassena output files serving as input
   sassopt=findopts('LoadSassena',algs_opt).copy(); sassopt.update({'OutputWorkspace':wsname})
-  ws = sortQvectors( hdfs[0], sassopt)
-
-  if len(hdfs)>1: # add remaining sassena output files
-    for hdf in hdfs[1:]:
-      ws1 = sortQvectors( hdf, findopts('LoadSassena',algs_opt) )
-      if mti.CheckWorkspacesMatch(Workspace1=wsname+'_qvectors',Workspace2=ws1.getName()+'_qvectors'):
-        for wstype in ('_fq0','_fqt.Re','_fqt.Im'):
-          mti.Plus(LHSWorkspace=wsname+wstype,RHSWorkspace=ws1.getName()+wstype,OutputWorkspace=wsname+wstype)
-      else:
-        print 'Workspaces do not match'
-
-  if rebinQ: # rebin in Q space
-    rebinQ=','.join(rebinQ.split()) #substitute separators, from space to comma
-    mti.Rebin(InputWorkspace=wsname+'_fq0',Params=rebinQ,OutputWorkspace=wsname+'_fq0')
-    for wstype in ('_fqt.Re','_fqt.Im'):
-      mti.Transpose(InputWorkspace=wsname+wstype,OutputWorkspace=wsname+wstype)
-      mti.Rebin(InputWorkspace=wsname+wstype,Params=rebinQ,OutputWorkspace=wsname+wstype)
-      mti.Transpose(InputWorkspace=wsname+wstype,OutputWorkspace=wsname+wstype)
-  mti.SassenaFFT(ws,**findopts('SassenaFFT',algs_opt))
+  hdf=hdfs[0]
+  if len(hdfs)>1: # sum all sassena output files, then load the sum only
+    from tempfile import mkstemp
+    handle,hdf=mkstemp(dir=os.path.dirname(os.path.abspath(nxsname)),suffix='.h5')
+    os.close(handle)
+  try:
+    if len(hdfs)>1: sumSassena(hdfs,hdf,nprocs=nprocs)
+
+    if nativeFFT: # S(Q,E) with numpy, see sassenafft module
+      from sassenafft import genSQE as nativeSQE
+      from mantidhelper.algorithm import toBool
+      import numpy
+      fftopt=findopts('SassenaFFT',algs_opt)
+      if rebinQ: rebinQ=[float(x) for x in rebinQ.replace(',',' ').split()]
+      Q,E,sqe=nativeSQE(hdf, rebinQ=rebinQ, timeunit=float(sassopt.get('TimeUnit',1.0)),
+                        onlyReal=toBool(fftopt.get('FFTonlyRealPart',False)), detailedBalance=toBool(fftopt.get('DetailedBalance',False)),
+                        temp=float(fftopt.get('Temp',300.0)))
+      ws=mti.CreateWorkspace(DataX=numpy.tile(E,len(Q)), DataY=sqe.ravel(), NSpec=len(Q), UnitX='DeltaE',
+                             VerticalAxisUnit='MomentumTransfer', VerticalAxisValues=Q, OutputWorkspace=wsname+'_sqw')
+    else:
+      ws = sortQvectors( hdf, sassopt)
+      if rebinQ: # rebin in Q space
+        rebinQ=','.join(rebinQ.split()) #substitute separators, from space to comma
+        mti.Rebin(InputWorkspace=wsname+'_fq0',Params=rebinQ,OutputWorkspace=wsname+'_fq0')
+        for wstype in ('_fqt.Re','_fqt.Im'):
+          mti.Transpose(InputWorkspace=wsname+wstype,OutputWorkspace=wsname+wstype)
+          mti.Rebin(InputWorkspace=wsname+wstype,Params=rebinQ,OutputWorkspace=wsname+wstype)
+          mti.Transpose(InputWorkspace=wsname+wstype,OutputWorkspace=wsname+wstype)
+      mti.SassenaFFT(ws,**findopts('SassenaFFT',algs_opt))
+  finally:
+    if len(hdfs)>1: os.remove(hdf) # temporary sum
   wss=wsname+'_sqw'
 
   if 'NormaliseToUnity' in algs_opt.keys():
@@ -419,6 +623,8 @@ if __name__ == '__main__':
     p.add_argument('--indexes',          help='space separated list of workspace indexes to keep. Example: --indexes "2 4 6 8". If not declared, all indexes are kept')
     p.add_argument('--rebinQ',           help='useful when reported experimental S(Q,E) was obtained integrating over different [Q-dQ,Q+dQ] ranges. Format is "Qmin Qwidth Qmax".')
     p.add_argument('--scale',            help='scale S(Q,E) by this factor. Default=1.0',default=1.0,type=float)
+    p.add_argument('--nprocs',           help='number of processes reading the sassena output files, if more than one. Default is the number of cores',type=int)
+    p.add_argument('--nativeFFT',        help='compute S(Q,E) with numpy instead of Mantid algorithms LoadSassena and SassenaFFT',action='store_true')
     p.add_argument('--LoadSassena',      help='certain arguments for the algorithm. Example --LoadSassena="TimeUnit:0.1"')
     p.add_argument('--SassenaFFT',       help='certain arguments for the algorithm. Example: --SassenaFFT="FTTonlyRealPart:True,DetailedBalance:True,Temp:290"')
     p.add_argument('--NormaliseToUnity', help='certain arguments for the algorithm. Example: --NormaliseToUnity="RangeLower:-50.0,RangeUpper:50.0"')
@@ -430,7 +636,7 @@ if __name__ == '__main__':
       args=p.parse_args()
       indexes=[]
       if args.indexes: indexes=[int(i) for i in args.indexes.split()]
-      genSQE(args.hdfname, args.nxsname, wsname=args.wsname, indexes=indexes, rebinQ=args.rebinQ, scale=args.scale,
+      genSQE(args.hdfname, args.nxsname, wsname=args.wsname, indexes=indexes, rebinQ=args.rebinQ, scale=args.scale, nprocs=args.nprocs, nativeFFT=args.nativeFFT,
              LoadSassena=getDictFromArgparse('LoadSassena',args),
              SassenaFFT=getDictFromArgparse('SassenaFFT',args),
              SaveNexus=getDictFromArgparse('SaveNexus',args),
@@ -0,0 +1,92 @@
+'''
+Parity of the native S(Q,E) with Mantid algorithms LoadSassena and SassenaFFT
+
+The simulated.nxs files of the LiCl test data were produced by genSQE with LoadSassena
+and SassenaFFT (FFTonlyRealPart, no DetailedBalance, no rebinning in Q) from the fqt.hd5
+file in the same directory, then ConvertToHistogram, NormaliseToUnity in [-0.05, 0.05]
+and prunespectra keeping workspace indexes 2, 4, 6 and 8 (see the processing history
+stored in the files). NormaliseToUnity removes the absolute scale of S(Q,E), which is
+checked instead against the integral over energies. Options not covered by the saved
+files are checked against the definitions of the Mantid algorithms.
+
+Created on Oct 18, 2026
+'''
+import os
+import sys
+import glob
+import unittest
+import numpy
+
+here=os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0,here)
+from sassenafft import K2meV, ps2meV, genSQE, loadIQt, rebinQMatrix, sassenaFFT
+
+simdata=os.path.join(here,'..','..','test','LiCl','simdata')
+
+def loadNexus(filename):
+  """ bin boundaries and values of the Workspace2D stored in a Mantid processed Nexus file """
+  from h5py import File
+  f=File(filename,'r')
+  x=f['mantid_workspace_1/workspace/axis1'][...]
+  y=f['mantid_workspace_1/workspace/values'][...]
+  f.close()
+  return x,y
+
+class SavedOutputTest(unittest.TestCase):
+
+  def test_parity(self):
+    """ same energies and same S(Q,E), up to the normalization, as the saved Mantid output """
+    directories=[os.path.dirname(x) for x in sorted(glob.glob(os.path.join(simdata,'*','T290','production','fqt.hd5')))]
+    self.assertTrue(directories)
+    for directory in directories:
+      x,y=loadNexus(os.path.join(directory,'simulated.nxs'))
+      Q,E,sqe=genSQE(os.path.join(directory,'fqt.hd5'),onlyReal=True)
+      boundaries=numpy.concatenate(([1.5*E[0]-0.5*E[1]],(E[1:]+E[:-1])/2,[1.5*E[-1]-0.5*E[-2]])) # ConvertToHistogram
+      numpy.testing.assert_allclose(boundaries,x,rtol=0,atol=1e-9)
+      inrange=(x[:-1]>=-0.05)&(x[1:]<=0.05) # NormaliseToUnity, without partial bins
+      sqe=sqe/sqe[:,inrange].sum()
+      numpy.testing.assert_allclose(sqe[[2,4,6,8]],y,rtol=0,atol=1e-6*y.max())
+
+  def test_normalization(self):
+    """ S(Q,E) is a density per meV, its integral over energies is I(Q,t=0) """
+    Q,fqt=loadIQt(os.path.join(simdata,'Q32','T290','production','fqt.hd5'))
+    for timeunit in (1.0,0.5):
+      E,sqe=sassenaFFT(fqt,timeunit=timeunit,onlyReal=True)
+      self.assertAlmostEqual(E[1]-E[0],ps2meV/(timeunit*len(E)))
+      numpy.testing.assert_allclose(sqe.sum(axis=1)*(E[1]-E[0]),fqt[:,0].real,rtol=1e-10)
+
+class DefinitionTest(unittest.TestCase):
+
+  def test_energy_sign(self):
+    """ I(Q,t)=exp(-i*w*t) has all its spectral weight at E=-w, in meV """
+    nt=64
+    frequency=5.0/(2*nt-1) # in 1/ps, on the grid of frequencies
+    t=numpy.arange(nt)
+    E,sqe=sassenaFFT(numpy.exp(-2j*numpy.pi*frequency*t))
+    self.assertAlmostEqual(E[numpy.argmax(sqe[0])],-frequency*ps2meV)
+
+  def test_detailed_balance(self):
+    """ SassenaFFT multiplies by ExponentialCorrection C0*exp(-C1*E), with C0=1 and C1=-1/(2kT) """
+    Q,fqt=loadIQt(os.path.join(simdata,'Q32','T290','production','fqt.hd5'))
+    temp=290.0
+    E,classical=sassenaFFT(fqt,onlyReal=True)
+    E,quantum=sassenaFFT(fqt,onlyReal=True,detailedBalance=True,temp=temp)
+    C0,C1=1.0,-1.0/(2*temp*K2meV)
+    numpy.testing.assert_allclose(quantum,classical*C0*numpy.exp(-C1*E),rtol=1e-12)
+    # energy gain of the sample, E>0, is more likely: S(Q,E)=exp(E/kT)*S(Q,-E)
+    numpy.testing.assert_allclose(quantum,quantum[:,::-1]*numpy.exp(E/(temp*K2meV)),rtol=1e-6)
+
+  def test_rebinQ(self):
+    """ as Mantid::Rebin of point data, spectra are summed with the overlap of their bins, not averaged """
+    Q=numpy.arange(1,11)*0.1
+    R,centers=rebinQMatrix(Q,0.4,0.2,1.0)
+    R=R.toarray() if hasattr(R,'toarray') else R
+    numpy.testing.assert_allclose(centers,[0.5,0.7,0.9])
+    numpy.testing.assert_allclose(R.dot(numpy.ones(len(Q))),[2.0,2.0,2.0]) # twice the width of the Q-spacing
+    numpy.testing.assert_allclose(R[0],[0,0,0,0.5,1,0.5,0,0,0,0],atol=1e-12) # Q-bin [0.4,0.6) shares 0.4 and 0.6
+    Qbins,E,sqe=genSQE(os.path.join(simdata,'Q32','T290','production','fqt.hd5'),rebinQ=(0.4,0.2,1.0),onlyReal=True)
+    Q,E,unbinned=genSQE(os.path.join(simdata,'Q32','T290','production','fqt.hd5'),onlyReal=True)
+    numpy.testing.assert_allclose(sqe,R.dot(unbinned),rtol=1e-6) # rebin commutes with the transform, up to single precision of I(Q,t)
+
+if __name__ == "__main__":
+  unittest.main()